@@ -7,10 +7,10 @@ import shutil
 import numpy as np
 from ast import literal_eval
 import matplotlib.pyplot as plt
-from multiprocessing import Process
 
 from pyPSCF import pyPSCF
 from pyPSCF.BackTrajHysplit import *
+from pyPSCF.background import BackgroundJob
 
 import time
 
@@ -1330,20 +1330,44 @@ class MainFrame(Frame):
                           text="About",
                           sticky=N+E+S+W)
 
+        # ===== Progress ====================================================
+        self.job = None
+        self.status_frame = Frame(self)
+        self.status_frame.grid(row=2,
+                               column=0,
+                               sticky=E+W)
+        self.progressbar = Progressbar(self.status_frame,
+                                       orient=HORIZONTAL,
+                                       mode="determinate")
+        self.progressbar.pack(side=LEFT, fill=X, expand=True, padx=5, pady=5)
+        self.status = StringVar()
+        self.status.set("Ready")
+        self.status_label = Label(self.status_frame,
+                                  textvariable=self.status,
+                                  width=45)
+        self.status_label.pack(side=LEFT, padx=5, pady=5)
+        self.cancel_button = Button(self.status_frame,
+                                    text="Cancel",
+                                    state=DISABLED,
+                                    command=self.on_cancel)
+        self.cancel_button.pack(side=RIGHT, padx=5, pady=5)
+
         # ===== Text ========================================================
-        # self.text = tkst.ScrolledText(self,
-        #                              wrap="word",
-        #                               width  = 200,
-        #                               height = 10)
-        # self.text.grid(row=2,
-        #                column=0,
-        #               sticky=N+E+S+W)
-        # self.text.tag_configure("stderr", foreground="#b22222")
+        self.text = tkst.ScrolledText(self,
+                                      wrap="word",
+                                      width  = 100,
+                                      height = 8,
+                                      state=DISABLED)
+        self.text.grid(row=3,
+                       column=0,
+                       sticky=N+E+S+W)
+        self.text.tag_configure("stderr", foreground="#b22222")
 
         self.columnconfigure(0, weight=10)
         self.rowconfigure(0, weight=10)
         self.rowconfigure(1, weight=10)
-        self.rowconfigure(2, weight=10)
+        self.rowconfigure(2, weight=1)
+        self.rowconfigure(3, weight=10)
 
         # this allows using the mouse wheel even on the disabled Text widget
         # without the need to clic on said widget
@@ -1376,6 +1400,70 @@ class MainFrame(Frame):
         elif active_tab == 1:
             self.PSCF_tab.on_save()
 
+    def log(self, message, tag="stdout"):
+        TextRedirector(self.text, tag).write(message+"\n")
+        self.text.see(END)
+
+    def start_job(self, name, job, on_done):
+        """Run a BackgroundJob and follow it with `after` until it ends.
+
+        `on_done` is called with the result of the job, in the GUI thread.
+        """
+        if self.job is not None:
+            showinfo("Busy", "A computation is already running.")
+            return
+        self.job = job
+        self.job_name = name
+        self.job_done = on_done
+        self.progressbar.configure(value=0, maximum=1)
+        self.status.set(name+" starts...")
+        self.log(name+" starts...")
+        self.run_button.configure(state=DISABLED)
+        self.cancel_button.configure(state=NORMAL)
+        job.start()
+        self.after(200, self.poll_job)
+
+    def poll_job(self):
+        """Show the events of the running job."""
+        job = self.job
+        for kind, value in job.events():
+            if kind == "progress":
+                eta = "?"
+                if value["eta"] is not None:
+                    eta = time.strftime("%H:%M:%S", time.gmtime(value["eta"]))
+                self.progressbar.configure(value=value["done"],
+                                           maximum=max(value["total"], 1))
+                self.status.set("{}: {}/{} ({:.1f}/s), ETA {}".format(
+                    self.job_name, value["done"], value["total"],
+                    value["rate"], eta))
+            elif kind == "done":
+                self.end_job(self.job_name+" done.")
+                self.job_done(value)
+                return
+            elif kind == "error":
+                self.end_job(self.job_name+" failed.")
+                self.log(value, "stderr")
+                showerror("Error", "{} failed:\n{}".format(
+                    self.job_name, value.strip().splitlines()[-1]))
+                return
+            elif kind == "cancelled":
+                self.end_job(self.job_name+" cancelled.")
+                return
+        self.after(200, self.poll_job)
+
+    def end_job(self, message):
+        self.job = None
+        self.status.set(message)
+        self.log(message)
+        self.run_button.configure(state=NORMAL)
+        self.cancel_button.configure(state=DISABLED)
+
+    def on_cancel(self):
+        if self.job is not None:
+            self.job.cancel()
+            self.status.set(self.job_name+": cancelling...")
+            self.cancel_button.configure(state=DISABLED)
+
 
 
 
@@ -1392,45 +1480,51 @@ class MainFrame(Frame):
         # change tab
         # self.notebook.select(2)
         print("PSCF starts... Please wait.")
-        for specie in range(len(param["species"])):
-            args = dict(
-                station=param["station"],
-                specie=param["species"][specie],
-                lat0=self.PSCF_tab.locStation[param["station"]][0],
-                lon0=self.PSCF_tab.locStation[param["station"]][1],
-                folder=param["dirBackTraj"],
-                prefix=param["prefix"],
-                add_hour=json2arr(param["add_hour"], np.float),
-                resQuality=param["resQuality"],
-                percentile=json2arr(param["percentile"], np.float),
-                threshold=json2arr(param["threshold"], np.float),
-                concFile=param["Cfile"],
-                dateMin=param["dateMin"],
-                dateMax=param["dateMax"],
-                wfunc=param["wF"],
-                wfunc_type="manual" if param["wFmanual"] else "auto",
-                smoothplot=param["smoothplot"],
-                mapMinMax=param["mapMinMax"],
-                cutWithRain=param["cutWithRain"],
-                hourinthepast=param["backTraj"],
-                plotBT=param["plotBT"],
-                plotPolar=param["plotPolar"],
-                pd_kwarg={"sep": ";"}
-            )
-            for var in ["threshold", "percentile"]:
-                if (len(param["species"])>1) & (len(args[var])>1):
-                    args[var] = args[var][specie]
-                else:
-                    args[var] = args[var][0]
-            if param["percentileBool"]:
-                args["threshold"] = None
-            else:
-                args["percentile"] = None
+        args = dict(
+            station=param["station"],
+            species=param["species"],
+            lat0=self.PSCF_tab.locStation[param["station"]][0],
+            lon0=self.PSCF_tab.locStation[param["station"]][1],
+            folder=param["dirBackTraj"],
+            prefix=param["prefix"],
+            add_hour=json2arr(param["add_hour"], float),
+            resQuality=param["resQuality"],
+            concFile=param["Cfile"],
+            dateMin=param["dateMin"],
+            dateMax=param["dateMax"],
+            wfunc=param["wF"],
+            wfunc_type="manual" if param["wFmanual"] else "auto",
+            wFlim=[float(v) for v in param["wFlim"]],
+            wFval=[float(v) for v in param["wFval"]],
+            smoothplot=param["smoothplot"],
+            mapMinMax=param["mapMinMax"],
+            cutWithRain=param["cutWithRain"],
+            hourinthepast=param["backTraj"],
+            plotBT=param["plotBT"],
+            plotPolar=param["plotPolar"],
+            pd_kwarg={"sep": ";"}
+        )
+        # one threshold per specie, or the first one for all of them
+        var = "percentile" if param["percentileBool"] else "threshold"
+        values = json2arr(param[var], float)
+        if (len(param["species"])>1) & (len(values)>1):
+            values = values[:len(param["species"]), np.newaxis]
+        else:
+            values = values[:1]
+        args[var+"s"] = values
+
+        # args should follow the init signature of pyPSCF.MultiPSCF
+        def compute(progress):
+            multi = pyPSCF.MultiPSCF(progress=progress, **args)
+            multi.run()
+            return multi
 
-            model = pyPSCF.PSCF(**args)
-            # args should follow the init signature of pyPSCF.PSCF
+        self.start_job("PSCF", BackgroundJob(compute),
+                       lambda multi: self.on_PSCF_done(multi, param))
 
-            model.run()
+    def on_PSCF_done(self, multi, param):
+        for specie in param["species"]:
+            model = multi.select(specie)
             if model.plotBT:
                 model.plot_backtraj()
             if model.plotPolar:
@@ -1449,12 +1543,15 @@ class MainFrame(Frame):
         # change tab
         # self.notebook.select(2)
         # Compute the Back Traj
-        for i in range(nbCPU):
-            time.sleep(1)
-            p = Process(target=BT)
-            p.start()
-        # block until the last process finish
-        p.join()
+        self.start_job("Back-trajectories", BackgroundJob(BT, nbCPU=nbCPU),
+                       self.on_backtraj_done)
+
+    def on_backtraj_done(self, results):
+        failed = [r["file"] for r in results if r["state"] == "failed"]
+        if failed:
+            self.log("HYSPLIT failed for: "+", ".join(failed), "stderr")
+            showerror("Error", "HYSPLIT failed for {} back-trajectories: {}".format(
+                len(failed), ", ".join(failed)))
 
         showinfo("""Done!""", """The back-trajectory script is finish. See the terminal output if error was raised.""")
 
@@ -0,0 +1,142 @@
+"""Benchmark of the stages of the PSCF pipeline.
+
+A synthetic dataset (back-trajectories and concentration file, see
+:mod:`synthetic`) is generated and each stage of `PSCF.run` and of the
+plotting is timed:
+
+- filter: selection of the samples and critical concentration,
+- load: extraction of the back-trajectories,
+- bin: cell index, per-trajectory contributions and counts,
+- weight: PSCF, trajectory density and weighting function,
+- smooth: gaussian filter of the map,
+- plot: PSCF map rendering (with the Agg backend).
+
+The stages are timed by the profiler of the model (``PSCF(profile=True)``),
+so the benchmark and the library report the same stages. The memory is not
+traced while timing: with ``--memory``, one more run traces the peak memory
+(``PSCF(profile="memory")``).
+The results are written as JSON, so they can be compared between versions.
+
+Usage::
+
+    python benchmarks/bench_pipeline.py --days 365 --add-hour 0 6 12 18 \\
+        --length 72 --output bench.json
+"""
+import os
+import sys
+import json
+import argparse
+import platform
+import tempfile
+import numpy as np
+import scipy
+import pandas as pd
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt  # noqa: E402
+from scipy.ndimage import gaussian_filter  # noqa: E402
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from pyPSCF import pyPSCF  # noqa: E402
+from synthetic import make_dataset  # noqa: E402
+
+
+def run_stages(model, plot=True):
+    """Run the PSCF model and the plot with the profiler enabled.
+
+    Return
+    ------
+    stats : dict
+        The profiler statistics, see :class:`pyPSCF.profiling.Profiler`.
+    """
+    model.run()
+    if plot:
+        model.plot_PSCF()
+        plt.close("all")
+    else:
+        with model.profiler.stage("smooth"):
+            gaussian_filter(model.PSCF_, 1)
+    return model.stats_
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--days", type=int, default=90,
+                        help="number of samples (one per day)")
+    parser.add_argument("--add-hour", type=int, nargs="+", default=[0],
+                        help="back-trajectories starting hours around the "
+                             "sample")
+    parser.add_argument("--length", type=int, default=72,
+                        help="number of endpoints of the back-trajectories")
+    parser.add_argument("--meteo", nargs="+",
+                        default=["PRESSURE", "RAINFALL"],
+                        help="diagnostic meteo variables")
+    parser.add_argument("--resolution", type=float, default=0.5)
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="number of runs, the best one is kept")
+    parser.add_argument("--no-plot", action="store_true",
+                        help="do not time the plot stage")
+    parser.add_argument("--memory", action="store_true",
+                        help="trace the peak memory in one more run")
+    parser.add_argument("--output", help="write the JSON results in this file")
+    args = parser.parse_args(argv)
+
+    if "RAINFALL" not in args.meteo:
+        parser.error("RAINFALL must be in the meteo variables")
+
+    results = {
+        "config": {
+            "days": args.days,
+            "add_hour": args.add_hour,
+            "length": args.length,
+            "meteo": args.meteo,
+            "resolution": args.resolution,
+            "repeat": args.repeat,
+        },
+        "versions": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "scipy": scipy.__version__,
+            "matplotlib": matplotlib.__version__,
+        },
+    }
+
+    with tempfile.TemporaryDirectory() as folder:
+        dataset = make_dataset(folder, days=args.days,
+                               add_hour=tuple(args.add_hour),
+                               length=args.length, meteo=tuple(args.meteo))
+        runs = []
+        for i in range(args.repeat):
+            model = pyPSCF.PSCF(specie="specie", percentile=75,
+                                cutWithRain=True, smoothplot=True,
+                                resolution=args.resolution, profile=True,
+                                **dataset)
+            runs.append(run_stages(model, plot=not args.no_plot))
+        if args.memory:
+            model = pyPSCF.PSCF(specie="specie", percentile=75,
+                                cutWithRain=True, smoothplot=True,
+                                resolution=args.resolution, profile="memory",
+                                **dataset)
+            memory = run_stages(model, plot=not args.no_plot)
+
+    results["stages"] = {
+        stage: min(run["stages"][stage] for run in runs)
+        for stage in runs[0]["stages"]
+    }
+    results["total"] = sum(results["stages"].values())
+    for counter in ["files", "missing_files", "trajectories", "endpoints",
+                    "max_rss"]:
+        results[counter] = runs[-1].get(counter, 0)
+    if args.memory:
+        results["peak_memory"] = memory["peak_memory"]
+
+    output = json.dumps(results, indent=4)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
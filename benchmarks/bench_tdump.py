@@ -0,0 +1,97 @@
+"""Micro-benchmark of the HYSPLIT tdump parser.
+
+Compare :func:`pyPSCF.tdump.read_columns` with the former parsing of
+`PSCF.extractBackTraj` (two `linecache.getline` and a `pd.read_table` per
+file) and with `np.loadtxt`.
+
+Usage::
+
+    python benchmarks/bench_tdump.py [--files 500] [--length 240] [--nrows 72]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import linecache
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from pyPSCF.tdump import read_columns, TDUMP_COLUMNS  # noqa: E402
+from synthetic import write_tdump  # noqa: E402
+
+COLUMNS = ["lon", "lat", "age", "RAINFALL"]
+
+
+def read_legacy(datafile, nrows):
+    """The former parser of PSCF.extractBackTraj."""
+    nb_line_to_skip = linecache.getline(datafile, 1).split()
+    nb_line_to_skip = int(nb_line_to_skip[0])
+    meteo_idx = linecache.getline(datafile, nb_line_to_skip+4).split()
+    idx_names = np.hstack((TDUMP_COLUMNS, meteo_idx[1:]))
+    traj = pd.read_csv(datafile, sep=r"\s+", header=None, names=idx_names,
+                       skiprows=nb_line_to_skip+4, nrows=nrows)
+    return traj[COLUMNS]
+
+
+def read_loadtxt(datafile, nrows):
+    """np.loadtxt on the endpoint lines."""
+    with open(datafile, "r") as f:
+        lines = f.readlines()
+    nb_line_to_skip = int(lines[0].split()[0]) + 4
+    names = TDUMP_COLUMNS + lines[nb_line_to_skip-1].split()[1:]
+    return np.loadtxt(lines[nb_line_to_skip:nb_line_to_skip+nrows],
+                      usecols=[names.index(c) for c in COLUMNS])
+
+
+def read_new(datafile, nrows):
+    return read_columns(datafile, COLUMNS, nrows=nrows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--files", type=int, default=500)
+    parser.add_argument("--length", type=int, default=240,
+                        help="number of endpoints per file")
+    parser.add_argument("--nrows", type=int, default=72,
+                        help="number of endpoints read per file")
+    parser.add_argument("--json", help="write the results in this file")
+    args = parser.parse_args(argv)
+
+    rng = np.random.default_rng(0)
+    results = {"files": args.files, "length": args.length,
+               "nrows": args.nrows, "seconds": {}}
+    with tempfile.TemporaryDirectory() as folder:
+        files = []
+        for d in pd.date_range("2017-01-01", periods=args.files, freq="h"):
+            files.append(os.path.join(folder, d.strftime("traj_%y%m%d%H")))
+            write_tdump(files[-1], d, length=args.length, rng=rng)
+
+        reference = None
+        for name, reader in [("legacy", read_legacy),
+                             ("loadtxt", read_loadtxt),
+                             ("tdump", read_new)]:
+            linecache.clearcache()
+            start = time.perf_counter()
+            out = [reader(f, args.nrows) for f in files]
+            results["seconds"][name] = time.perf_counter() - start
+            lon = np.concatenate([np.asarray(o["lon"] if name != "loadtxt"
+                                             else o[:, 0]) for o in out])
+            if reference is None:
+                reference = lon
+            assert np.array_equal(reference, lon), name
+
+    print("{:8s} {:>10s} {:>8s}".format("parser", "ms/file", "speedup"))
+    for name, seconds in results["seconds"].items():
+        print("{:8s} {:10.3f} {:8.1f}".format(
+            name, 1000*seconds/args.files,
+            results["seconds"]["legacy"]/seconds))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""Synthetic HYSPLIT back-trajectories for the benchmarks."""
+import os
+import numpy as np
+import pandas as pd
+
+
+def write_tdump(datafile, dateBT, length=72, meteo=("PRESSURE", "RAINFALL"),
+                lat0=45., lon0=5., alt=100., rng=None):
+    """Write a random walk back-trajectory in the HYSPLIT tdump format.
+
+    Parameters
+    ----------
+    datafile : str, path
+        The file to write.
+    dateBT : pd.Timestamp
+        The starting date of the back-trajectory.
+    length : int, default 72
+        Number of hourly endpoints.
+    meteo : tuple of str
+        The diagnostic meteo variables. RAINFALL is 0 most of the time.
+    lat0, lon0, alt : float
+        The starting point.
+    rng : np.random.Generator, optional
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+
+    age = -np.arange(length)
+    lat = np.clip(lat0 + np.cumsum(rng.normal(0, 0.4, length)) - rng.normal(0, 0.4),
+                  -89, 89)
+    lon = (lon0 + np.cumsum(rng.normal(-0.2, 0.5, length)) + 180) % 360 - 180
+    lat[0], lon[0] = lat0, lon0
+    dates = dateBT - pd.to_timedelta(np.arange(length), unit="h")
+
+    lines = [
+        "{:6d}{:6d}".format(1, 1),
+        "    NOAA {:5d}{:6d}{:6d}{:6d}{:6d}".format(dateBT.year % 100,
+                                                   dateBT.month, 1, 0, 0),
+        "{:6d} BACKWARD OMEGA".format(1),
+        "{:6d}{:6d}{:6d}{:6d}{:9.3f}{:9.3f}{:8.1f}".format(
+            dateBT.year % 100, dateBT.month, dateBT.day, dateBT.hour,
+            lat0, lon0, alt),
+        "{:6d} {}".format(len(meteo), " ".join(meteo)),
+    ]
+    for k in range(length):
+        d = dates[k]
+        values = []
+        for m in meteo:
+            if m == "RAINFALL":
+                values.append(0.0 if rng.random() > 0.03 else rng.random())
+            elif m == "PRESSURE":
+                values.append(990 - rng.random()*100)
+            else:
+                values.append(rng.random()*100)
+        lines.append(
+            "{:6d}{:6d}{:6d}{:6d}{:6d}{:6d}{:6d}{:6d}{:8.1f}{:9.3f}{:9.3f}{:9.1f}"
+            .format(1, 1, d.year % 100, d.month, d.day, d.hour, 0, 0,
+                    age[k], lat[k], lon[k], alt)
+            + "".join("{:9.1f}".format(v) for v in values)
+        )
+    with open(datafile, "w") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def merge_tdump(datafile, files):
+    """Merge tdump files of one trajectory as HYSPLIT writes a run of several.
+
+    Parameters
+    ----------
+    datafile : str, path
+        The file to write.
+    files : list of str, path
+        The files of the trajectories, with the same dates, in the order of
+        their starting locations.
+    """
+    lines = []
+    for f in files:
+        with open(f) as fh:
+            lines.append(fh.read().splitlines())
+    pos = int(lines[0][0].split()[0]) + 1
+    merged = lines[0][:pos]
+    merged.append("{:6d}".format(len(files)) + lines[0][pos][6:])
+    merged.extend(traj[pos+1] for traj in lines)
+    merged.append(lines[0][pos+2])
+    for k in range(pos+3, len(lines[0])):
+        merged.extend("{:6d}".format(i+1) + traj[k][6:]
+                      for i, traj in enumerate(lines))
+    with open(datafile, "w") as f:
+        f.write("\n".join(merged) + "\n")
+
+
+def make_dataset(folder, station="SYN", start="2017-01-01", days=30,
+                 add_hour=(0,), length=72, meteo=("PRESSURE", "RAINFALL"),
+                 species=("specie",), lat0=45., lon0=5., seed=0):
+    """Write a synthetic back-trajectory directory and concentration file.
+
+    One sample per day at 00:00 is written in the concentration file, and one
+    back-trajectory per sample and `add_hour` offset in `folder/backtraj`.
+
+    Parameters
+    ----------
+    folder : str, path
+        Where to write the dataset.
+    station : str
+        The name of the station, used in the file names.
+    start : str
+        The first day.
+    days : int
+        Number of days (i.e. of samples).
+    add_hour : tuple of int
+        The back-trajectories starting hours around the sample hour.
+    length : int
+        Number of hourly endpoints of the back-trajectories.
+    meteo : tuple of str
+        The diagnostic meteo variables of the back-trajectories.
+    species : tuple of str
+        The columns of the concentration file.
+    lat0, lon0 : float
+        The location of the station.
+    seed : int
+        Seed of the random generator.
+
+    Return
+    ------
+    dataset : dict
+        The parameters to give to :class:`pyPSCF.pyPSCF.PSCF`, except
+        `specie`.
+    """
+    rng = np.random.default_rng(seed)
+    dirBT = os.path.join(folder, "backtraj")
+    os.makedirs(dirBT, exist_ok=True)
+    prefix = "traj_{}_".format(station)
+
+    dates = pd.date_range(start, periods=days, freq="D")
+    for date in dates:
+        for hour in add_hour:
+            dateBT = date + pd.Timedelta(hours=hour)
+            write_tdump(os.path.join(dirBT, prefix+dateBT.strftime("%y%m%d%H")),
+                        dateBT, length=length, meteo=meteo, lat0=lat0,
+                        lon0=lon0, rng=rng)
+
+    conc = pd.DataFrame(
+        {specie: rng.lognormal(size=days) for specie in species},
+        index=pd.Index(dates, name="date")
+    )
+    concFile = os.path.join(folder, "conc_{}.csv".format(station))
+    conc.to_csv(concFile, sep=";")
+
+    lonmin, lonmax = np.floor(lon0) - 40, np.floor(lon0) + 30
+    latmin, latmax = max(np.floor(lat0) - 25, -90), min(np.floor(lat0) + 25, 90)
+    return dict(
+        station=station, lat0=lat0, lon0=lon0, folder=dirBT, prefix=prefix,
+        add_hour=list(add_hour), concFile=concFile,
+        dateMin=(dates[0] - pd.Timedelta(days=1)).strftime("%Y-%m-%d"),
+        dateMax=(dates[-1] + pd.Timedelta(days=1)).strftime("%Y-%m-%d"),
+        mapMinMax={"lonmin": lonmin, "lonmax": lonmax,
+                   "latmin": latmin, "latmax": latmax},
+        hourinthepast=length, pd_kwarg={"sep": ";"},
+    )
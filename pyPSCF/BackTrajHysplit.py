@@ -1,14 +1,31 @@
 import os
 import sys
-import numpy as np
 import time
+import subprocess
+import tempfile
 import datetime as dt
-from dateutil.relativedelta import relativedelta
 import calendar
 import re
 import json
 import shutil
+import traceback
 import pandas as pd
+from multiprocessing import Pool, Event
+
+from pyPSCF.tdump import check_tdump, split_tdump
+from pyPSCF.manifest import (JobManifest, MANIFEST_NAME, RUNNING, DONE,
+                             FAILED, file_checksum, file_stat)
+
+
+# height of the model top (m), the trajectories reaching it are stopped
+MODEL_TOP = 10000.0
+# height below the model top above which a trajectory may have reached it
+# before its next hourly endpoint
+TOP_MARGIN = 1000.0
+# interval between two checks of the cancellation of a HYSPLIT run (second)
+CANCEL_POLL = 0.5
+
+_SHARED = {}
 
 
 def file_exists(path):
@@ -21,101 +38,565 @@ def get_currentFile(station, d):
 def update_date(d, stepHH):
     return d + pd.Timedelta(stepHH+"H")
 
-def BT():
+def get_param(paramFile=None):
     """
-    Compute the back-trajectory according to the parameters in parameters/localParamBackTraj.json.
-    
-    It should be use eithery with GUI.pyw otherwise or from the '../parameters'
-    dir, ortherwise the relative path won't be effective.
+    Load the back-trajectory parameters.
+
+    Parameters
+    ----------
+    paramFile : str, path, optional
+        The json file of parameters. By default
+        parameters/localParamBackTraj.json.
+
+    Return
+    ------
+    param : dict
     """
+    if paramFile is None:
+        paramFile = os.path.normpath('parameters/localParamBackTraj.json')
+    with open(paramFile, 'r') as dataFile:
+        param = json.load(dataFile)
+    return param
 
-    # ===== Load the parameters from the json file          ===================
-    with open(os.path.normpath('parameters/localParamBackTraj.json'), 'r') as dataFile:
-        param=json.load(dataFile)
+# GDAS1 weekly files: gdas1.<mon><yy>.w<week>, the week 5 ending with the month
+GDAS_PATTERN = re.compile(r"^gdas1\.([a-z]{3})(\d{2})\.w([1-5])$")
+GDAS_MONTHS = ["jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep",
+               "oct", "nov", "dec"]
+# time step of GDAS1, the margin needed to interpolate at the ends of a file
+GDAS_STEP = pd.Timedelta(hours=3)
+
+def index_metfiles(dirGDAS):
+    """
+    Index the GDAS1 weekly files of a directory by their time coverage.
+
+    The directory is listed once, so the files of all the back-trajectories
+    are then found without any other file system access.
+
+    Parameters
+    ----------
+    dirGDAS : str, path
+        The GDAS directory.
+
+    Return
+    ------
+    index : pd.DataFrame
+        The columns `file`, `start` and `end` (the end being excluded), sorted
+        by `start`.
+    """
+    rows = []
+    for f in os.listdir(dirGDAS):
+        match = GDAS_PATTERN.match(f)
+        if match is None or match.group(1) not in GDAS_MONTHS:
+            continue
+        mon, yy, week = match.groups()
+        month = pd.Timestamp(year=2000+int(yy),
+                             month=GDAS_MONTHS.index(mon)+1, day=1)
+        start = month + pd.Timedelta(days=7*(int(week)-1))
+        end = min(start + pd.Timedelta(days=7), month + pd.DateOffset(months=1))
+        rows.append((f, start, end))
+    index = pd.DataFrame(rows, columns=["file", "start", "end"])
+    return index.sort_values("start", ignore_index=True)
+
+def get_metfiles(curDate, dirGDAS, hBT=None, index=None):
+    """
+    List the GDAS files needed for a back-trajectory starting at `curDate`.
+
+    Parameters
+    ----------
+    curDate : datetime
+        The starting date of the back-trajectory.
+    dirGDAS : str, path
+        The GDAS directory.
+    hBT : int, optional
+        The duration of the trajectory (hour, negative for a
+        back-trajectory). Only the files covering the trajectory are listed.
+        By default, the files from the middle of the previous month to the
+        end of the current month.
+    index : pd.DataFrame, optional
+        The index of the GDAS files (see :func:`index_metfiles`). By default,
+        `dirGDAS` is indexed.
+
+    Return
+    ------
+    files : list of str
+        The existing GDAS files, in chronological order.
+    """
+    if index is None:
+        index = index_metfiles(dirGDAS)
+    curDate = pd.Timestamp(curDate)
+    if hBT is None:
+        month = curDate.to_period("M").to_timestamp()
+        start = month - pd.DateOffset(months=1) + pd.Timedelta(days=14)
+        end = month + pd.DateOffset(months=1) - pd.Timedelta(hours=1)
+    else:
+        start, end = sorted([curDate, curDate + pd.Timedelta(hours=hBT)])
+        start, end = start - GDAS_STEP, end + GDAS_STEP
+    overlap = (index["start"] <= end) & (index["end"] > start)
+    return index.loc[overlap, "file"].tolist()
+
+def get_starts(param):
+    """
+    List the starting points of the back-trajectories.
+
+    Parameters
+    ----------
+    param : dict
+        The back-trajectory parameters. The optional "starts" parameter is a
+        list of starting points, as dict with the keys "station", "lat",
+        "lon" and "alt" (the missing keys are taken from the parameters).
+        By default, the single starting point of the station.
+
+    Return
+    ------
+    starts : list of dict
+        The starting points. The output files being named after the station
+        (see :func:`get_currentFile`), the height is added to the station
+        shared by several starting points, e.g. "Maido_500m".
+
+    Raises
+    ------
+    ValueError
+        If several starting points still have the same station.
+    """
+    starts = param.get("starts") or [{}]
+    keys = ["station", "lat", "lon", "alt"]
+    starts = [{k: start.get(k, param[k]) for k in keys} for start in starts]
+    stations = [start["station"] for start in starts]
+    for start in starts:
+        if stations.count(start["station"]) > 1:
+            start["station"] = "{}_{:g}m".format(start["station"],
+                                                 float(start["alt"]))
+    stations = [start["station"] for start in starts]
+    duplicated = sorted(set(s for s in stations if stations.count(s) > 1))
+    if duplicated:
+        raise ValueError("Several starting points have the station {}, "
+                         "give them different names.".format(duplicated))
+    return starts
+
+def get_control(param, curDate, files, currentFile, starts=None,
+                dirOutput=None):
+    """
+    Write the content of the CONTROL file of a back-trajectory.
+
+    Parameters
+    ----------
+    param : dict
+        The back-trajectory parameters.
+    curDate : datetime
+        The starting date of the back-trajectory.
+    files : list of str
+        The GDAS files to use.
+    currentFile : str
+        The name of the output file.
+    starts : list of dict, optional
+        The starting points (see :func:`get_starts`) computed in the same
+        run, written in the same output file. By default, the station.
+    dirOutput : str, optional
+        The directory of the output file. By default the "dirOutput"
+        parameter.
+
+    Return
+    ------
+    control : str
+    """
+    if starts is None:
+        starts = [param]
+    if dirOutput is None:
+        dirOutput = param["dirOutput"]+os.sep
+    dirGDAS = os.path.abspath(param["dirGDAS"])+os.sep
+
+    YY = dt.datetime.strftime(curDate, "%y")
+    MM = dt.datetime.strftime(curDate, "%m")
+    DD = dt.datetime.strftime(curDate, "%d")
+    HH = dt.datetime.strftime(curDate, "%H")
+    f =  "%s %s %s %s\n" % (YY, MM, DD, HH)
+    f += "%s\n" % len(starts)
+    for start in starts:
+        f += "%s %s %s\n" % (start["lat"], start["lon"], start["alt"])
+    f += "%s\n" % param["hBT"]
+    f += "0\n"
+    f += "%.1f\n" % MODEL_TOP
+    f += "%s\n" % len(files)
+    for file in files:
+        f += "%s\n" % dirGDAS
+        f += "%s\n" % file
+    f += "%s\n" % dirOutput
+    f += "%s\n" % currentFile
+    return f
+
+def check_output(path, hBT):
+    """
+    Check that the output of a back-trajectory is complete.
+
+    The file must be readable down to its last endpoint, which must be `hBT`
+    hours old. HYSPLIT ends the trajectories reaching the model top earlier:
+    they are complete if their last endpoint is within `TOP_MARGIN` of
+    `MODEL_TOP`. Any other shorter trajectory (e.g. meteo files missing or
+    run killed) is incomplete.
+
+    Parameters
+    ----------
+    path : str, path
+        The back-trajectory file.
+    hBT : float
+        The duration of the back-trajectories.
+
+    Raises
+    ------
+    ValueError
+        If the output is incomplete (see :func:`pyPSCF.tdump.check_tdump`).
+    """
+    check_tdump(path, hours=hBT, top=MODEL_TOP - TOP_MARGIN)
+
+def output_done(job, path, hBT, outputs):
+    """
+    Either or not the output `path` of a back-trajectory is complete.
+
+    An output recorded as done in the manifest must still have the same
+    size and modification time, or else the same checksum. An output
+    computed before the manifest existed (`job` is None) is checked (see
+    :func:`check_output`).
+
+    Parameters
+    ----------
+    job : dict or None
+        The job of the manifest (see :meth:`JobManifest.jobs`).
+    path : str, path
+        The back-trajectory file.
+    hBT : float
+        The duration of the back-trajectories.
+    outputs : list
+        The (file, checksum, size, mtime) of the outputs to record as done
+        (see :meth:`JobManifest.set_done`) are appended to it.
+
+    Return
+    ------
+    done : boolean
+    """
+    try:
+        size, mtime = file_stat(path)
+    except FileNotFoundError:
+        return False
+    if job is None:
+        try:
+            check_output(path, hBT)
+        except ValueError:
+            return False
+        outputs.append((os.path.basename(path), file_checksum(path), size,
+                        mtime))
+        return True
+    if job["state"] != DONE:
+        return False
+    if job["size"] == size and job["mtime"] == mtime:
+        return True
+    if job["checksum"] != file_checksum(path):
+        return False
+    # same content, e.g. copied: only record its new size and mtime
+    outputs.append((job["file"], job["checksum"], size, mtime))
+    return True
 
+def get_tasks(param):
+    """
+    List the back-trajectories still to compute.
+
+    The jobs are recorded in the manifest of `dirOutput` (see
+    :mod:`pyPSCF.manifest`). A back-trajectory is computed again if it is
+    not done, if its output is missing or was modified, or if its worker
+    died while running it.
+
+    The back-trajectories of all the starting points (see
+    :func:`get_starts`) of a date are computed by a single HYSPLIT run, by
+    batches of at most "batchSize" starting points (optional parameter, by
+    default all of them).
+
+    Parameters
+    ----------
+    param : dict
+        The back-trajectory parameters.
+
+    Return
+    ------
+    tasks : list of dict
+        One task per HYSPLIT run, to be run by :func:`run_task`.
+    """
     curDate = pd.to_datetime(param["dateMin"])
     endDate = pd.to_datetime(param["dateMax"])
-    # YY,MM,DD,HH = int(param["date"][0]),int(param["date"][1]),int(param["date"][2]),int(param["date"][3])
-    # YYend,MMend,DDend,HHend = int(param["dateEnd"][0]), int(param["dateEnd"][1]), int(param["dateEnd"][2]), int(param["dateEnd"][3])
-    
+
     dirOutput       = param["dirOutput"]+os.sep
     HysplitExec     = param["dirHysplit"]+os.sep+"exec"+os.sep+"hyts_std"
     if sys.platform=="win32":
         HysplitExec += ".exe"
-    dirHysplit      = param["dirHysplit"]+os.sep+"working"+os.sep
     dirGDAS         = param["dirGDAS"]+os.sep
-    CONTROL         = dirHysplit+"CONTROL"
-    
+
+    if not os.path.isdir(dirOutput):
+        os.makedirs(dirOutput)
+    manifestFile = os.path.abspath(dirOutput+MANIFEST_NAME)
+    manifest = JobManifest(manifestFile, timeout=param.get("jobTimeout"))
+    jobs = manifest.jobs()
+
+    metfiles = index_metfiles(dirGDAS)
+    hBT = int(float(param["hBT"]))
+    starts = get_starts(param)
+    batchSize = max(1, int(param.get("batchSize", len(starts))))
 
     curDate = update_date(curDate, param["stepHH"])
 
-    # ===== Write the SETUP.CFG file                    =======================
-    shutil.copy(os.path.normpath('parameters/SETUP_backTraj.CFG'), dirHysplit+"SETUP.CFG")
-    # go to the hysplit dir
-    os.chdir(dirHysplit)
-    # ===== Compute the Back Traj                       =======================
-    while endDate >= curDate: #dt.datetime(YYend+2000, MMend, DDend, HHend) >= dt.datetime(int(YY)+2000, int(MM), int(DD), int(HH)):
-        currentFile = get_currentFile(param["station"], curDate)
-        if file_exists(dirOutput+currentFile):
-            curDate = update_date(curDate, param["stepHH"])
-            print("file already exist :", currentFile)
-            continue
-        cfile = open(CONTROL, "r").readlines()
-        if currentFile in cfile[-1].strip():
-            curDate = update_date(curDate, param["stepHH"])
-            print("file is already processing:", currentFile)
-            time.sleep(np.random.rand()*3)
-            continue
-        #if not file_exists(dirOutput+currentFile):
-        ## create file name
-        #file1, previous month
-        preDate = curDate + relativedelta(months=-1)
-        mon = dt.datetime.strftime(preDate, "%b").lower()
-        year = dt.datetime.strftime(preDate, "%y")
-        files = []
-        
-        files = ["gdas1."+mon+year+".w{i}".format(i=i) for i in range(3,6)]
-        #other file (all the current month)
-        mon = dt.datetime.strftime(curDate, "%b").lower()
-        year = dt.datetime.strftime(curDate, "%y")
-        files += ["gdas1."+mon+year+".w{i}".format(i=i) for i in range(1,6)]
-        #file7, next month
-        # nextDate = curDate + relativedelta(months=1)
-        # mon = dt.datetime.strftime(nextDate, "%b").lower()
-        # year = dt.datetime.strftime(nextDate, "%y")
-        # files += ["gdas1."+mon+year+".w1"]
-        for f in files:
-            if not os.path.exists(dirGDAS+f):
-                files.remove(f)
-
-        #Write the CONTROL file
-        YY = dt.datetime.strftime(curDate, "%y")
-        MM = dt.datetime.strftime(curDate, "%m")
-        DD = dt.datetime.strftime(curDate, "%d")
-        HH = dt.datetime.strftime(curDate, "%H")
-        f =  "%s %s %s %s\n" % (YY, MM, DD, HH)
-        f += "1\n"
-        f += "%s %s %s\n" % (param["lat"], param["lon"], param["alt"])
-        f += "%s\n" % param["hBT"]
-        f += "0\n"
-        f += "10000.0\n"
-        f += "%s\n" % len(files)
-        for file in files:
-            f += "%s\n" % dirGDAS
-            f += "%s\n" % file
-        f += "%s\n" % dirOutput
-        f += "%s\n" % currentFile
-        if not file_exists(dirOutput+currentFile):
-            file = open(CONTROL, 'w')
-            file.write(f)
-            file.close()
-            print("Processing : ", currentFile)
-            os.system(HysplitExec)
-            time.sleep(np.random.rand()*3)
-    
+    tasks = []
+    outputs = []
+    while endDate >= curDate:
+        todo = []
+        for start in starts:
+            currentFile = get_currentFile(start["station"], curDate)
+            job = jobs.get(currentFile)
+            if job is not None and job["state"] == RUNNING and \
+                    not manifest.is_stale(job):
+                print("file already running :", currentFile)
+            elif output_done(job, dirOutput+currentFile, hBT, outputs):
+                print("file already exist :", currentFile)
+            else:
+                if job is not None and job["state"] == RUNNING:
+                    manifest.release(job)
+                todo.append(dict(
+                    start, file=currentFile,
+                    output=os.path.abspath(dirOutput+currentFile)
+                ))
+        if todo:
+            files = get_metfiles(curDate, dirGDAS, hBT, metfiles)
+        for i in range(0, len(todo), batchSize):
+            tasks.append({
+                "date": curDate,
+                "starts": todo[i:i+batchSize],
+                "metfiles": files,
+                "param": param,
+                "manifest": manifestFile,
+                "exec": os.path.abspath(HysplitExec),
+                "dirHysplit": os.path.abspath(param["dirHysplit"]),
+                "setup": os.path.abspath(param.get(
+                    "setup", os.path.normpath('parameters/SETUP_backTraj.CFG')
+                )),
+            })
         curDate = update_date(curDate, param["stepHH"])
 
-    return 1
+    manifest.set_done(outputs)
+    manifest.set_pending([start["file"] for task in tasks
+                          for start in task["starts"]])
+    return tasks
+
+def _init_worker(cancel):
+    """Share the cancellation event of :func:`BT` with the pool workers."""
+    _SHARED["cancel"] = cancel
+
+def _cancelled():
+    cancel = _SHARED.get("cancel")
+    return cancel is not None and cancel.is_set()
+
+def wait_hysplit(proc):
+    """
+    Wait for a HYSPLIT run, which is killed if :func:`BT` is cancelled.
+
+    Parameters
+    ----------
+    proc : subprocess.Popen
+        The HYSPLIT process, its output being piped.
+
+    Return
+    ------
+    output : bytes or None
+        The output of HYSPLIT, None if it was killed.
+    """
+    while True:
+        try:
+            return proc.communicate(timeout=CANCEL_POLL)[0]
+        except subprocess.TimeoutExpired:
+            if _cancelled():
+                proc.kill()
+                proc.communicate()
+                return None
+
+def run_task(task):
+    """
+    Run HYSPLIT for the back-trajectories of a task.
+
+    The jobs are first claimed in the manifest, and the ones that another
+    worker already has are skipped. HYSPLIT is run once for all the starting
+    points left, in its own temporary working directory (next to the
+    'working' one of HYSPLIT), with its own CONTROL and SETUP.CFG files, so
+    that several tasks can run at the same time. Its output is split into
+    one file per back-trajectory (see :func:`pyPSCF.tdump.split_tdump`),
+    which are then checked (see :func:`check_output`): an incomplete output
+    is removed and its job is recorded as failed.
+
+    Once :func:`BT` is cancelled, the tasks left are skipped and HYSPLIT is
+    killed (see :func:`wait_hysplit`): its working directory is removed and
+    its jobs are recorded as failed, to be computed at the next call.
+
+    Parameters
+    ----------
+    task : dict
+        A task of :func:`get_tasks`.
+
+    Return
+    ------
+    results : list of dict
+        For each back-trajectory, the file name, the state of the job
+        ("done", "failed" or "skipped"), the exit status of HYSPLIT, the
+        runtime of the HYSPLIT run and the output of HYSPLIT (or the error)
+        if it failed.
+    """
+    manifest = JobManifest(task["manifest"])
+    starts = []
+    results = []
+    for start in task["starts"]:
+        if not _cancelled() and manifest.claim(start["file"]):
+            starts.append(start)
+        else:
+            results.append({"file": start["file"], "state": "skipped",
+                            "returncode": None, "runtime": 0, "output": ""})
+    if not starts:
+        return results
+
+    workdir = tempfile.mkdtemp(prefix="working_", dir=task["dirHysplit"])
+    try:
+        shutil.copy(task["setup"], os.path.join(workdir, "SETUP.CFG"))
+        # some HYSPLIT versions look for ASCDATA.CFG in the working directory
+        ascdata = os.path.join(task["dirHysplit"], "working", "ASCDATA.CFG")
+        if os.path.exists(ascdata):
+            shutil.copy(ascdata, workdir)
+        with open(os.path.join(workdir, "CONTROL"), "w") as f:
+            f.write(get_control(task["param"], task["date"], task["metfiles"],
+                                "tdump", starts=starts,
+                                dirOutput="."+os.sep))
+
+        start = time.time()
+        proc = subprocess.Popen([task["exec"]], cwd=workdir,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT)
+        try:
+            output = wait_hysplit(proc)
+        except BaseException:
+            proc.kill()
+            proc.wait()
+            raise
+        run = {
+            "state": DONE,
+            "returncode": proc.returncode,
+            "runtime": time.time() - start,
+            "output": "",
+        }
+        if output is None:
+            run["state"] = FAILED
+            run["output"] = "Cancelled"
+        elif proc.returncode != 0:
+            run["state"] = FAILED
+            run["output"] = output.decode(errors="replace")
+        else:
+            try:
+                split_tdump(os.path.join(workdir, "tdump"),
+                            [s["output"] for s in starts])
+            except (OSError, ValueError, IndexError) as e:
+                run["state"] = FAILED
+                run["output"] = "The output of HYSPLIT can not be split: " \
+                    "{}".format(e)
+    except BaseException:
+        for s in starts:
+            manifest.finish(s["file"], FAILED, message=traceback.format_exc())
+        raise
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    for s in starts:
+        result = dict(run, file=s["file"])
+        checksum = size = mtime = None
+        if result["state"] == DONE:
+            try:
+                check_output(s["output"], task["param"]["hBT"])
+                checksum = file_checksum(s["output"])
+                size, mtime = file_stat(s["output"])
+            except (OSError, ValueError) as e:
+                result["state"] = FAILED
+                result["output"] = str(e)
+        if result["state"] == FAILED and os.path.exists(s["output"]):
+            os.remove(s["output"])
+        manifest.finish(s["file"], result["state"],
+                        runtime=result["runtime"], checksum=checksum,
+                        size=size, mtime=mtime,
+                        message=result["output"] or None)
+        results.append(result)
+    return results
+
+def BT(nbCPU=None, paramFile=None, progress=None):
+    """
+    Compute the back-trajectory according to the parameters in parameters/localParamBackTraj.json.
+    
+    It should be use eithery with GUI.pyw otherwise or from the '../parameters'
+    dir, ortherwise the relative path won't be effective.
+
+    The back-trajectories are split into tasks run by a pool of `nbCPU`
+    processes, each HYSPLIT run having its own working directory. The state
+    of each back-trajectory is kept in a manifest in `dirOutput`, so an
+    interrupted computation is resumed by calling `BT` again: only the
+    missing, failed or corrupted back-trajectories are computed. A
+    back-trajectory running for more than the "jobTimeout" parameter (in
+    seconds, optional) is considered abandoned.
+
+    Several starting points (other heights or stations) can be given with
+    the "starts" parameter: the back-trajectories of a date are then
+    computed by a single HYSPLIT run (see :func:`get_tasks`).
+
+    Parameters
+    ----------
+    nbCPU : int, optional
+        Number of HYSPLIT run in parallel. By default the "cpu" parameter.
+    paramFile : str, path, optional
+        The json file of parameters.
+    progress : callable, optional
+        Called with the number of back-trajectories processed and to
+        process, after each HYSPLIT run. If it raises an exception, the
+        HYSPLIT runs are killed and their working directories removed before
+        the exception is raised; the back-trajectories left are computed at
+        the next call (see :mod:`pyPSCF.background`).
+
+    Return
+    ------
+    results : list of dict
+        The result of each back-trajectory (see :func:`run_task`).
+    """
+    # ===== Load the parameters from the json file          ===================
+    param = get_param(paramFile)
+    if nbCPU is None:
+        nbCPU = int(param.get("cpu", 1))
+
+    # ===== Compute the Back Traj                       =======================
+    tasks = get_tasks(param)
+    total = sum(len(task["starts"]) for task in tasks)
+    results = []
+    if progress is not None:
+        progress(0, total)
+    cancel = Event()
+    pool = Pool(max(1, nbCPU), initializer=_init_worker, initargs=(cancel,))
+    try:
+        for result in (r for batch in pool.imap_unordered(run_task, tasks)
+                       for r in batch):
+            if result["state"] == DONE:
+                print("Processed : ", result["file"])
+            elif result["state"] == "skipped":
+                print("Claimed by another worker : ", result["file"])
+            else:
+                print("HYSPLIT failed ({}) for : {}\n{}".format(
+                    result["returncode"], result["file"], result["output"]
+                ))
+            results.append(result)
+            if progress is not None:
+                progress(len(results), total)
+    except BaseException:
+        # the workers kill HYSPLIT and clean up, instead of being terminated
+        cancel.set()
+        raise
+    finally:
+        pool.close()
+        pool.join()
+
+    return results
 
 
 def BTconverter():
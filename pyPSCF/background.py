@@ -0,0 +1,106 @@
+"""Run long computations in a background thread.
+
+The back-trajectory computation (:func:`pyPSCF.BackTrajHysplit.BT`) and the
+PSCF models (:class:`pyPSCF.pyPSCF.PSCF`) report their progress through a
+`progress(done, total)` callback. A :class:`BackgroundJob` runs them in a
+thread and turns the calls of this callback into events (with the throughput
+and the remaining time) in a queue, which the GUI reads periodically with the
+Tk `after` method, so that its event loop is never blocked. The callback also
+raises :class:`Cancelled` once the job is cancelled, which stops the
+computation.
+"""
+import time
+import queue
+import threading
+import traceback
+
+
+class Cancelled(Exception):
+    """Raised in the background thread when the job is cancelled."""
+
+
+class BackgroundJob:
+    """
+    Run `target(*args, progress=callback, **kwargs)` in a background thread.
+
+    Parameters
+    ----------
+    target : callable
+        The computation. It is given the `progress` keyword argument, to be
+        called with the number of items done and the total number of items.
+    interval : float, default 0.2
+        Minimum time between two progress events (second).
+
+    Notes
+    -----
+    The events returned by :meth:`events` are (kind, value) tuples:
+
+    - ("progress", dict) with the keys done, total, elapsed (second), rate
+      (item per second) and eta (second, None if unknown),
+    - ("done", result) with the value returned by `target`,
+    - ("error", str) with the traceback of the exception raised,
+    - ("cancelled", None).
+    """
+    def __init__(self, target, *args, interval=0.2, **kwargs):
+        self.target = target
+        self.args = args
+        self.kwargs = kwargs
+        self.interval = interval
+        self.queue = queue.Queue()
+        self._cancel = threading.Event()
+        self._thread = None
+        self._start = None
+        self._last = None
+
+    def start(self):
+        """Start the computation."""
+        self._start = self._last = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def cancel(self):
+        """Ask the computation to stop at its next progress report."""
+        self._cancel.set()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def _progress(self, done, total):
+        """Progress callback given to the target."""
+        if self._cancel.is_set():
+            raise Cancelled()
+        now = time.perf_counter()
+        if done < total and now - self._last < self.interval:
+            return
+        self._last = now
+        elapsed = now - self._start
+        rate = done / elapsed if elapsed > 0 else 0.
+        eta = (total - done) / rate if rate > 0 else None
+        self.queue.put(("progress", {"done": done, "total": total,
+                                     "elapsed": elapsed, "rate": rate,
+                                     "eta": eta}))
+
+    def _run(self):
+        try:
+            result = self.target(*self.args, progress=self._progress,
+                                 **self.kwargs)
+        except Cancelled:
+            self.queue.put(("cancelled", None))
+        except Exception:
+            self.queue.put(("error", traceback.format_exc()))
+        else:
+            self.queue.put(("done", result))
+
+    def events(self):
+        """The events since the last call, without waiting."""
+        events = []
+        while True:
+            try:
+                events.append(self.queue.get_nowait())
+            except queue.Empty:
+                return events
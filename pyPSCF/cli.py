@@ -0,0 +1,300 @@
+"""Command line interface to run PSCF without the GUI.
+
+The jobs are described in a JSON file::
+
+    {
+        "stations": "parameters/locationStation.json",
+        "output": "output",
+        "defaults": {
+            "folder": "/data/backtraj/{station}/",
+            "prefix": "traj_{station}_",
+            "concFile": "/data/conc/{station}.csv",
+            "add_hour": [0],
+            "pd_kwarg": {"sep": ";"}
+        },
+        "jobs": [
+            {"station": "LYON", "species": ["PM10", "OC"],
+             "periods": [["2017-01-01", "2017-07-01"],
+                         ["2017-07-01", "2018-01-01"]],
+             "percentiles": [75, 90]},
+            {"station": "GRE-fr", "species": ["PM10"],
+             "dateMin": "2017-01-01", "dateMax": "2018-01-01",
+             "thresholds": [50]}
+        ]
+    }
+
+The keys of a job (and of `defaults`) are the parameters of
+:class:`pyPSCF.pyPSCF.PSCF`. `lat0` and `lon0` are read from the stations
+file if not given, and `{station}` is replaced by the station name in the
+string parameters. A job has either `dateMin`/`dateMax` or a list of
+`periods`, and a list of `percentiles` or `thresholds`.
+
+The jobs sharing the same station, period and parameters are run together
+by a single :class:`pyPSCF.pyPSCF.MultiPSCF`, so their back-trajectories are
+read once. The groups are run in parallel. For each job, specie and
+threshold, the grids are written in a `.npz` file, the sums by direction
+from the station (if `plotPolar`, see :meth:`pyPSCF.pyPSCF.PSCF.sectors`) in
+a `_sectors.csv` file and the maps in `.png` files (without display).
+
+Usage::
+
+    pypscf jobs.json --n-jobs 4
+"""
+import os
+import re
+import sys
+import json
+import argparse
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt  # noqa: E402
+
+from pyPSCF.pyPSCF import MultiPSCF  # noqa: E402
+
+
+# parameters which do not change the back-trajectories read by a group
+JOB_KEYS = ["species", "percentiles", "thresholds", "periods"]
+
+
+def read_jobs(jobFile, stationFile=None):
+    """Read a job file and expand it into single period jobs.
+
+    Parameters
+    ----------
+    jobFile : str, path
+        The JSON job file, see :mod:`pyPSCF.cli`.
+    stationFile : str, path, optional
+        The JSON file of the station locations (as
+        `parameters/locationStation.json`). By default the `stations` entry of
+        the job file.
+
+    Return
+    ------
+    jobs : list of dict
+        The parameters of each job, with `dateMin`, `dateMax`, `lat0` and
+        `lon0` filled.
+    """
+    with open(jobFile, "r") as f:
+        config = json.load(f)
+    if stationFile is None:
+        stationFile = config.get("stations")
+    locStation = {}
+    if stationFile is not None:
+        with open(stationFile, "r") as f:
+            locStation = json.load(f)
+
+    jobs = []
+    for i, job in enumerate(config["jobs"]):
+        param = dict(config.get("defaults", {}))
+        param.update(job)
+        station = param["station"]
+        param = {
+            k: v.format(station=station) if isinstance(v, str) else v
+            for k, v in param.items()
+        }
+        if ("lat0" not in param) or ("lon0" not in param):
+            if station not in locStation:
+                raise ValueError("Job {}: the station {} is not in the "
+                                 "stations file".format(i, station))
+            param.setdefault("lat0", float(locStation[station][0]))
+            param.setdefault("lon0", float(locStation[station][1]))
+        if ("percentiles" in param) == ("thresholds" in param):
+            raise ValueError("Job {}: either 'percentiles' or 'thresholds' "
+                             "should be specified".format(i))
+        if isinstance(param["species"], str):
+            param["species"] = [param["species"]]
+
+        periods = param.pop("periods", None)
+        if periods is None:
+            periods = [(param["dateMin"], param["dateMax"])]
+        for dateMin, dateMax in periods:
+            jobs.append(dict(param, dateMin=dateMin, dateMax=dateMax))
+    return jobs
+
+
+def group_jobs(jobs):
+    """Group the jobs which read the same back-trajectories.
+
+    Parameters
+    ----------
+    jobs : list of dict
+        The jobs, see :func:`read_jobs`.
+
+    Return
+    ------
+    groups : list of dict
+        Each group has the keys `kwargs` (the common PSCF parameters), `kind`
+        ("percentiles" or "thresholds") and `jobs` (list of (job number,
+        specie, value)).
+    """
+    groups = {}
+    for n, job in enumerate(jobs):
+        kind = "percentiles" if "percentiles" in job else "thresholds"
+        kwargs = {k: v for k, v in job.items() if k not in JOB_KEYS}
+        key = json.dumps([kind, kwargs], sort_keys=True, default=str)
+        group = groups.setdefault(key, {"kwargs": kwargs, "kind": kind,
+                                        "jobs": []})
+        for specie in job["species"]:
+            for value in np.atleast_1d(job[kind]):
+                group["jobs"].append((n, specie, float(value)))
+    return list(groups.values())
+
+
+def _filename(job, specie, kind, value):
+    """Base name of the output files of a job result."""
+    name = "{station}_{specie}_{dateMin}_{dateMax}_{kind}{value:g}".format(
+        station=job["station"], specie=specie, dateMin=job["dateMin"],
+        dateMax=job["dateMax"], kind=kind[0], value=value
+    )
+    return re.sub(r"[^\w.\-]+", "_", name)
+
+
+def run_group(group, output, plot=True):
+    """Run the PSCF of a group of jobs and write their results.
+
+    Parameters
+    ----------
+    group : dict
+        A group of jobs, see :func:`group_jobs`.
+    output : str, path
+        The directory of the results.
+    plot : boolean, default True
+        Either or not save the maps.
+
+    Return
+    ------
+    results : list of dict
+        One per (job, specie, value), with the written `files` or the `error`.
+    """
+    kwargs, kind = group["kwargs"], group["kind"]
+
+    # ===== one row of thresholds per specie
+    species = []
+    values = {}
+    for n, specie, value in group["jobs"]:
+        if specie not in values:
+            species.append(specie)
+            values[specie] = []
+        if value not in values[specie]:
+            values[specie].append(value)
+    ncol = max(len(v) for v in values.values())
+    table = np.array([values[s] + values[s][-1:]*(ncol-len(values[s]))
+                      for s in species])
+
+    results = []
+    try:
+        multi = MultiPSCF(species=species, **{kind: table}, **kwargs)
+        multi.run()
+    except Exception:
+        error = traceback.format_exc()
+        return [dict(job=n, specie=specie, value=value, error=error)
+                for n, specie, value in group["jobs"]]
+
+    for n, specie, value in group["jobs"]:
+        result = dict(job=n, specie=specie, value=value, files=[])
+        try:
+            model = multi.select(specie, values[specie].index(value))
+            base = os.path.join(output, _filename(kwargs, specie, kind, value))
+            np.savez_compressed(
+                base+".npz", lon=model.lon, lat=model.lat,
+                concCrit=model.concCrit, ngrid=model.ngrid_,
+                mgrid=model.mgrid_, PSCF=model.PSCF_,
+                trajdensity=model.trajdensity_,
+            )
+            result["files"].append(base+".npz")
+            if model.plotPolar:
+                model.sectors().to_csv(base+"_sectors.csv", index=False)
+                result["files"].append(base+"_sectors.csv")
+            if plot:
+                maps = [("", model.plot_PSCF)]
+                if model.plotBT:
+                    maps.append(("_allBT", model.plot_backtraj))
+                if model.plotPolar:
+                    maps.append(("_windrose", model.plot_PSCF_polar))
+                for suffix, plot_map in maps:
+                    plot_map()
+                    plt.gcf().savefig(base+suffix+".png")
+                    plt.close("all")
+                    result["files"].append(base+suffix+".png")
+        except Exception:
+            plt.close("all")
+            result["error"] = traceback.format_exc()
+        results.append(result)
+    return results
+
+
+def run_jobs(jobs, output, n_jobs=1, plot=True):
+    """Run all the jobs, the groups of jobs in parallel.
+
+    Parameters
+    ----------
+    jobs : list of dict
+        The jobs, see :func:`read_jobs`.
+    output : str, path
+        The directory of the results.
+    n_jobs : int, default 1
+        Number of processes.
+    plot : boolean, default True
+        Either or not save the maps.
+
+    Return
+    ------
+    results : list of dict
+        See :func:`run_group`.
+    """
+    if not os.path.isdir(output):
+        os.makedirs(output)
+    groups = group_jobs(jobs)
+    if n_jobs == 1:
+        outputs = [run_group(g, output, plot) for g in groups]
+    else:
+        with ProcessPoolExecutor(n_jobs) as executor:
+            outputs = list(executor.map(run_group, groups,
+                                        [output]*len(groups),
+                                        [plot]*len(groups)))
+    return [r for results in outputs for r in results]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Run PSCF jobs without the GUI."
+    )
+    parser.add_argument("jobFile", help="the JSON job file")
+    parser.add_argument("--stations", help="the JSON file of the stations "
+                        "location (default: 'stations' of the job file)")
+    parser.add_argument("--output", help="directory of the results "
+                        "(default: 'output' of the job file, or 'output')")
+    parser.add_argument("--n-jobs", type=int, default=1,
+                        help="number of processes")
+    parser.add_argument("--no-plot", action="store_true",
+                        help="only write the grids, not the maps")
+    args = parser.parse_args(argv)
+
+    jobs = read_jobs(args.jobFile, args.stations)
+    output = args.output
+    if output is None:
+        with open(args.jobFile, "r") as f:
+            output = json.load(f).get("output", "output")
+
+    results = run_jobs(jobs, output, n_jobs=args.n_jobs,
+                       plot=not args.no_plot)
+    failed = 0
+    for r in results:
+        job = jobs[r["job"]]
+        name = "{} {} {} {} {:g}".format(job["station"], r["specie"],
+                                         job["dateMin"], job["dateMax"],
+                                         r["value"])
+        if "error" in r:
+            failed += 1
+            print("FAILED {}\n{}".format(name, r["error"]), file=sys.stderr)
+        else:
+            print("done {}: {}".format(name, ", ".join(r["files"])))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
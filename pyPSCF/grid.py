@@ -0,0 +1,197 @@
+"""Regular lon/lat grid on which the endpoints are counted."""
+import numpy as np
+
+
+# mean Earth radius (km)
+EARTH_RADIUS = 6371.
+
+
+class Grid:
+    """
+    Regular lon/lat grid of the PSCF.
+
+    The cells are identified by a flat integer index, computed once for each
+    endpoint and then used for all the counts and cell lookups.
+
+    Parameters
+    ----------
+    mapMinMax : dict
+        Dictionary of minimun/maximum of lat/lon of the grid.
+        Example:
+        mapMinMax = {'latmin': 37.5, 'latmax': 60, 'lonmin': -10, 'lonmax': 20}
+    resolution : float, default 0.5
+        Size of the cells, in degree.
+
+    Attributes
+    ----------
+    lon, lat : np.ndarray
+        The lon/lat of the lower left corner of the cells.
+    lon_map, lat_map : np.ndarray
+        The meshgrid of `lon` and `lat`.
+    shape : tuple
+        The (lon, lat) shape of the gridded arrays.
+    size : int
+        The number of cells.
+    """
+    def __init__(self, mapMinMax, resolution=0.5):
+        self.mapMinMax = mapMinMax
+        self.resolution = float(resolution)
+
+        self.lon = self._edges(mapMinMax["lonmin"], mapMinMax["lonmax"])
+        self.lat = self._edges(mapMinMax["latmin"], mapMinMax["latmax"])
+        self.lon_map, self.lat_map = np.meshgrid(self.lon, self.lat)
+        self.shape = (len(self.lon), len(self.lat))
+        self.size = self.shape[0] * self.shape[1]
+        self._sectors = {}
+
+    def __eq__(self, other):
+        return isinstance(other, Grid) and \
+            self.resolution == other.resolution and \
+            np.array_equal(self.lon, other.lon) and \
+            np.array_equal(self.lat, other.lat)
+
+    def _edges(self, vmin, vmax):
+        """Lower edge of the cells, the max being in the last cell."""
+        n = int(np.floor(round((vmax - vmin)/self.resolution, 6))) + 1
+        return vmin + self.resolution * np.arange(n)
+
+    def _index(self, x, origin, n):
+        """Index of the cell along one axis, -1 if outside the grid."""
+        q = np.round((np.asarray(x, dtype=float) - origin)/self.resolution, 6)
+        i = np.floor(q)
+        # the last cell includes its right edge
+        i[q == n] = n - 1
+        i[(i < 0) | (i >= n) | np.isnan(i)] = -1
+        return i.astype(int)
+
+    def cell_index(self, lon, lat):
+        """
+        Flat index of the cell of each (lon, lat), -1 if outside the grid.
+
+        Parameters
+        ----------
+        lon, lat : array-like
+            The coordinates of the endpoints.
+
+        Return
+        ------
+        cells : np.ndarray of int
+        """
+        ilon = self._index(lon, self.lon[0], self.shape[0])
+        ilat = self._index(lat, self.lat[0], self.shape[1])
+        return np.where((ilon >= 0) & (ilat >= 0),
+                        ilon*self.shape[1] + ilat, -1)
+
+    def unravel(self, cells):
+        """The (lon, lat) of the lower left corner of the cells."""
+        ilon, ilat = np.unravel_index(cells, self.shape)
+        return self.lon[ilon], self.lat[ilat]
+
+    def count(self, cells, weights=None):
+        """
+        Count (or sum the weights of) the endpoints in each cell.
+
+        Parameters
+        ----------
+        cells : np.ndarray of int
+            The flat index of the endpoints, see :meth:`cell_index`.
+        weights : np.ndarray, optional
+            The weight of each endpoint.
+
+        Return
+        ------
+        grid : np.ndarray
+            Of shape `shape`.
+        """
+        cells = np.asarray(cells)
+        inside = cells >= 0
+        if weights is not None:
+            weights = np.asarray(weights, dtype=float)[inside]
+        counts = np.bincount(cells[inside], weights=weights,
+                             minlength=self.size)
+        return counts.astype(float).reshape(self.shape)
+
+    def sectors(self, lon0, lat0, nsectors=16, rings=None):
+        """
+        Sector (and distance ring) of each cell around a station.
+
+        The bearing of the lower left corner of each cell is computed from
+        the station, counterclockwise from the East (as in the polar plot),
+        and binned in `nsectors` sectors, the first one being
+        `0 <= bearing <= 360/nsectors` and the next ones excluding their lower
+        edge. The result is cached, so it is computed once per station.
+
+        Parameters
+        ----------
+        lon0, lat0 : float
+            The station coordinates.
+        nsectors : int, default 16
+            Number of sectors.
+        rings : array-like, optional
+            The edges of the distance rings (km, increasing). The cells
+            outside of the rings are in no sector.
+
+        Return
+        ------
+        index : np.ndarray of int
+            Of shape `shape`, the sector of each cell plus `nsectors` times
+            its ring, -1 for the cells in no sector.
+        """
+        key = (float(lon0), float(lat0), int(nsectors),
+               None if rings is None else tuple(np.asarray(rings, float)))
+        if key in self._sectors:
+            return self._sectors[key]
+
+        lon = np.radians(self.lon)[:, np.newaxis]
+        lat = np.radians(self.lat)[np.newaxis, :]
+        lat0 = np.radians(lat0)
+        deltalon = np.radians(lon0) - lon
+        a = np.sin(deltalon) * np.cos(lat)
+        b = np.cos(lat0)*np.sin(lat) - np.sin(lat0)*np.cos(lat)*np.cos(deltalon)
+        # change the origin: from N to E, and set the angle between 0 and 2pi
+        bearing = np.arctan2(a, b) + np.pi/2
+        bearing[bearing < 0] += 2*np.pi
+        theta = np.radians(np.linspace(0, 360, nsectors+1))
+        index = np.digitize(bearing, theta[1:-1], right=True)
+
+        if rings is not None:
+            rings = np.asarray(rings, dtype=float)
+            # haversine distance
+            h = np.sin((lat - lat0)/2)**2 \
+                + np.cos(lat0)*np.cos(lat)*np.sin(deltalon/2)**2
+            distance = 2 * EARTH_RADIUS * np.arcsin(np.sqrt(h))
+            ring = np.digitize(distance, rings) - 1
+            outside = (ring < 0) | (ring >= len(rings)-1)
+            index = np.where(outside, -1, index + nsectors*ring)
+
+        self._sectors[key] = index
+        return index
+
+    def aggregate(self, values, index, n):
+        """
+        Sum gridded values by group of cells, e.g. by sector.
+
+        Parameters
+        ----------
+        values : np.ndarray
+            Of shape `(..., lon, lat)`.
+        index : np.ndarray of int
+            The group of each cell (see :meth:`sectors`), -1 for none.
+        n : int
+            The number of groups.
+
+        Return
+        ------
+        sums : np.ndarray
+            Of shape `(..., n)`.
+        """
+        values = np.asarray(values, dtype=float)
+        lead = values.shape[:-2]
+        values = values.reshape(-1, self.size)
+        index = np.asarray(index).ravel()
+        inside = index >= 0
+        # a single bincount for all the leading dimensions
+        groups = np.arange(len(values))[:, np.newaxis]*n + index[inside]
+        sums = np.bincount(groups.ravel(), weights=values[:, inside].ravel(),
+                           minlength=len(values)*n)
+        return sums.reshape(lead + (n,))
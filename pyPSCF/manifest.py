@@ -0,0 +1,202 @@
+"""Persistent manifest of the back-trajectory jobs.
+
+The state of each back-trajectory job (pending, running, done or failed) is
+recorded in a SQLite file of the output directory, with the runtime of
+HYSPLIT and the checksum, size and modification time of the output file. A
+restarted computation only runs the jobs which are not done, or whose output
+file changed or is missing, and the workers claim the jobs atomically, so that
+several computations can share the same output directory. The output files are
+only hashed again if their size or modification time changed.
+"""
+import os
+import sys
+import time
+import socket
+import sqlite3
+import hashlib
+from contextlib import contextmanager
+
+
+MANIFEST_NAME = "manifest.sqlite"
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+def file_checksum(path):
+    """SHA-1 checksum of a file."""
+    sha = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 16), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def file_stat(path):
+    """Size (byte) and modification time of a file, used to skip hashing it.
+    """
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime
+
+
+def _alive(pid):
+    """Either or not the process `pid` of this host is still running."""
+    if sys.platform == "win32":
+        # os.kill would terminate the process, rely on the timeout instead
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class JobManifest:
+    """
+    SQLite manifest of the back-trajectory jobs, one row per output file.
+
+    Each process opens its own connection, so the manifest can be used by
+    the workers of a pool.
+
+    Parameters
+    ----------
+    path : str, path
+        The SQLite file, created if needed.
+    timeout : float, optional
+        A job running for more than `timeout` seconds is considered
+        abandoned. By default, a running job is only abandoned if its
+        process (on the same host) is dead.
+    """
+    def __init__(self, path, timeout=None):
+        self.path = path
+        self.timeout = timeout
+        with self._connect() as con:
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "file TEXT PRIMARY KEY, state TEXT NOT NULL, host TEXT, "
+                "pid INTEGER, started REAL, runtime REAL, checksum TEXT, "
+                "size INTEGER, mtime REAL, message TEXT)"
+            )
+            # manifests written before the size and mtime were recorded
+            columns = [row[1] for row in
+                       con.execute("PRAGMA table_info(jobs)").fetchall()]
+            for column, kind in [("size", "INTEGER"), ("mtime", "REAL")]:
+                if column not in columns:
+                    con.execute("ALTER TABLE jobs ADD COLUMN {} {}"
+                                .format(column, kind))
+
+    @contextmanager
+    def _connect(self):
+        """Connection committed and closed at the end of the block."""
+        con = sqlite3.connect(self.path, timeout=60)
+        try:
+            with con:
+                yield con
+        finally:
+            con.close()
+
+    def jobs(self):
+        """The recorded jobs.
+
+        Return
+        ------
+        jobs : dict
+            For each file, a dict with the keys state, host, pid, started,
+            runtime, checksum, size, mtime and message.
+        """
+        with self._connect() as con:
+            con.row_factory = sqlite3.Row
+            rows = con.execute("SELECT * FROM jobs").fetchall()
+        return {row["file"]: dict(row) for row in rows}
+
+    def is_stale(self, job):
+        """Either or not a running job was abandoned by its worker."""
+        if job["state"] != RUNNING:
+            return False
+        if self.timeout is not None and \
+                time.time() - job["started"] > self.timeout:
+            return True
+        return job["host"] == socket.gethostname() and not _alive(job["pid"])
+
+    def set_pending(self, files):
+        """Record the `files` as pending, unless they are running."""
+        with self._connect() as con:
+            con.executemany(
+                "INSERT INTO jobs (file, state) VALUES (?, ?) "
+                "ON CONFLICT(file) DO UPDATE SET state=excluded.state "
+                "WHERE state!=?",
+                [(f, PENDING, RUNNING) for f in files]
+            )
+
+    def release(self, job):
+        """Set back a stale running `job` (see :meth:`jobs`) to pending.
+
+        Nothing is done if the job was claimed again in the meantime.
+        """
+        with self._connect() as con:
+            con.execute(
+                "UPDATE jobs SET state=? WHERE file=? AND state=? AND "
+                "pid=? AND started=?",
+                (PENDING, job["file"], RUNNING, job["pid"], job["started"])
+            )
+
+    def claim(self, file):
+        """Mark a pending job as running by this process.
+
+        The job is claimed by a single conditional update, so only one
+        worker gets it.
+
+        Return
+        ------
+        claimed : boolean
+            False if the job was not pending (e.g. claimed by another
+            worker).
+        """
+        with self._connect() as con:
+            cur = con.execute(
+                "UPDATE jobs SET state=?, host=?, pid=?, started=? "
+                "WHERE file=? AND state=?",
+                (RUNNING, socket.gethostname(), os.getpid(), time.time(),
+                 file, PENDING)
+            )
+            claimed = cur.rowcount == 1
+        return claimed
+
+    def finish(self, file, state, runtime=None, checksum=None, size=None,
+               mtime=None, message=None):
+        """Record the end of a job, `state` being DONE or FAILED."""
+        with self._connect() as con:
+            con.execute(
+                "INSERT INTO jobs (file, state, runtime, checksum, size, "
+                "mtime, message) VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(file) DO UPDATE SET state=excluded.state, "
+                "runtime=excluded.runtime, checksum=excluded.checksum, "
+                "size=excluded.size, mtime=excluded.mtime, "
+                "message=excluded.message",
+                (file, state, runtime, checksum, size, mtime, message)
+            )
+
+    def set_done(self, outputs):
+        """Record outputs as done in a single transaction.
+
+        Parameters
+        ----------
+        outputs : list of tuple
+            The (file, checksum, size, mtime) of each output, e.g. computed
+            before the manifest existed. The runtime of a job already
+            recorded is kept.
+        """
+        with self._connect() as con:
+            con.executemany(
+                "INSERT INTO jobs (file, state, checksum, size, mtime) "
+                "VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(file) DO UPDATE SET state=excluded.state, "
+                "checksum=excluded.checksum, size=excluded.size, "
+                "mtime=excluded.mtime",
+                [(f, DONE, checksum, size, mtime)
+                 for f, checksum, size, mtime in outputs]
+            )
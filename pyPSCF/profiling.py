@@ -0,0 +1,94 @@
+"""Instrumentation of the stages of the PSCF computation."""
+import sys
+import time
+import logging
+import tracemalloc
+from contextlib import contextmanager
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+logger = logging.getLogger("pyPSCF")
+
+
+class Profiler:
+    """
+    Collect the wall time of the stages and some counters of a run.
+
+    When disabled, all the methods do nothing, so it can be left in the code.
+    When enabled, each stage is also logged at the INFO level with the
+    "pyPSCF" logger.
+
+    Parameters
+    ----------
+    enabled : boolean, default False
+        Either or not collect the statistics.
+    memory : boolean, default False
+        Also trace the peak memory of the run with `tracemalloc`. It slows
+        down the computation a lot, so the wall times are then not
+        meaningful.
+    """
+    def __init__(self, enabled=False, memory=False):
+        self.enabled = enabled
+        self.memory = memory
+        self.stats = {"stages": {}}
+        self._tracing = False
+
+    def start(self):
+        """Reset the statistics and start tracing the memory."""
+        if not self.enabled:
+            return
+        self.stats = {"stages": {}}
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._tracing = True
+        if self.memory:
+            tracemalloc.reset_peak()
+
+    def stop(self):
+        """Stop tracing the memory.
+
+        Return
+        ------
+        stats : dict
+            The statistics: the wall time of each stage (in `stats["stages"]`),
+            the counters, the maximum resident set size of the process
+            (`max_rss`, in byte, if available) and, if `memory`, the peak
+            memory of the run (`peak_memory`, in byte).
+        """
+        if not self.enabled:
+            return None
+        if resource is not None:
+            rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            # kilobyte on Linux, byte on macOS
+            self.stats["max_rss"] = rss if sys.platform == "darwin" else rss*1024
+        if self.memory and tracemalloc.is_tracing():
+            self.stats["peak_memory"] = tracemalloc.get_traced_memory()[1]
+            if self._tracing:
+                tracemalloc.stop()
+                self._tracing = False
+        logger.info("stats: %s", self.stats)
+        return self.stats
+
+    @contextmanager
+    def stage(self, name):
+        """Time a stage. The times of the stages with the same name add up."""
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            stages = self.stats["stages"]
+            stages[name] = stages.get(name, 0) + elapsed
+            logger.info("%s: %.3f s", name, elapsed)
+
+    def count(self, name, value):
+        """Add `value` to the counter `name`."""
+        if not self.enabled:
+            return
+        self.stats[name] = self.stats.get(name, 0) + value
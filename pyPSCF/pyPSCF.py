@@ -1,21 +1,393 @@
 # -*-coding:Utf-8 -*
 import sys
 import os
+import copy
 import datetime as dt
 import numpy as np
 # import scipy
 # from scipy import signal
 import scipy.stats as sst
+from scipy import sparse
+from scipy.io import netcdf_file
 from scipy.ndimage.filters import gaussian_filter
+from scipy.ndimage import uniform_filter
 import matplotlib.pyplot as plt
+from matplotlib.collections import LineCollection
+from matplotlib.lines import Line2D
 import cartopy.crs as ccrs
 import cartopy.feature as cfeature
 import math
-import linecache
+import warnings
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 
+from pyPSCF.grid import Grid
+from pyPSCF.profiling import Profiler
+from pyPSCF.tdump import read_columns
+from pyPSCF.trajectories import Trajectories
+from pyPSCF.trajstore import TrajStore
 
-class PSCF:
+
+_SHARED = {}
+
+
+def _init_permutation(contrib, mask):
+    """Share the contributions and the mask with the pool workers."""
+    _SHARED["contrib"] = contrib
+    _SHARED["mask"] = mask
+
+
+def _permutation_chunk(mgrid, n, seed):
+    """Compute `n` mgrid with the trajectories classification shuffled.
+
+    Return
+    ------
+    count : np.ndarray
+        Number of resamples with a mgrid greater or equal to `mgrid`, per cell.
+    total, total2 : np.ndarray
+        Sum and sum of squares of the resampled mgrid, per cell.
+    """
+    contrib, mask = _SHARED["contrib"], _SHARED["mask"]
+    rng = np.random.default_rng(seed)
+    masks = rng.permuted(np.tile(mask, (n, 1)), axis=1)
+    resampled = contrib.T @ masks.T
+    count = (resampled >= mgrid[:, np.newaxis]).sum(axis=1)
+    return count, resampled.sum(axis=1), (resampled**2).sum(axis=1)
+
+
+def _init_sweep(bt, mapMinMax, concCrit):
+    """Share the full trajectories with the pool workers."""
+    _SHARED["bt"] = bt
+    _SHARED["mapMinMax"] = mapMinMax
+    _SHARED["concCrit"] = concCrit
+    _SHARED["resolution"] = None
+
+
+def _sweep_chunk(resolution, hourinthepast, rainThreshold):
+    """Count the endpoints of the trajectories cut with these parameters.
+
+    The cells of the trajectories are only computed again if the resolution
+    changes.
+
+    Return
+    ------
+    ngrid : np.ndarray
+        Of shape (lon, lat).
+    mgrid : np.ndarray
+        Of shape (concCrit, lon, lat).
+    """
+    bt, concCrit = _SHARED["bt"], _SHARED["concCrit"]
+    grid = Grid(_SHARED["mapMinMax"], resolution)
+    if _SHARED["resolution"] != resolution:
+        bt.set_cells(grid)
+        _SHARED["resolution"] = resolution
+    bt = bt.truncate(hourinthepast=hourinthepast, rainThreshold=rainThreshold)
+    contrib = bt.contributions(grid.size)
+    ngrid = grid.count(bt.cell)
+    mask = (bt.conc[:, np.newaxis] >= concCrit[np.newaxis, :]).astype(float)
+    mgrid = (contrib.T @ mask).T.reshape((len(concCrit),) + grid.shape)
+    return ngrid, mgrid
+
+
+def _run_station(model):
+    """Run the PSCF of a station and return its partial grids.
+
+    Return
+    ------
+    partial : dict
+        The date and concCrit of the model, its ngrid and mgrid and the sum
+        of the log-concentrations (`cwt_sum`) and the number of endpoints
+        (`cwt_count`) of the trajectories with a positive concentration in
+        each cell.
+    """
+    model.run()
+    conc = model.bt.conc
+    valid = np.isfinite(conc) & (conc > 0)
+    logc = np.log(conc, out=np.zeros(len(conc)), where=valid)
+    shape = model.grid.shape
+    return {
+        "date": model.date,
+        "concCrit": model.concCrit,
+        "ngrid": model.ngrid_,
+        "mgrid": model.mgrid_,
+        "cwt_sum": (model.contrib_.T @ logc).reshape(shape),
+        "cwt_count": (model.contrib_.T @ valid.astype(float)).reshape(shape),
+    }
+
+
+class PSCFResults:
+    """
+    Weighting and maps of the grids of a PSCF computation.
+
+    It is shared by :class:`PSCF` and :class:`CompositePSCF`. The class using
+    it sets the `station`, `specie`, `lat0`, `lon0`, `mapMinMax`,
+    `resolution`, `resQuality`, `smoothplot`, the weighting function
+    parameters (`wfunc`, `wfunc_type`, `wFlim`, `wFval`) and a `profiler`.
+    After a run, it sets the `date` and `concCrit` and calls
+    :meth:`_set_grid` and :meth:`_compute`. The drill-down of the maps uses
+    `bt`, `traj_` and `cell2traj_`, which may be None.
+    """
+    def toRad(self, x):
+        return x*math.pi/180
+
+    def onclick(self, event, plotType):
+        """ Find the BT which pass through the clicked cell."""
+        ax = plt.gca()
+
+        if event.button == 1 and (event.xdata and event.ydata):
+            if getattr(self, "cell2traj_", None) is None:
+                print("The back-trajectories are not kept by run_stream and "
+                      "from_netcdf.")
+                return
+            cell = self.grid.cell_index([event.xdata], [event.ydata])[0]
+            if cell < 0:
+                return
+            lon, lat = self.grid.unravel(cell)
+            print("Lon/Lat: {:.2f} / {:.2f}".format(lon, lat))
+            # find all the BT
+            rows = self.cell_trajectories(cell)
+            if plotType == "PSCF":
+                rows = rows[self.traj_["conc"].values[rows] > self.concCrit]
+            lines = LineCollection(self.bt.segments(rows), colors='0.75')
+            lines.set_gid("backtraj")
+            ax.add_collection(lines)
+            traj = self.traj_.iloc[rows]
+            for date, dateBT, conc in zip(traj["date"], traj["dateBT"],
+                                          traj["conc"]):
+                print("date: {:10} | BT: {:13}h | [x]: {:f}".format(
+                    date.strftime('%Y-%m-%d'),
+                    dateBT.strftime('%Y-%m-%d %H'),
+                    conc)
+                )
+            print("")
+            sys.stdout.flush()
+            event.canvas.draw()
+        if event.button == 3:
+
+            for artist in list(ax.lines) + list(ax.collections):
+                if isinstance(artist, Line2D) or artist.get_gid() == "backtraj":
+                    artist.remove()
+
+            if plotType == "allBT":
+                var = self.trajdensity_
+            elif plotType == "PSCF":
+                var = self.PSCF_
+            else:
+                raise ValueError("`plotType` must be in ['allBT', 'PSCF']")
+
+            if self.smoothplot:
+                var = gaussian_filter(var, 1)
+
+            ax.pcolormesh(self.lon_map, self.lat_map, var.T, cmap='hot_r')
+            ax.plot(self.lon0, self.lat0, 'o', color='0.75')
+            event.canvas.draw()
+
+    def cell_trajectories(self, cell):
+        """Trajectories passing through a cell.
+
+        Parameters
+        ----------
+        cell : int
+            Flat index of the cell (see :meth:`pyPSCF.grid.Grid.cell_index`).
+
+        Return
+        ------
+        rows : np.ndarray
+            Position of the trajectories in `traj_`.
+        """
+        indptr = self.cell2traj_.indptr
+        return self.cell2traj_.indices[indptr[cell]:indptr[cell+1]]
+
+    def _set_grid(self):
+        """Set the grid and the lon/lat of its cells."""
+        grid = Grid(self.mapMinMax, self.resolution)
+        # keep the same grid, and so its cached sectors, between runs
+        if getattr(self, "grid", None) != grid:
+            self.grid = grid
+        self.lon = self.grid.lon
+        self.lat = self.grid.lat
+        self.lon_map, self.lat_map = self.grid.lon_map, self.grid.lat_map
+
+    def _compute(self, ngrid, mgrid):
+        """Compute the PSCF and the trajectory density from ngrid and mgrid.
+
+        `mgrid` may have leading dimensions (specie, threshold, ...) before
+        the (lon, lat) ones of `ngrid`.
+        """
+        not0 = np.where(ngrid != 0)
+
+        PSCF = np.divide(mgrid, ngrid, out=np.zeros(np.shape(mgrid)),
+                         where=ngrid != 0)
+
+        trajdensity = np.zeros(np.shape(ngrid))
+        trajdensity[not0] = np.log10(ngrid[not0])
+
+        # ===== Weighting function
+        wF = None
+        if self.wfunc:
+            wF = self._weighting(ngrid, self.wfunc_type)
+            PSCF = PSCF * wF
+
+        self.ngrid_ = ngrid
+        self.mgrid_ = mgrid
+        self.PSCF_ = PSCF
+        self.trajdensity_ = trajdensity
+        self.wF_ = wF
+
+    def _weighting(self, ngrid, wfunc_type):
+        """Weighting function of each cell.
+
+        The piecewise constant weights are looked up with a single
+        `np.digitize` over the grid.
+        """
+        if callable(wfunc_type):
+            return np.asarray(wfunc_type(ngrid), dtype=float)
+
+        not0 = ngrid != 0
+        if wfunc_type == "auto":
+            wF = np.zeros(np.shape(ngrid))
+            wF[not0] = np.log(ngrid[not0])/np.log(ngrid.max())
+            return wF
+
+        wFlim, wFval = self.wFlim, self.wFval
+        if wfunc_type == "manual":
+            if wFlim is None:
+                wFlim = [0.3, 0.6, 0.85]
+            if wFval is None:
+                wFval = [0.08, 0.35, 0.725, 1.0]
+            x = np.zeros(np.shape(ngrid))
+            x[not0] = np.log10(ngrid[not0])
+            wFlim = np.asarray(wFlim, dtype=float) * x.max()
+        elif wfunc_type == "piecewise":
+            if wFlim is None or wFval is None:
+                raise ValueError("'wFlim' and 'wFval' should be specified "
+                                 "for a piecewise weighting function.")
+            x = ngrid
+            wFlim = np.asarray(wFlim, dtype=float)
+        else:
+            raise ValueError("`wfunc_type` must be 'auto', 'manual', "
+                             "'piecewise' or a function.")
+
+        wFval = np.asarray(wFval, dtype=float)
+        if len(wFval) != len(wFlim) + 1:
+            raise ValueError("'wFval' should have one more value than "
+                             "'wFlim'.")
+        if np.any(np.diff(wFlim) < 0):
+            raise ValueError("'wFlim' should be increasing.")
+        return wFval[np.digitize(x, wFlim)]
+
+    def reweight(self, wfunc=None, wfunc_type=None, wFlim=None, wFval=None):
+        """Change the weighting function of the PSCF.
+
+        Only the weights and the PSCF are computed again, from `ngrid_` and
+        `mgrid_`: the trajectories are not counted again.
+
+        Parameters
+        ----------
+        wfunc, wfunc_type, wFlim, wFval : optional
+            See :class:`PSCF`. The ones not given are not changed.
+        """
+        keys = ["wfunc", "wfunc_type", "wFlim", "wFval"]
+        old = {k: getattr(self, k) for k in keys}
+        for k, v in zip(keys, [wfunc, wfunc_type, wFlim, wFval]):
+            if v is not None:
+                setattr(self, k, v)
+        try:
+            self._compute(self.ngrid_, self.mgrid_)
+        except ValueError:
+            for k, v in old.items():
+                setattr(self, k, v)
+            raise
+
+    def plot_backtraj(self):
+        """Plot a map of all trajectories.
+        """
+        with self.profiler.stage("smooth"):
+            if self.smoothplot:
+                trajdensity = gaussian_filter(self.trajdensity_, 1)
+            else:
+                trajdensity = self.trajdensity_
+
+        with self.profiler.stage("plot"):
+            figBT = plt.figure()
+            ax = figBT.add_subplot(1, 1, 1, projection=ccrs.PlateCarree())
+            ax.set_extent(
+                [
+                    self.mapMinMax["lonmin"],
+                    self.mapMinMax["lonmax"],
+                    self.mapMinMax["latmin"],
+                    self.mapMinMax["latmax"],
+                ],
+                ccrs.PlateCarree()
+            )
+
+            ax.coastlines(resolution=self.resQuality)
+            ax.add_feature(cfeature.BORDERS.with_scale(self.resQuality),
+                           edgecolor='grey')
+
+            pmesh = ax.pcolormesh(self.lon_map, self.lat_map, trajdensity.T, cmap='hot_r')
+
+            ax.plot(self.lon0, self.lat0, 'o', color='0.75')
+
+            plotTitle = "{station}\nBacktrajectories probability (log(n))".format(
+                station=self.station
+            )
+            plt.title(plotTitle)
+
+            cid = figBT.canvas.mpl_connect('button_press_event',
+                                           lambda event: self.onclick(event, "allBT"))
+            figBT.canvas.manager.set_window_title(self.station+"_allBT")
+            if self.profiler.enabled:
+                # time the rendering, which is otherwise delayed to the display
+                figBT.canvas.draw()
+
+    def plot_PSCF(self):
+        """Plot the PSCF map.
+        """
+        with self.profiler.stage("smooth"):
+            if self.smoothplot:
+                PSCF = gaussian_filter(self.PSCF_, 1)
+            else:
+                PSCF = self.PSCF_
+
+        with self.profiler.stage("plot"):
+            fig = plt.figure()  # keep handle for the onclick function
+            ax = fig.add_subplot(1, 1, 1, projection=ccrs.PlateCarree())
+            ax.set_extent(
+                [
+                    self.mapMinMax["lonmin"],
+                    self.mapMinMax["lonmax"],
+                    self.mapMinMax["latmin"],
+                    self.mapMinMax["latmax"],
+                ],
+                ccrs.PlateCarree()
+            )
+
+            ax.coastlines(resolution=self.resQuality)
+            ax.add_feature(cfeature.BORDERS.with_scale(self.resQuality),
+                           edgecolor='grey')
+
+            pmesh = ax.pcolormesh(self.lon_map, self.lat_map, PSCF.T, cmap='hot_r')
+
+            ax.plot(self.lon0, self.lat0, 'o', color='0.75')
+
+            plotTitle = "{station}, {specie} > {concCrit}\nFrom {dmin} to {dmax}".format(
+                station=self.station, specie=self.specie,
+                concCrit=np.round(self.concCrit, 5),
+                dmin=min(self.date).strftime('%Y/%m/%d'),
+                dmax=max(self.date).strftime('%Y/%m/%d')
+            )
+            plt.title(plotTitle)
+
+            cid = fig.canvas.mpl_connect('button_press_event',
+                                         lambda event: self.onclick(event, "PSCF"))
+            fig.canvas.manager.set_window_title(self.station+self.specie)
+            if self.profiler.enabled:
+                # time the rendering, which is otherwise delayed to the display
+                fig.canvas.draw()
+
+
+class PSCF(PSCFResults):
     """
 
     Parameters
@@ -55,15 +427,34 @@ class PSCF:
         The concentration threshold. It overrides the `percentile` value.
     wfunc : boolean, default True
         Either or not use a weighting function.
-    wfunc_type : "manual" or "auto", default "auto"
-        Type of weighting function. "auto" is continuous.
+    wfunc_type : "auto", "manual", "piecewise" or callable, default "auto"
+        Type of weighting function of the cells:
+
+        - "auto": continuous, log(n)/log(n_max) with n the number of
+          endpoints of the cell,
+        - "manual": piecewise constant on the trajectory density d (log10(n)),
+          the limits `wFlim` being fractions of d_max (as in the GUI),
+        - "piecewise": piecewise constant on n, the limits `wFlim` being
+          numbers of endpoints,
+        - a function of the (lon, lat) array of n returning the weights.
+    wFlim : list of float, optional
+        The increasing limits of the "manual" and "piecewise" weighting
+        functions. By default [0.3, 0.6, 0.85] for "manual".
+    wFval : list of float, optional
+        The weights below the first limit, between the limits and above the
+        last limit (one more value than `wFlim`). By default
+        [0.08, 0.35, 0.725, 1] for "manual".
     mapMinMax : dict
         Dictionary of minimun/maximum of lat/lon for the map.
         Example:
         mapMinMax = {'latmin': 37.5, 'latmax': 60, 'lonmin': -10, 'lonmax': 20}
         This example is the default (France centered).
+    resolution : float, default 0.5
+        Size of the grid cells, in degree.
     cutWithRain : boolean, default True
         Either or not cut the backtrajectory to the last rainning date.
+    rainThreshold : float, default 0
+        The rainfall above which the backtrajectory is cut, if `cutWithRain`.
     hourinthepast : integer, default 72
         Number of hour considered for the backtrajectory life.
     resQuality : '110m' or '50m', default '110m'
@@ -81,12 +472,41 @@ class PSCF:
     pd_kwarg : dict, optional
         Dictionary of option pass to pd.read_csv to read the concentration
         file. By default, pd_kwarg={'index_col'=0, 'parse_date'=['date']}.
+    store : TrajStore or str, path, optional
+        A trajectory store (see :func:`pyPSCF.trajstore.ingest`). If given,
+        the back-trajectories are read from it instead of the `folder` files.
+    profile : boolean or "memory", default False
+        Collect the wall time of each stage, the number of files read and
+        missing, of trajectories and endpoints and the maximum memory of the
+        process in the `stats_` dictionary. They are also logged with the
+        "pyPSCF" logger at the INFO level. The plots add their smooth and
+        plot stages, the figure being drawn within the plot stage. With
+        "memory", the peak memory of the run is also traced with
+        `tracemalloc`, which slows it down.
+    progress : callable, optional
+        Called with the number of back-trajectory files read and to read
+        while they are read. It may raise an exception to stop the run (see
+        :mod:`pyPSCF.background`).
+    cache : boolean, default False
+        Keep the full back-trajectories (all the hours of the files, with
+        their rain) in memory, so `hourinthepast`, `cutWithRain` and
+        `rainThreshold` can be changed and the model run again without
+        reading the files again. See :meth:`clear_cache` to free this memory.
+
+    Notes
+    -----
+    By default, only the endpoints younger than `hourinthepast` are read
+    (the endpoints being hourly) and nothing is kept but the cut
+    trajectories in `bt`. :meth:`sweep` reads the full back-trajectories,
+    once per call, or takes them from memory with `cache`.
     """
     def __init__(self, station, specie, lat0, lon0, folder, prefix, add_hour,
                  concFile, dateMin, dateMax, percentile=75, threshold=None,
                  wfunc=True, wfunc_type="auto", resQuality="110m", smoothplot=True,
                  mapMinMax=None, cutWithRain=True, hourinthepast=72,
-                 plotBT=True, plotPolar=True, pd_kwarg=None):
+                 plotBT=True, plotPolar=True, pd_kwarg=None, store=None,
+                 resolution=0.5, profile=False, rainThreshold=0,
+                 wFlim=None, wFval=None, progress=None, cache=False):
 
         self.station = station
         self.specie = specie
@@ -104,291 +524,1026 @@ class PSCF:
         else:
             self.mapMinMax = {'latmin': 37.5, 'latmax': 60,
                               'lonmin': -10, 'lonmax': 20}
+        self.resolution = resolution
         self.dateMin = dateMin
         self.dateMax = dateMax
 
-        # TODO: properly handle pd_kwarg
-        self.data = pd.read_csv(concFile,
-                                index_col=0,
-                                parse_dates=["date"], **pd_kwarg)
+        self.concFile = concFile
+        self.pd_kwarg = pd_kwarg if pd_kwarg else {}
+        self._data = None
 
         self.wfunc = wfunc
         self.wfunc_type = wfunc_type
+        self.wFlim = wFlim
+        self.wFval = wFval
         self.plotBT = plotBT
         self.plotPolar = plotPolar
         self.smoothplot = smoothplot
 
         self.cutWithRain = cutWithRain
+        self.rainThreshold = rainThreshold
         self.hourinthepast = hourinthepast
 
-    def toRad(self, x):
-        return x*math.pi/180
+        if store is not None and not isinstance(store, TrajStore):
+            store = TrajStore(store)
+        self.store = store
 
-    def onclick(self, event, plotType):
-        """ Find the BT which pass through the clicked cell."""
-        ax = plt.gca()
+        self.profiler = Profiler(bool(profile), memory=profile == "memory")
+        self.progress = progress
 
-        if event.button == 1 and (event.xdata and event.ydata):
-            lon, lat = event.xdata, event.ydata
-            lon = np.floor(lon*2)/2
-            lat = np.floor(lat*2)/2
-            print("Lon/Lat: {:.2f} / {:.2f}".format(lon, lat))
-            # find all the BT
-            lonNorm = np.floor(self.bt["lon"]*2)/2
-            latNorm = np.floor(self.bt["lat"]*2)/2
-            df = self.bt[((lonNorm == lon) & (latNorm == lat))]
-            if plotType == "PSCF":
-                df = df[:][df["conc"] > self.concCrit]
-            for i in np.unique(df["dateBT"]):
-                tmp = self.bt[:][self.bt["dateBT"] == i]
-                ax.plot(tmp["lon"], tmp["lat"], '-', color='0.75')  # , marker='.')
-                print("date: {:10} | BT: {:13}h | [x]: {:f}".format(
-                    tmp["date"].iloc[0].strftime('%Y-%m-%d'),
-                    tmp["dateBT"].iloc[0].strftime('%Y-%m-%d %H'),
-                    tmp["conc"].iloc[0])
-                )
-            print("")
-            sys.stdout.flush()
-            event.canvas.draw()
-        if event.button == 3:
+        self.cache = cache
+        self._cache = None
 
-            ax.lines = []
+    @property
+    def data(self):
+        """The concentrations, read from `concFile` at the first use."""
+        if self._data is None:
+            self._data = self._read_data()
+        return self._data
 
-            if plotType == "allBT":
-                var = self.trajdensity_
-            elif plotType == "PSCF":
-                var = self.PSCF_
+    @data.setter
+    def data(self, data):
+        self._data = data
+
+    def _read_data(self):
+        """Read the concentration file."""
+        # TODO: properly handle pd_kwarg
+        return pd.read_csv(self.concFile,
+                           index_col=0,
+                           parse_dates=["date"], **self.pd_kwarg)
+
+    def _read_files(self, datesBT, nrows=None):
+        """Read the back-trajectories files starting at `datesBT`.
+
+        Parameters
+        ----------
+        datesBT : pd.DatetimeIndex
+            The starting dates of the trajectories.
+        nrows : int, optional
+            Number of endpoints to read in each file.
+
+        Return
+        ------
+        found : np.ndarray of boolean
+            Either or not each file exists.
+        length : np.ndarray
+            Number of endpoints of each found trajectory.
+        data : dict of np.ndarray
+            The lon, lat, age and RAINFALL endpoints of the found trajectories,
+            one after another.
+        """
+        found = np.zeros(len(datesBT), dtype=bool)
+        columns = ["lon", "lat", "age", "RAINFALL"]
+        endpoints = []
+        for i, dateBT in enumerate(datesBT):
+            name = self.prefix + dateBT.strftime('%y%m%d%H')
+            datafile = os.path.join(self.folder, name)
+            if os.path.isfile(datafile):
+                found[i] = True
+                endpoints.append(read_columns(datafile, columns, nrows=nrows))
+            if self.progress is not None:
+                self.progress(i+1, len(datesBT))
+
+        length = np.array([len(e) for e in endpoints], dtype=int)
+        if endpoints:
+            endpoints = np.concatenate(endpoints)
+            data = {c: endpoints[c] for c in columns}
+        else:
+            data = {c: np.zeros(0) for c in columns}
+        return found, length, data
+
+    def _load(self, datesBT, cache=False, nrows=None):
+        """The full back-trajectories starting at `datesBT`.
+
+        The trajectories not yet in the cache are read from the files or the
+        store.
+
+        Parameters
+        ----------
+        datesBT : pd.DatetimeIndex
+            The starting dates of the trajectories.
+        cache : boolean, default False
+            Either or not take the trajectories from and keep them in the
+            cache.
+        nrows : int, optional
+            Only read the first `nrows` endpoints of each trajectory. The
+            trajectories are then neither taken from nor kept in the cache.
+
+        Return
+        ------
+        found : np.ndarray of boolean
+            Either or not each trajectory exists.
+        bt : Trajectories
+            The found trajectories, with their rain. Their `date` is the
+            starting date and their `conc` is not set.
+        """
+        pool = self._cache if cache and nrows is None else None
+        if pool is None:
+            pool = Trajectories([], [], [], [0], [], [], [], rain=[])
+        cached = pd.DatetimeIndex(pool.dateBT)
+
+        # ===== read the trajectories not in the cache
+        toread = datesBT[~datesBT.isin(cached)].unique()
+        if len(toread):
+            if self.store is None:
+                found, length, data = self._read_files(toread, nrows)
             else:
-                raise ValueError("`plotType` must be in ['allBT', 'PSCF']")
+                found, length, data = self.store.select(
+                    toread, ["lon", "lat", "age", "RAINFALL"], nrows=nrows
+                )
+                if self.progress is not None:
+                    self.progress(len(toread), len(toread))
+            self.profiler.count("files", int(found.sum()))
+            new = Trajectories(
+                toread[found], toread[found], np.full(found.sum(), np.nan),
+                np.concatenate(([0], np.cumsum(length))),
+                data["lon"], data["lat"], data["age"], rain=data["RAINFALL"]
+            )
+            pool = Trajectories.concatenate([pool, new])
+            pool = pool.take(np.argsort(pool.dateBT, kind="stable"))
+            cached = pd.DatetimeIndex(pool.dateBT)
+            if cache and nrows is None:
+                self._cache = pool
 
-            if self.smoothplot:
-                var = gaussian_filter(var, 1)
+        rows = cached.get_indexer(datesBT)
+        found = rows >= 0
+        return found, pool.take(rows[found])
 
-            ax.pcolormesh(self.lon_map, self.lat_map, var.T, cmap='hot_r')
-            ax.plot(self.lon0, self.lat0, 'o', color='0.75')
-            event.canvas.draw()
+    def clear_cache(self):
+        """Free the back-trajectories kept in memory."""
+        self._cache = None
 
-    def extractBackTraj(self):
+    def extractBackTraj(self, date=None, conc=None, cache=None,
+                        truncate=True):
         """
-        Sum up back trajectories file into a pandas DataFrame according to the
-        class parameters.
+        Gather the back trajectories files into a :class:`Trajectories`
+        according to the class parameters.
+
+        The trajectories are read at once, either from the files or from the
+        trajectory store, unless they are already in memory. They are then
+        cut by age and rain all together. The trajectories without any
+        endpoint left (e.g. raining at their start) are dropped.
+
+        Parameters
+        ----------
+        date : list of datetime, optional
+            The dates of the samples. By default `self.date`.
+        conc : list of float, optional
+            The concentrations of the samples. By default `self.conc`.
+        cache : boolean, optional
+            Read the full trajectories and keep them in memory for the next
+            runs. Otherwise, the trajectories in memory are not used either
+            and, if `truncate`, only the endpoints younger than
+            `hourinthepast` are read (the endpoints being hourly). By default
+            `self.cache`.
+        truncate : boolean, default True
+            Cut the trajectories by age and rain. Otherwise the full
+            trajectories are returned.
 
         Return
         ------
-        df : pd.DataFrame
+        bt : Trajectories
+            The sample date, starting date and concentration of each
+            trajectory and their lon, lat, age (hour) and rain endpoints.
         """
-        df = pd.DataFrame()
-        for date, conc in zip(self.date, self.conc):
+        if date is None:
+            date, conc = self.date, self.conc
+
+        # ===== list the back traj needed
+        dates = []
+        datesBT = []
+        concs = []
+        for date, conc in zip(date, conc):
             # find all back traj for the date d
             for hour in self.add_hour:
-                # open back traj file
-                # name = self.prefix + aammddhh(date+dt.timedelta(hours=hour))
-                name = self.prefix + \
-                        (date+dt.timedelta(hours=hour)).strftime('%y%m%d%H')
-                datafile = os.path.join(self.folder, name)
-
-                if not os.path.isfile(datafile):
-                    print('Back-trajectory {} file is missing'.format(name))
-                    continue
-                else:
-                    # add the lon/lat of the BT
-                    nb_line_to_skip = linecache.getline(datafile, 1).split()
-                    nb_line_to_skip = int(nb_line_to_skip[0])
-                    meteo_idx = linecache.getline(datafile, nb_line_to_skip+4).split()
-                    idx_names = ["a", "b", "year", "month", "day", "hour", "c",
-                                 "d", "run", "lat", "lon", "alt"]
-                    idx_names = np.hstack((idx_names, meteo_idx[1:]))
-
-                    traj = pd.read_table(datafile,
-                                         delim_whitespace=True,
-                                         header=None,
-                                         names=idx_names,
-                                         skiprows=nb_line_to_skip+4,
-                                         nrows=self.hourinthepast)
-                    lat = traj["lat"]
-                    lon = traj["lon"]
-                    rain = traj["RAINFALL"]
-
-                    # if it was raining at least one time, we cut it
-                    if self.cutWithRain and any(rain > 0):
-                        idx_rain = np.where(rain != 0)[0][0]
-                        lat = lat[:idx_rain]
-                        lon = lon[:idx_rain]
-
-                    dftmp = pd.DataFrame(data={
-                        "date": date,
-                        "dateBT": date+dt.timedelta(hours=hour),
-                        "conc": conc,
-                        "lon": lon,
-                        "lat": lat
-                    })
-
-                    df = pd.concat([df, dftmp])
+                dates.append(date)
+                datesBT.append(date+dt.timedelta(hours=hour))
+                concs.append(conc)
+        dates = pd.DatetimeIndex(dates)
+        datesBT = pd.DatetimeIndex(datesBT)
+        concs = np.asarray(concs, dtype=float)
 
-        return df
+        # ===== read them
+        if cache is None:
+            cache = self.cache
+        nrows = None
+        if truncate and not cache:
+            nrows = int(np.ceil(self.hourinthepast))
+        found, bt = self._load(datesBT, cache=cache, nrows=nrows)
+        for dateBT in datesBT[~found]:
+            name = self.prefix + dateBT.strftime('%y%m%d%H')
+            print('Back-trajectory {} file is missing'.format(name))
+        self.profiler.count("missing_files", int((~found).sum()))
+        bt.date = dates[found].values
+        bt.conc = concs[found]
+
+        # ===== cut them by age and, if it was raining, at the first rain
+        if truncate:
+            bt = bt.truncate(
+                hourinthepast=int(self.hourinthepast),
+                rainThreshold=self.rainThreshold if self.cutWithRain else None
+            )
+
+        return bt
+
+    def _get_concCrit(self):
+        """Critical concentration from the percentile or the threshold."""
+        if self.percentile:
+            concCrit = sst.scoreatpercentile(self.conc, self.percentile)
+        elif self.threshold:
+            concCrit = self.threshold
+        else:
+            raise ValueError("'percentile' or 'threshold' shoud be specified.'")
+        # if len(concCrit)==1:
+        #     concCrit = concCrit[0]
+        return concCrit
+
+    def _contributions(self, bt):
+        """Count the endpoints of each trajectory in each cell.
+
+        The cells of `bt` must be set (see :meth:`Trajectories.set_cells`).
+
+        Return
+        ------
+        traj : pd.DataFrame
+            The date, dateBT and conc of each trajectory of `bt`.
+        contrib : scipy.sparse.csr_matrix
+            Number of endpoints of each trajectory (row) in each cell (column).
+        """
+        return bt.meta(), bt.contributions(self.grid.size)
+
+    def _set_index(self):
+        """Build the inverted index of the trajectories in each cell.
+
+        Sets `cell2traj_`, a CSC matrix whose column c holds the rows of
+        `traj_` (and `bt`) passing through the cell c.
+        """
+        self.cell2traj_ = self.contrib_.tocsc()
 
     def run(self):
         """Run the PSCF model"""
+        profiler = self.profiler
+        profiler.start()
         specie = self.specie
-        percentile = self.percentile
-        threshold = self.threshold
-        data = self.data
-        mapMinMax = self.mapMinMax
 
-        # extract relevant info
-        # date format for the file "YYYY-MM-DD HH:MM"
-        data = data[(data.index > self.dateMin) & (data.index < self.dateMax)]
+        with profiler.stage("filter"):
+            data = self.data
 
-        self.date = data.index
+            # extract relevant info
+            # date format for the file "YYYY-MM-DD HH:MM"
+            data = data[(data.index > self.dateMin) & (data.index < self.dateMax)]
 
-        self.conc = data[specie]
+            self.date = data.index
+
+            self.conc = data[specie]
+
+            # ===== critical concentration
+            self.concCrit = self._get_concCrit()
 
-        # ===== critical concentration
-        if percentile:
-            concCrit = sst.scoreatpercentile(self.conc, percentile)
-        elif threshold:
-            concCrit = threshold
-        else:
-            raise ValueError("'percentile' or 'threshold' shoud be specified.'")
-        # if len(concCrit)==1:
-        #     concCrit = concCrit[0]
-        self.concCrit = concCrit
-        
-        
         # ===== Extract all back-traj needed        ===========================
-        self.bt = self.extractBackTraj()
-
-        # ===== convert lon/lat to 0, 0.5, 1, etc
-        # +0.1 in order to have the max in the array
-        self.lon = np.arange(mapMinMax["lonmin"], mapMinMax["lonmax"]+0.01, 0.5) 
-        self.lat = np.arange(mapMinMax["latmin"], mapMinMax["latmax"]+0.01, 0.5)
-        self.lon_map, self.lat_map = np.meshgrid(self.lon, self.lat)
-
-        ngrid, xedges, yedges = np.histogram2d(self.bt["lon"],
-                                               self.bt["lat"],
-                                               bins=[
-                                                   np.hstack((self.lon,
-                                                              self.lon[-1]+0.5)),
-                                                   np.hstack((self.lat,
-                                                              self.lat[-1]+0.5))
-                                               ])
-        maskgtconcCrit = self.bt["conc"] >= concCrit
-        mgrid, xedges, yedges = np.histogram2d(self.bt.loc[maskgtconcCrit, "lon"],
-                                               self.bt.loc[maskgtconcCrit, "lat"],
-                                               bins=[
-                                                   np.hstack((self.lon,
-                                                              self.lon[-1]+0.5)),
-                                                   np.hstack((self.lat,
-                                                              self.lat[-1]+0.5))
-                                               ])
+        with profiler.stage("load"):
+            self.bt = self.extractBackTraj()
 
-        not0 = np.where(ngrid != 0)
+        # ===== count the endpoints in each cell
+        with profiler.stage("bin"):
+            self._set_grid()
+            self.bt.set_cells(self.grid)
+            self.traj_, self.contrib_ = self._contributions(self.bt)
+            self._set_index()
 
-        PSCF = np.zeros(np.shape(ngrid))
-        PSCF[not0] = mgrid[not0]/ngrid[not0]
+            ngrid = self.grid.count(self.bt.cell)
+            mask = (self.bt.conc >= self.concCrit).astype(float)
+            mgrid = (self.contrib_.T @ mask).reshape(self.grid.shape)
 
-        trajdensity = np.zeros(np.shape(ngrid))
-        trajdensity[not0] = np.log10(ngrid[not0])
+        with profiler.stage("weight"):
+            self._compute(ngrid, mgrid)
 
-        # ===== Weighting function
-        if self.wfunc:
-            wF = np.zeros(np.shape(ngrid))
-            # TODO: "manual" is not yet implemented in the API
-            if self.wfunc_type == "manual":
-                self.wfunc_type = "auto"
-
-            if self.wfunc_type == "manual":
-                wFlim=np.array([ float(param["wFlim"][0]), float(param["wFlim"][1]), float(param["wFlim"][2]) ]) *trajdensity.max()
-                wFval=np.array([ float(param["wFval"][0]), float(param["wFval"][1]), float(param["wFval"][2]), float(param["wFval"][3]) ])
-
-                wF[ np.where( trajdensity <  wFlim[0]) ]=wFval[0]
-                wF[ np.where((trajdensity >= wFlim[0]) & (trajdensity<wFlim[1]))]=wFval[1]
-                wF[ np.where((trajdensity >= wFlim[1]) & (trajdensity<wFlim[2]))]=wFval[2]
-                wF[ np.where( trajdensity >= wFlim[2]) ]=wFval[3]
-            elif self.wfunc_type == "auto":
-                # m0 = np.where(mgrid !=0)
-                # wF[m0] = np.log(mgrid[m0])/np.log(ngrid.max())
-                wF[not0] = np.log(ngrid[not0])/np.log(ngrid.max())
+        profiler.count("trajectories", len(self.bt))
+        profiler.count("endpoints", self.bt.size)
+        self.stats_ = profiler.stop()
 
-            PSCF = PSCF * wF
+    def run_stream(self, max_endpoints=1000000):
+        """Run the PSCF model with a bounded memory.
 
-        self.ngrid_ = ngrid
-        self.mgrid_ = mgrid
-        self.PSCF_ = PSCF
-        self.trajdensity_ = trajdensity
+        The back-trajectories are read by chunks of samples and their
+        endpoints are counted on the fly in `ngrid_` and `mgrid_`, so the
+        memory does not depend on the length of the period. The results are
+        the same as :meth:`run`, but the back-trajectories are not kept:
+        `bt`, `traj_` and `contrib_` are None, so the drill-down of the
+        plots, :meth:`update`, :meth:`significance` and :meth:`cwt` are not
+        available. Only the endpoints younger than `hourinthepast` are read
+        (the endpoints being hourly), and the trajectories are neither taken
+        from nor kept in memory, even with `cache`.
 
-    def plot_backtraj(self):
-        """Plot a map of all trajectories.
+        Parameters
+        ----------
+        max_endpoints : int, default 1000000
+            Maximum number of endpoints read at once.
         """
-        figBT = plt.figure()
-        ax = figBT.add_subplot(1, 1, 1, projection=ccrs.PlateCarree())
-        ax.set_extent(
-            [
-                self.mapMinMax["lonmin"],
-                self.mapMinMax["lonmax"],
-                self.mapMinMax["latmin"],
-                self.mapMinMax["latmax"],
-            ],
-            ccrs.PlateCarree()
+        profiler = self.profiler
+        profiler.start()
+
+        with profiler.stage("filter"):
+            data = self.data
+
+            # extract relevant info
+            data = data[(data.index > self.dateMin) & (data.index < self.dateMax)]
+
+            self.date = data.index
+
+            self.conc = data[self.specie]
+
+            # ===== critical concentration
+            self.concCrit = self._get_concCrit()
+
+        # ===== accumulate the back-traj by chunks of samples
+        self._set_grid()
+        ngrid = np.zeros(self.grid.shape)
+        mgrid = np.zeros(self.grid.shape)
+        nrows = int(np.ceil(self.hourinthepast))
+        chunksize = max(1, int(max_endpoints // (len(self.add_hour) * nrows)))
+        for start in range(0, len(self.date), chunksize):
+            with profiler.stage("load"):
+                bt = self.extractBackTraj(self.date[start:start+chunksize],
+                                          self.conc.iloc[start:start+chunksize],
+                                          cache=False)
+            with profiler.stage("bin"):
+                cell = bt.set_cells(self.grid)
+                ngrid += self.grid.count(cell)
+                mgrid += self.grid.count(cell,
+                                         weights=bt.repeat(bt.conc >= self.concCrit))
+            profiler.count("trajectories", len(bt))
+            profiler.count("endpoints", bt.size)
+
+        self.bt = None
+        self.traj_ = None
+        self.contrib_ = None
+        self.cell2traj_ = None
+
+        with profiler.stage("weight"):
+            self._compute(ngrid, mgrid)
+        self.stats_ = profiler.stop()
+
+    def update(self):
+        """Update the PSCF with the new samples of the concentration file.
+
+        The concentration file is read again and only the back-trajectories of
+        the samples not yet accounted are extracted. Their contributions are
+        added to `ngrid_` and `mgrid_`. If the critical concentration changes,
+        only the contributions of the trajectories whose classification
+        flipped are added to or removed from `mgrid_`.
+
+        If the model was never run (see also :meth:`load_state`), it is
+        equivalent to :meth:`run`.
+        """
+        if getattr(self, "contrib_", None) is None:
+            return self.run()
+
+        profiler = self.profiler
+        profiler.start()
+
+        with profiler.stage("filter"):
+            self.data = self._read_data()
+            data = self.data
+            data = data[(data.index > self.dateMin) & (data.index < self.dateMax)]
+            new = ~data.index.isin(self.date)
+
+            self.date = data.index
+            self.conc = data[self.specie]
+
+        # ===== trajectories whose classification flipped
+        with profiler.stage("bin"):
+            oldCrit = self.concCrit
+            self.concCrit = self._get_concCrit()
+            conc = self.traj_["conc"].values
+            flip = (conc >= self.concCrit).astype(float) - (conc >= oldCrit)
+            shape = self.grid.shape
+            mgrid = self.mgrid_ + (self.contrib_.T @ flip).reshape(shape)
+            ngrid = self.ngrid_.copy()
+
+        # ===== new trajectories
+        if new.any():
+            with profiler.stage("load"):
+                bt = self.extractBackTraj(data.index[new], data.loc[new, self.specie])
+            with profiler.stage("bin"):
+                bt.set_cells(self.grid)
+                _, contrib = self._contributions(bt)
+                ngrid += self.grid.count(bt.cell)
+                mask = (bt.conc >= self.concCrit).astype(float)
+                mgrid += (contrib.T @ mask).reshape(shape)
+
+                self.bt = Trajectories.concatenate([self.bt, bt])
+                self.traj_ = self.bt.meta()
+                self.contrib_ = sparse.vstack([self.contrib_, contrib],
+                                              format="csr")
+                self._set_index()
+            profiler.count("trajectories", len(bt))
+            profiler.count("endpoints", bt.size)
+
+        with profiler.stage("weight"):
+            self._compute(ngrid, mgrid)
+        self.stats_ = profiler.stop()
+
+    def save_state(self, filename):
+        """Save the grids and the per-trajectory contributions.
+
+        The saved state can be loaded by :meth:`load_state` and updated with
+        new samples by :meth:`update`.
+
+        Parameters
+        ----------
+        filename : str, path
+            The npz file.
+        """
+        np.savez_compressed(
+            filename,
+            mapMinMax=np.array([self.mapMinMax[k] for k in
+                                ["lonmin", "lonmax", "latmin", "latmax"]],
+                               dtype=float),
+            resolution=self.grid.resolution,
+            date=self.date.values,
+            concCrit=self.concCrit,
+            ngrid=self.ngrid_,
+            mgrid=self.mgrid_,
+            traj_date=self.bt.date,
+            traj_dateBT=self.bt.dateBT,
+            traj_conc=self.bt.conc,
+            contrib_data=self.contrib_.data,
+            contrib_indices=self.contrib_.indices,
+            contrib_indptr=self.contrib_.indptr,
+            contrib_shape=self.contrib_.shape,
+            bt_offsets=self.bt.offsets,
+            bt_lon=self.bt.lon,
+            bt_lat=self.bt.lat,
+            bt_age=self.bt.age,
         )
-        if self.smoothplot:
-            trajdensity = gaussian_filter(self.trajdensity_, 1)
-        else:
-            trajdensity = self.trajdensity_
 
-        ax.coastlines(resolution=self.resQuality)
-        ax.add_feature(cfeature.BORDERS.with_scale(self.resQuality),
-                       edgecolor='grey')
+    def load_state(self, filename):
+        """Load a state saved by :meth:`save_state`.
+
+        The grid of the state must be the one of the model.
+
+        Parameters
+        ----------
+        filename : str, path
+            The npz file.
+        """
+        with np.load(filename) as state:
+            self._set_grid()
+            grid = Grid(dict(zip(["lonmin", "lonmax", "latmin", "latmax"],
+                                 state["mapMinMax"])),
+                        state["resolution"][()])
+            if grid != self.grid:
+                raise ValueError("The grid of the state is not the grid of "
+                                 "the model (see `mapMinMax` and "
+                                 "`resolution`).")
+
+            self.date = pd.DatetimeIndex(state["date"])
+            self.conc = self.data.loc[self.data.index.isin(self.date),
+                                      self.specie]
+            self.concCrit = state["concCrit"][()]
+
+            self.bt = Trajectories(
+                state["traj_date"], state["traj_dateBT"], state["traj_conc"],
+                state["bt_offsets"], state["bt_lon"], state["bt_lat"],
+                state["bt_age"],
+            )
+            self.bt.set_cells(self.grid)
+            self.traj_ = self.bt.meta()
+            self.contrib_ = sparse.csr_matrix(
+                (state["contrib_data"], state["contrib_indices"],
+                 state["contrib_indptr"]),
+                shape=tuple(state["contrib_shape"])
+            )
+            self._set_index()
+
+            self._compute(state["ngrid"], state["mgrid"])
+
+    def to_netcdf(self, filename):
+        """Save the results in a NetCDF file.
+
+        The file holds the grids (`ngrid`, `mgrid`, `PSCF`, `trajdensity`,
+        the weighting function `wF` and, if computed, `pvalue`, `CWT` and
+        `RCWT`) on the (lon, lat) grid, the dates of the samples, and the
+        station, specie, critical concentration and parameters of the run as
+        global attributes. It can be read back with :meth:`from_netcdf`.
+
+        Parameters
+        ----------
+        filename : str, path
+            The NetCDF (version 3) file.
+        """
+        with netcdf_file(filename, "w", version=2) as f:
+            f.title = "PSCF of {} at {}".format(self.specie, self.station)
+            f.history = "Created {} by pyPSCF".format(
+                dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+            attrs = {
+                "station": str(self.station),
+                "specie": str(self.specie),
+                "concCrit": float(self.concCrit),
+                "lat0": self.lat0,
+                "lon0": self.lon0,
+                "folder": str(self.folder),
+                "prefix": str(self.prefix),
+                "concFile": str(self.concFile),
+                "dateMin": str(self.dateMin),
+                "dateMax": str(self.dateMax),
+                "resolution": self.grid.resolution,
+                "add_hour": self.add_hour,
+                "hourinthepast": self.hourinthepast,
+                "cutWithRain": int(self.cutWithRain),
+                "rainThreshold": self.rainThreshold,
+                "wfunc": int(bool(self.wfunc)),
+                "wfunc_type": getattr(self.wfunc_type, "__name__",
+                                      str(self.wfunc_type)),
+            }
+            attrs.update(self.mapMinMax)
+            if self.percentile:
+                attrs["percentile"] = self.percentile
+            for k, v in attrs.items():
+                if isinstance(v, str):
+                    setattr(f, k, v)
+                elif isinstance(v, int):
+                    setattr(f, k, np.int32(v))
+                else:
+                    # as double, plain floats are written as float
+                    setattr(f, k, np.asarray(v, dtype=np.float64))
+
+            f.createDimension("lon", len(self.lon))
+            f.createDimension("lat", len(self.lat))
+            f.createDimension("date", len(self.date))
+
+            lon = f.createVariable("lon", "d", ("lon",))
+            lon[:] = self.lon
+            lon.units = "degrees_east"
+            lon.long_name = "longitude of the lower left corner of the cells"
+            lat = f.createVariable("lat", "d", ("lat",))
+            lat[:] = self.lat
+            lat.units = "degrees_north"
+            lat.long_name = "latitude of the lower left corner of the cells"
+            date = f.createVariable("date", "d", ("date",))
+            date[:] = (self.date.values - np.datetime64("1970-01-01")) \
+                / np.timedelta64(1, "h")
+            date.units = "hours since 1970-01-01 00:00:00"
+            date.long_name = "date of the samples"
+
+            grids = {
+                "ngrid": (self.ngrid_, "number of endpoints"),
+                "mgrid": (self.mgrid_, "number of endpoints above concCrit"),
+                "PSCF": (self.PSCF_, "potential source contribution function"),
+                "trajdensity": (self.trajdensity_, "log10 of ngrid"),
+                "wF": (getattr(self, "wF_", None), "weighting function"),
+                "pvalue": (getattr(self, "pvalue_", None),
+                           "p-value of the permutation test"),
+                "CWT": (getattr(self, "CWT_", None),
+                        "concentration-weighted trajectory"),
+                "RCWT": (getattr(self, "RCWT_", None),
+                         "redistributed concentration-weighted trajectory"),
+            }
+            for name, (values, long_name) in grids.items():
+                if values is None:
+                    continue
+                var = f.createVariable(name, "d", ("lon", "lat"))
+                var[:] = values
+                var.long_name = long_name
 
-        pmesh = ax.pcolormesh(self.lon_map, self.lat_map, trajdensity.T, cmap='hot_r')
+    @classmethod
+    def from_netcdf(cls, filename, mmap=True):
+        """Load the results saved by :meth:`to_netcdf`.
 
-        ax.plot(self.lon0, self.lat0, 'o', color='0.75')
+        The model can be plotted (without the drill-down of the
+        trajectories) or combined with others. The concentration file is not
+        read.
 
-        plotTitle = "{station}\nBacktrajectories probability (log(n))".format(
-            station=self.station
+        Parameters
+        ----------
+        filename : str, path
+            The NetCDF file.
+        mmap : boolean, default True
+            Memory-map the grids instead of reading them. The file is then
+            kept open as long as the model exists.
+
+        Return
+        ------
+        model : PSCF
+        """
+        f = netcdf_file(filename, "r", mmap=mmap)
+        attrs = {k: (v.decode() if isinstance(v, bytes) else v)
+                 for k, v in f._attributes.items()}
+
+        model = cls(
+            station=attrs["station"],
+            specie=attrs["specie"],
+            lat0=attrs["lat0"],
+            lon0=attrs["lon0"],
+            folder=attrs["folder"],
+            prefix=attrs["prefix"],
+            add_hour=np.atleast_1d(attrs["add_hour"]).tolist(),
+            concFile=attrs["concFile"],
+            dateMin=attrs["dateMin"],
+            dateMax=attrs["dateMax"],
+            percentile=attrs.get("percentile"),
+            threshold=None if "percentile" in attrs else float(attrs["concCrit"]),
+            wfunc=bool(attrs["wfunc"]),
+            wfunc_type=attrs["wfunc_type"],
+            mapMinMax={k: float(attrs[k]) for k in
+                       ["lonmin", "lonmax", "latmin", "latmax"]},
+            resolution=float(attrs["resolution"]),
+            cutWithRain=bool(attrs["cutWithRain"]),
+            rainThreshold=float(attrs["rainThreshold"]),
+            hourinthepast=float(attrs["hourinthepast"]),
         )
-        plt.title(plotTitle)
+        model.concCrit = float(attrs["concCrit"])
+
+        model._set_grid()
+        if not (np.allclose(model.lon, f.variables["lon"][:]) and
+                np.allclose(model.lat, f.variables["lat"][:])):
+            raise ValueError("The grid of {} is not regular.".format(filename))
+        model.date = pd.DatetimeIndex(
+            np.datetime64("1970-01-01")
+            + (f.variables["date"][:] * 3600).astype("timedelta64[s]")
+        )
+
+        variables = f.variables
+        model.ngrid_ = variables["ngrid"][:]
+        model.mgrid_ = variables["mgrid"][:]
+        model.PSCF_ = variables["PSCF"][:]
+        model.trajdensity_ = variables["trajdensity"][:]
+        model.wF_ = variables["wF"][:] if "wF" in variables else None
+        for name in ["pvalue", "CWT", "RCWT"]:
+            if name in variables:
+                setattr(model, name+"_", variables[name][:])
+
+        model.bt = None
+        model.traj_ = None
+        model.contrib_ = None
+        model.cell2traj_ = None
+        if mmap:
+            # the memory-mapped grids need the file to stay open
+            model._netcdf = f
+        else:
+            f.close()
+        return model
+
+    def significance(self, n_resamples=1000, chunksize=100, n_jobs=1,
+                     random_state=None):
+        """Permutation test of the PSCF of each cell.
+
+        The concentrations are shuffled across the trajectories
+        `n_resamples` times and `mgrid_` is recomputed each time from the
+        per-trajectory contributions, `chunksize` resamples at once. The
+        p-value of a cell is the probability to get a mgrid at least as high
+        as the observed one by chance. Since the weighting function only
+        depends on `ngrid_`, it also applies to the weighted PSCF.
+
+        Parameters
+        ----------
+        n_resamples : int, default 1000
+            Number of permutations.
+        chunksize : int, default 100
+            Number of permutations computed at once.
+        n_jobs : int, default 1
+            Number of processes used to compute the chunks.
+        random_state : int, optional
+            Seed of the random generator. The results do not depend on
+            `n_jobs`.
+
+        Return
+        ------
+        pvalue : np.ndarray
+            The p-value of each cell. It is also stored in `pvalue_`, and the
+            mean and standard deviation of the resampled mgrid in
+            `mgrid_null_mean_` and `mgrid_null_std_`.
+        """
+        mask = (self.traj_["conc"].values >= self.concCrit).astype(float)
+        mgrid = self.mgrid_.ravel()
+
+        sizes = [chunksize] * (n_resamples // chunksize)
+        if n_resamples % chunksize:
+            sizes.append(n_resamples % chunksize)
+        seeds = np.random.SeedSequence(random_state).spawn(len(sizes))
+
+        if n_jobs == 1:
+            _init_permutation(self.contrib_, mask)
+            results = [_permutation_chunk(mgrid, n, seed)
+                       for n, seed in zip(sizes, seeds)]
+            _SHARED.clear()
+        else:
+            with ProcessPoolExecutor(n_jobs, initializer=_init_permutation,
+                                     initargs=(self.contrib_, mask)) as pool:
+                results = list(pool.map(_permutation_chunk,
+                                        [mgrid]*len(sizes), sizes, seeds))
+
+        count, total, total2 = (np.sum(r, axis=0) for r in zip(*results))
+        mean = total / n_resamples
+        std = np.sqrt(np.maximum(total2/n_resamples - mean**2, 0))
+
+        self.pvalue_ = ((1 + count) / (1 + n_resamples)).reshape(self.grid.shape)
+        self.mgrid_null_mean_ = mean.reshape(self.grid.shape)
+        self.mgrid_null_std_ = std.reshape(self.grid.shape)
+        return self.pvalue_
+
+    def cwt(self, redistributed=False, tol=0.005, maxiter=100, smooth=False):
+        """Concentration-Weighted Trajectory (CWT) of each cell.
+
+        The CWT of a cell is the mean of the log-concentration of the
+        trajectories, weighted by their residence time (number of endpoints)
+        in the cell. It is computed from the same per-trajectory contributions
+        as the PSCF, so :meth:`run` must be called first. Only the
+        trajectories with a positive concentration are accounted.
+
+        The redistributed CWT (RCWT, Stohl, 1996) iteratively redistributes
+        the concentration of each trajectory along its endpoints: the
+        concentration at an endpoint is the one of the trajectory multiplied
+        by the ratio of the field in its cell to the mean of the field along
+        the trajectory. The redistributed concentrations are bounded by the
+        lowest and highest concentrations of the trajectories, and the new
+        field is their residence time weighted mean (of the logarithm, as the
+        CWT). It stops when the mean relative change of the field between two
+        iterations is below `tol`.
+
+        Parameters
+        ----------
+        redistributed : boolean, default False
+            Compute the RCWT instead of the CWT.
+        tol : float, default 0.005
+            RCWT convergence: mean relative change of the cells between two
+            iterations.
+        maxiter : int, default 100
+            Maximum number of RCWT iterations.
+        smooth : boolean, default False
+            Smooth the RCWT field with a 9-point filter after each iteration.
+
+        Return
+        ------
+        CWT : np.ndarray
+            The CWT (or RCWT) in concentration unit, multiplied by the
+            weighting function if any. It is also stored in `CWT_` (or
+            `RCWT_`).
+        """
+        contrib = self.contrib_
+        conc = self.traj_["conc"].values
+        nendpoints = np.asarray(contrib.sum(axis=1)).ravel()
+        valid = np.isfinite(conc) & (conc > 0) & (nendpoints > 0)
+        logc = np.log(conc, out=np.zeros(len(conc)), where=valid)
+
+        ncount = contrib.T @ valid.astype(float)
+        inside = ncount > 0
+        field = np.zeros(self.grid.size)
+        field[inside] = np.exp((contrib.T @ logc)[inside] / ncount[inside])
+
+        if redistributed:
+            # the endpoints (trajectory, cell, residence time) to redistribute
+            endpoints = contrib.tocoo()
+            keep = valid[endpoints.row]
+            row, col = endpoints.row[keep], endpoints.col[keep]
+            tau = endpoints.data[keep]
+            cmin, cmax = conc[valid].min(), conc[valid].max()
+            for iteration in range(1, maxiter+1):
+                # mean of the field along each trajectory
+                mean = np.bincount(row, weights=tau*field[col],
+                                   minlength=len(conc))
+                mean[valid] /= nendpoints[valid]
+                redist = np.clip(conc[row] * field[col] / mean[row],
+                                 cmin, cmax)
+                logfield = np.bincount(col, weights=tau*np.log(redist),
+                                       minlength=self.grid.size)
+                new = np.zeros(self.grid.size)
+                new[inside] = np.exp(logfield[inside] / ncount[inside])
+                if smooth:
+                    new = self._smooth_field(new, inside)
+                change = np.abs(new[inside] - field[inside]) / field[inside]
+                field = new
+                if change.mean() < tol:
+                    break
+            else:
+                warnings.warn("RCWT did not converge in {} iterations"
+                              .format(maxiter))
+            self.rcwt_iterations_ = iteration
+
+        CWT = field.reshape(self.grid.shape)
+        if self.wF_ is not None:
+            CWT = CWT * self.wF_
+
+        if redistributed:
+            self.RCWT_ = CWT
+        else:
+            self.CWT_ = CWT
+        return CWT
+
+    def _smooth_field(self, field, inside):
+        """Mean of each cell and its 8 neighbours with data."""
+        inside = inside.reshape(self.grid.shape).astype(float)
+        total = uniform_filter(field.reshape(self.grid.shape), 3,
+                               mode="constant")
+        weight = uniform_filter(inside, 3, mode="constant")
+        smoothed = np.divide(total, weight, out=np.zeros(self.grid.shape),
+                             where=inside > 0)
+        return smoothed.ravel()
+
+    def sweep(self, params, n_jobs=1):
+        """Run the PSCF for all the combinations of some parameters.
+
+        The full back-trajectories are read only once (or taken from memory,
+        see the `cache` parameter) and each combination only computes what
+        its parameters change: the cells once per resolution, the cut and
+        the endpoint counts once per (resolution, hourinthepast,
+        cutWithRain, rainThreshold), all the thresholds in a single product,
+        then the weighting and the smoothing (the weights being computed
+        once per count). The counts of
+        the combinations are computed in parallel.
+
+        The model itself (`PSCF_`, `bt`, ...) is not changed.
+
+        Parameters
+        ----------
+        params : dict
+            The values of each parameter to sweep, among `resolution`,
+            `hourinthepast`, `cutWithRain`, `rainThreshold`, `percentile` (or
+            `threshold`), `wfunc`, `wfunc_type` and `smoothplot`. The other
+            parameters are the ones of the model.
+            Example: {"hourinthepast": [24, 48, 72], "percentile": [75, 90]}
+        n_jobs : int, default 1
+            Number of processes.
+
+        Return
+        ------
+        results : dict
+            One result per resolution, since the grid depends on it. Each
+            result is a dict with:
 
+            - dims: the swept parameters (except the resolution), then "lon"
+              and "lat",
+            - coords: the values of each dimension,
+            - concCrit: the critical concentration, of shape the parameters
+              ones,
+            - ngrid, mgrid, trajdensity, PSCF: of shape the parameters ones
+              plus (lon, lat). PSCF is weighted and smoothed as requested.
+        """
+        allowed = ["resolution", "hourinthepast", "cutWithRain",
+                   "rainThreshold", "percentile", "threshold", "wfunc",
+                   "wfunc_type", "smoothplot"]
+        unknown = [k for k in params if k not in allowed]
+        if unknown:
+            raise ValueError("Can not sweep {}, only {}.".format(unknown,
+                                                                 allowed))
+        if "percentile" in params and "threshold" in params:
+            raise ValueError("Sweep either 'percentile' or 'threshold'.")
+
+        data = self.data
+        data = data[(data.index > self.dateMin) & (data.index < self.dateMax)]
+        self.date = data.index
+        self.conc = data[self.specie]
+
+        dims = [k for k in params if k != "resolution"]
+        coords = {k: np.atleast_1d(params[k]).tolist() for k in dims}
+        resolutions = np.atleast_1d(params.get("resolution",
+                                               self.resolution)).tolist()
+
+        def values(key):
+            return coords[key] if key in coords else [getattr(self, key)]
+
+        # ===== critical concentrations
+        if "percentile" in coords:
+            concCrit = [sst.scoreatpercentile(self.conc, p)
+                        for p in coords["percentile"]]
+        elif "threshold" in coords:
+            concCrit = coords["threshold"]
+        else:
+            concCrit = [self._get_concCrit()]
+        concCrit = np.asarray(concCrit, dtype=float)
+
+        # ===== endpoint counts of each trajectory cut
+        cuts = []
+        for resolution in resolutions:
+            for hour in values("hourinthepast"):
+                for cut in values("cutWithRain"):
+                    for rain in values("rainThreshold"):
+                        key = (resolution, int(hour), rain if cut else None)
+                        if key not in cuts:
+                            cuts.append(key)
+
+        bt = self.extractBackTraj(truncate=False)
+        if n_jobs == 1:
+            _init_sweep(bt, self.mapMinMax, concCrit)
+            counts = [_sweep_chunk(*key) for key in cuts]
+            _SHARED.clear()
+        else:
+            with ProcessPoolExecutor(n_jobs, initializer=_init_sweep,
+                                     initargs=(bt, self.mapMinMax,
+                                               concCrit)) as pool:
+                counts = list(pool.map(_sweep_chunk, *zip(*cuts)))
+        counts = dict(zip(cuts, counts))
+
+        # ===== weighting and smoothing of each combination
+        shape = tuple(len(coords[k]) for k in dims)
+        weights = {}
+        results = {}
+        for resolution in resolutions:
+            grid = Grid(self.mapMinMax, resolution)
+            result = {
+                "dims": dims + ["lon", "lat"],
+                "coords": dict(coords, lon=grid.lon, lat=grid.lat),
+                "concCrit": np.zeros(shape),
+            }
+            for k in ["ngrid", "mgrid", "trajdensity", "PSCF"]:
+                result[k] = np.zeros(shape + grid.shape)
 
-        cid = figBT.canvas.mpl_connect('button_press_event',
-                                       lambda event: self.onclick(event, "allBT"))
-        figBT.canvas.set_window_title(self.station+"_allBT")
+            for idx in np.ndindex(*shape):
+                param = {k: getattr(self, k) for k in allowed[1:]}
+                param.update({k: coords[k][i] for k, i in zip(dims, idx)})
+                key = (resolution, int(param["hourinthepast"]),
+                       param["rainThreshold"] if param["cutWithRain"] else None)
+                ngrid, mgrid = counts[key]
+                icrit = idx[dims.index("percentile")] if "percentile" in dims \
+                    else idx[dims.index("threshold")] if "threshold" in dims \
+                    else 0
+                mgrid = mgrid[icrit]
 
-    def plot_PSCF_polar(self):
+                PSCF = np.divide(mgrid, ngrid, out=np.zeros(grid.shape),
+                                 where=ngrid != 0)
+                trajdensity = np.zeros(grid.shape)
+                trajdensity[ngrid != 0] = np.log10(ngrid[ngrid != 0])
+                if param["wfunc"]:
+                    wkey = key + (param["wfunc_type"],)
+                    if wkey not in weights:
+                        weights[wkey] = self._weighting(ngrid,
+                                                        param["wfunc_type"])
+                    PSCF = PSCF * weights[wkey]
+                if param["smoothplot"]:
+                    PSCF = gaussian_filter(PSCF, 1)
+
+                result["concCrit"][idx] = concCrit[icrit]
+                result["ngrid"][idx] = ngrid
+                result["mgrid"][idx] = mgrid
+                result["trajdensity"][idx] = trajdensity
+                result["PSCF"][idx] = PSCF
+            results[resolution] = result
+        return results
+
+    def sectors(self, nsectors=16, rings=None):
+        """Aggregate the grids by direction (and distance) from the station.
+
+        The sector of each cell is computed once per station (see
+        :meth:`pyPSCF.grid.Grid.sectors`) and the grids are summed by sector
+        with a single `np.bincount`.
+
+        Parameters
+        ----------
+        nsectors : int, default 16
+            Number of sectors.
+        rings : array-like, optional
+            The edges of the distance rings (km), e.g. [0, 500, 1000, 2000].
+
+        Return
+        ------
+        sectors : pd.DataFrame
+            One row per sector (and ring), with the sector angles `theta_min`
+            and `theta_max` (degree, counterclockwise from the East), the
+            ring `dist_min` and `dist_max` (km, if `rings`), the sums of
+            `ngrid` and `mgrid` in the sector, its `PSCF` (mgrid/ngrid) and
+            `mgrid_percent`, the share of the total `mgrid` in the sector.
+        """
+        index = self.grid.sectors(self.lon0, self.lat0, nsectors, rings)
+        nrings = 1 if rings is None else len(rings) - 1
+        n = nsectors * nrings
+        ngrid = self.grid.aggregate(self.ngrid_, index, n)
+        mgrid = self.grid.aggregate(self.mgrid_, index, n)
+
+        theta = np.linspace(0, 360, nsectors+1)
+        df = pd.DataFrame({
+            "theta_min": np.tile(theta[:-1], nrings),
+            "theta_max": np.tile(theta[1:], nrings),
+        })
+        if rings is not None:
+            rings = np.asarray(rings, dtype=float)
+            df["dist_min"] = np.repeat(rings[:-1], nsectors)
+            df["dist_max"] = np.repeat(rings[1:], nsectors)
+        df["ngrid"] = ngrid
+        df["mgrid"] = mgrid
+        df["PSCF"] = np.divide(mgrid, ngrid, out=np.zeros(n), where=ngrid > 0)
+        df["mgrid_percent"] = mgrid/np.sum(self.mgrid_)*100
+        return df
+
+    def plot_PSCF_polar(self, nsectors=16):
         """ Plot a polar plot of the PSCF
+
+        Parameters
+        ----------
+        nsectors : int, default 16
+            Number of sectors, see :meth:`sectors`.
         """
-        # change the coordinate system to polar from the station point
-        deltalon = self.lon0 - self.lon
-        mesh_deltalon, mesh_lat = np.meshgrid(deltalon, self.lat)
-        mesh_lon, _ = np.meshgrid(self.lon, self.lat)
-        mesh_deltalon = self.toRad(mesh_deltalon)
-        mesh_lon = self.toRad(mesh_lon)
-        mesh_lat = self.toRad(mesh_lat)
-
-        a = np.sin(mesh_deltalon) * np.cos(mesh_lat)
-        b = np.cos(self.lat0*math.pi/180)*np.sin(mesh_lat) \
-            - np.sin(self.lat0*math.pi/180)*np.cos(mesh_lat)*np.cos(mesh_deltalon)
-        bearing = np.arctan2(a, b)
-        bearing += math.pi/2                        # change the origin: from N to E
-        bearing[np.where(bearing < 0)] += 2*math.pi   # set angle between 0 and 2pi 
-        bearing = bearing.T
-
-        # select and count the BT in a given Phi range
-        mPhi = list()
-        theta = self.toRad(np.arange(0, 361, 22.5))
-        mPhi.append( np.sum( self.mgrid_[ np.where(bearing <= theta[1]) ] ))
-        for i in range(1, len(theta)-1):
-            mPhi.append(np.sum(self.mgrid_[np.where((theta[i] < bearing) &
-                                                    (bearing <= theta[i+1]))]))
-        # convert it in percent
-        values = mPhi/np.sum(self.mgrid_)*100
+        sectors = self.sectors(nsectors)
+        theta = self.toRad(sectors["theta_min"].values)
+        values = sectors["mgrid_percent"].values
 
         # ===== Plot part
         figPolar = plt.figure()
         xticklabel = ['E', 'NE', 'N', 'NO', 'O', 'SO', 'S', 'SE']
 
         axPolar = plt.subplot(111, projection='polar')
-        bars = axPolar.bar( theta[:-1], values, width=math.pi/8, align="edge")
+        bars = axPolar.bar(theta, values, width=2*math.pi/nsectors,
+                           align="edge")
         axPolar.xaxis.set_ticklabels(xticklabel)
         axPolar.yaxis.set_ticks(range(0,int(max(values)), 5))
 
@@ -399,44 +1554,300 @@ class PSCF:
         )
         plt.title(plotTitle)
         plt.subplots_adjust(top=0.85, bottom=0.05, left=0.07, right=0.93)
-        figPolar.canvas.set_window_title(self.station+self.specie+"_windrose")
+        figPolar.canvas.manager.set_window_title(self.station+self.specie+"_windrose")
 
-    def plot_PSCF(self):
-        """Plot the PSCF map.
+
+class MultiPSCF:
+    """
+    PSCF of several species and thresholds in a single trajectory pass.
+
+    The back-trajectories are extracted and counted in the grid only once, and
+    the `mgrid_` of every (specie, threshold) pair are computed together from
+    the per-trajectory contributions. Each (specie, threshold) is then a
+    :class:`PSCF` given by :meth:`select`, with all its methods (plots,
+    :meth:`PSCF.cwt`, :meth:`PSCF.significance`, ...).
+
+    Parameters
+    ----------
+    species : list of str
+        The species to study. Must be specified in the concentration file.
+    percentiles : list or array, optional
+        The percentiles to use as thresholds. Either shared by all the species
+        (1D) or one row per specie (2D).
+    thresholds : list or array, optional
+        The concentration thresholds, 1D or 2D as `percentiles`. Only used if
+        `percentiles` is not given.
+    **kwargs :
+        The other parameters of :class:`PSCF`.
+
+    Attributes
+    ----------
+    model : PSCF
+        The model of the first specie, which reads the back-trajectories and
+        holds them with the grid and the contributions shared by all the
+        species.
+    concCrit : np.ndarray
+        The critical concentrations, of shape (specie, threshold).
+    mgrid_, PSCF_ : np.ndarray
+        Of shape (specie, threshold, lon, lat).
+    ngrid_, trajdensity_, wF_ : np.ndarray
+        Of shape (lon, lat), shared by all the species.
+    """
+    def __init__(self, species, percentiles=None, thresholds=None, **kwargs):
+        if percentiles is None and thresholds is None:
+            raise ValueError("'percentiles' or 'thresholds' shoud be specified.'")
+        kwargs["percentile"] = None
+        kwargs["threshold"] = None
+
+        self.species = list(species)
+        self.percentiles = percentiles
+        self.thresholds = thresholds
+        self.model = PSCF(specie=self.species[0], **kwargs)
+
+    def _values(self):
+        """The percentiles or thresholds, of shape (specie, threshold)."""
+        if self.percentiles is not None:
+            values = self.percentiles
+        else:
+            values = self.thresholds
+        values = np.atleast_1d(np.asarray(values, dtype=float))
+        return np.broadcast_to(values, (len(self.species), values.shape[-1]))
+
+    def _get_concCrit(self):
+        """Critical concentrations of shape (specie, threshold)."""
+        values = self._values()
+        if self.percentiles is None:
+            return np.array(values, dtype=float)
+        data = self.model.data.loc[self.model.date]
+        return np.array([sst.scoreatpercentile(data[specie], p)
+                         for specie, p in zip(self.species, values)],
+                        dtype=float)
+
+    def run(self):
+        """Run the PSCF model for all the species and thresholds"""
+        model = self.model
+        profiler = model.profiler
+        profiler.start()
+
+        with profiler.stage("filter"):
+            data = model.data
+
+            # extract relevant info
+            data = data[(data.index > model.dateMin) & (data.index < model.dateMax)]
+
+            model.date = data.index
+
+            model.conc = data[model.specie]
+
+            # ===== critical concentration
+            self.concCrit = self._get_concCrit()
+            model.concCrit = self.concCrit
+
+        # ===== Extract all back-traj needed        ===========================
+        with profiler.stage("load"):
+            model.bt = model.extractBackTraj()
+
+        # ===== count the endpoints in each cell
+        with profiler.stage("bin"):
+            model._set_grid()
+            model.bt.set_cells(model.grid)
+            model.traj_, model.contrib_ = model._contributions(model.bt)
+            model._set_index()
+
+            shape = model.grid.shape
+            ngrid = model.grid.count(model.bt.cell)
+
+            # ===== all the (specie, threshold) in one product
+            conc = data.loc[model.bt.date, self.species].values.T
+            mask = conc[:, np.newaxis, :] >= self.concCrit[:, :, np.newaxis]
+            mgrid = model.contrib_.T @ mask.reshape(-1, len(model.traj_)).T.astype(float)
+            mgrid = mgrid.T.reshape(self.concCrit.shape + shape)
+
+        with profiler.stage("weight"):
+            model._compute(ngrid, mgrid)
+            for k in ["ngrid_", "mgrid_", "PSCF_", "trajdensity_", "wF_"]:
+                setattr(self, k, getattr(model, k))
+
+        profiler.count("trajectories", len(model.bt))
+        profiler.count("endpoints", model.bt.size)
+        self.stats_ = profiler.stop()
+
+    def select(self, specie, threshold=0):
+        """Single specie/threshold view of the results.
+
+        Parameters
+        ----------
+        specie : str
+            One of the species.
+        threshold : int, default 0
+            Index of the percentile/threshold.
+
+        Return
+        ------
+        model : PSCF
+            A PSCF with the results of this specie and threshold, as if it was
+            run alone. It shares the back-trajectories and the grid of
+            `model`.
         """
-        fig = plt.figure()  # keep handle for the onclick function
-        ax = fig.add_subplot(1, 1, 1, projection=ccrs.PlateCarree())
-        ax.set_extent(
-            [
-                self.mapMinMax["lonmin"],
-                self.mapMinMax["lonmax"],
-                self.mapMinMax["latmin"],
-                self.mapMinMax["latmax"],
-            ],
-            ccrs.PlateCarree()
-        )
+        i = self.species.index(specie)
 
-        if self.smoothplot:
-            PSCF = gaussian_filter(self.PSCF_, 1)
+        model = copy.copy(self.model)
+        model.specie = specie
+        if self.percentiles is not None:
+            model.percentile = self._values()[i, threshold]
         else:
-            PSCF = self.PSCF_
+            model.threshold = self._values()[i, threshold]
+        model.conc = model.data.loc[model.date, specie]
+        model.concCrit = self.concCrit[i, threshold]
+        model.mgrid_ = self.mgrid_[i, threshold]
+        model.PSCF_ = self.PSCF_[i, threshold]
 
-        ax.coastlines(resolution=self.resQuality)
-        ax.add_feature(cfeature.BORDERS.with_scale(self.resQuality),
-                       edgecolor='grey')
+        conc = model.data.loc[model.bt.date, specie].values
+        model.bt = model.bt.assign(conc=conc)
+        model.traj_ = model.bt.meta()
 
-        pmesh = ax.pcolormesh(self.lon_map, self.lat_map, PSCF.T, cmap='hot_r')
+        return model
 
-        ax.plot(self.lon0, self.lat0, 'o', color='0.75')
 
-        plotTitle = "{station}, {specie} > {concCrit}\nFrom {dmin} to {dmax}".format(
-            station=self.station, specie=self.specie,
-            concCrit=self.concCrit.round(5),
-            dmin=min(self.date).strftime('%Y/%m/%d'),
-            dmax=max(self.date).strftime('%Y/%m/%d')
+class CompositePSCF(PSCFResults):
+    """
+    Joint PSCF and CWT of several stations on a common grid.
+
+    Each station is a :class:`PSCF` model, with its own back-trajectories,
+    concentration file and threshold. The stations are run independently
+    (in parallel) and their `ngrid_` and `mgrid_` are summed, so that the
+    trajectories of all the receptors contribute to a single map. The
+    composite is mapped with :meth:`plot_PSCF` and :meth:`plot_backtraj`;
+    the other methods of :class:`PSCF` apply to the station models.
+
+    Parameters
+    ----------
+    models : list of PSCF
+        The models of the stations. They must share the same grid
+        (`mapMinMax` and `resolution`).
+    wfunc, wfunc_type, wFlim, wFval :
+        The weighting function of the composite, see :class:`PSCF`.
+    smoothplot : boolean, default True
+        Use a gaussian filter to smooth the map plot.
+    resQuality : '110m' or '50m', default '110m'
+        The quality of the map.
+
+    Attributes
+    ----------
+    station_ngrid_, station_mgrid_ : np.ndarray
+        The partial grids of each station, of shape (station, lon, lat).
+        The models of the stations also hold their own results.
+    """
+    def __init__(self, models, wfunc=True, wfunc_type="auto", wFlim=None,
+                 wFval=None, smoothplot=True, resQuality="110m"):
+        if not models:
+            raise ValueError("At least one station model is needed.")
+        grids = [Grid(m.mapMinMax, m.resolution) for m in models]
+        if any(g != grids[0] for g in grids[1:]):
+            raise ValueError("All the stations must share the same grid "
+                             "(see `mapMinMax` and `resolution`).")
+
+        self.models = list(models)
+        self.stations = [m.station for m in models]
+        self.station = "+".join(self.stations)
+        self.specie = "+".join(sorted(set(m.specie for m in models)))
+        self.lat0 = np.array([m.lat0 for m in models])
+        self.lon0 = np.array([m.lon0 for m in models])
+        self.mapMinMax = models[0].mapMinMax
+        self.resolution = models[0].resolution
+
+        self.wfunc = wfunc
+        self.wfunc_type = wfunc_type
+        self.wFlim = wFlim
+        self.wFval = wFval
+        self.smoothplot = smoothplot
+        self.resQuality = resQuality
+        self.plotBT = True
+        self.plotPolar = False
+
+        self.profiler = Profiler()
+        self.bt = None
+        self.traj_ = None
+        self.cell2traj_ = None
+
+    def run(self, n_jobs=1):
+        """Run the PSCF of all the stations and sum their grids.
+
+        Parameters
+        ----------
+        n_jobs : int, default 1
+            Number of processes. With more than one process, the station
+            models only get their grids back, not their trajectories.
+        """
+        if n_jobs == 1:
+            partials = [_run_station(m) for m in self.models]
+        else:
+            with ProcessPoolExecutor(n_jobs) as pool:
+                partials = list(pool.map(_run_station, self.models))
+
+        for model, partial in zip(self.models, partials):
+            if n_jobs != 1:
+                model.date = partial["date"]
+                model.concCrit = partial["concCrit"]
+                model._set_grid()
+                model._compute(partial["ngrid"], partial["mgrid"])
+        self._reduce(partials)
+
+    def combine(self):
+        """Sum the grids of station models which already have results.
+
+        For instance models loaded with :meth:`PSCF.from_netcdf`, so the
+        composite is built without computing anything again. The joint CWT
+        is then not available.
+        """
+        partials = [{"date": m.date, "concCrit": m.concCrit,
+                     "ngrid": m.ngrid_, "mgrid": m.mgrid_}
+                    for m in self.models]
+        self._reduce(partials)
+
+    def _reduce(self, partials):
+        """Sum the partial grids of the stations."""
+        self._set_grid()
+        self.date = pd.DatetimeIndex(
+            np.unique(np.concatenate([p["date"].values for p in partials]))
         )
-        plt.title(plotTitle)
+        self.concCrit = np.array([p["concCrit"] for p in partials],
+                                 dtype=float)
+        self.station_ngrid_ = np.array([p["ngrid"] for p in partials])
+        self.station_mgrid_ = np.array([p["mgrid"] for p in partials])
+        self._cwt_sum = None
+        self._cwt_count = None
+        if all("cwt_sum" in p for p in partials):
+            self._cwt_sum = np.sum([p["cwt_sum"] for p in partials], axis=0)
+            self._cwt_count = np.sum([p["cwt_count"] for p in partials],
+                                     axis=0)
 
-        cid = fig.canvas.mpl_connect('button_press_event',
-                                     lambda event: self.onclick(event, "PSCF"))
-        fig.canvas.set_window_title(self.station+self.specie)
+        self._compute(self.station_ngrid_.sum(axis=0),
+                      self.station_mgrid_.sum(axis=0))
+
+    def cwt(self):
+        """Joint CWT of all the stations.
+
+        The log-concentrations of the trajectories of all the stations are
+        averaged in each cell, weighted by their residence time, so the
+        stations should measure the same specie in the same unit. The
+        redistributed CWT is only computed per station (see
+        :meth:`PSCF.cwt`).
+
+        Return
+        ------
+        CWT : np.ndarray
+            The CWT, multiplied by the weighting function if any. It is also
+            stored in `CWT_`.
+        """
+        if self._cwt_sum is None:
+            raise ValueError("The joint CWT needs the trajectories, see "
+                             "`run`.")
+        inside = self._cwt_count > 0
+        logCWT = np.divide(self._cwt_sum, self._cwt_count,
+                           out=np.zeros(self.grid.shape), where=inside)
+        CWT = np.where(inside, np.exp(logCWT), 0)
+        if self.wF_ is not None:
+            CWT = CWT * self.wF_
+        self.CWT_ = CWT
+        return CWT
@@ -0,0 +1,267 @@
+"""Reader of the HYSPLIT trajectory output files (tdump format).
+
+The endpoints of a tdump file are written with a fixed width format, so they
+are read as a structured view of the raw bytes of the file and only the
+requested columns are converted to float. The layout of the file (header
+size, column names and widths) is cached, since all the back-trajectories of
+a run share it. Files which are not fixed width (e.g. with endpoints wrapped
+on several lines) are read with `np.loadtxt`.
+"""
+import os
+import re
+import functools
+import numpy as np
+
+
+TDUMP_COLUMNS = ["a", "b", "year", "month", "day", "hour", "c", "d", "age",
+                 "lat", "lon", "alt"]
+
+
+def _next_line(raw, pos):
+    """The line starting at `pos` and the position of the next one."""
+    end = raw.find(b"\n", pos)
+    if end == -1:
+        end = len(raw)
+    return raw[pos:end], end+1
+
+
+def _read_header(raw):
+    """Parse the header of a tdump file.
+
+    Return
+    ------
+    names : tuple of str
+        Name of the columns of the endpoints.
+    pos : int
+        Position of the first endpoint in `raw`.
+    """
+    line, pos = _next_line(raw, 0)
+    nb_meteo = int(line.split()[0])
+    for i in range(nb_meteo):
+        line, pos = _next_line(raw, pos)
+    line, pos = _next_line(raw, pos)
+    nb_traj = int(line.split()[0])
+    for i in range(nb_traj):
+        line, pos = _next_line(raw, pos)
+    line, pos = _next_line(raw, pos)
+    meteo_idx = line.decode().split()
+    return tuple(TDUMP_COLUMNS + meteo_idx[1:]), pos
+
+
+@functools.lru_cache(maxsize=64)
+def _layout(names, ends, linesize):
+    """Structured dtype of an endpoint line, one bytes field per column.
+
+    Parameters
+    ----------
+    names : tuple of str
+        Name of the columns.
+    ends : tuple of int
+        Position of the end of each column in the line (they are right
+        aligned).
+    linesize : int
+        Size of a line, including the end of line.
+    """
+    starts = (0,) + ends[:-1]
+    return np.dtype({
+        "names": list(names) + ["_eol"],
+        "formats": ["S{}".format(e-s) for s, e in zip(starts, ends)] + ["S1"],
+        "offsets": list(starts) + [linesize-1],
+        "itemsize": linesize,
+    })
+
+
+def _read_endpoints(raw, pos, names, columns, nrows):
+    """Convert the `columns` of the endpoints to a 2D float array."""
+    eol = raw.find(b"\n", pos)
+    if eol == -1 or not raw.endswith(b"\n"):
+        raw = raw + b"\n"
+        eol = raw.find(b"\n", pos)
+    first = raw[pos:eol+1]
+    ends = tuple(m.end() for m in re.finditer(rb"\S+", first))
+
+    count = (len(raw) - pos) // len(first)
+    if nrows is not None:
+        count = min(count, nrows)
+
+    records = None
+    if len(ends) == len(names) and first.strip():
+        dtype = _layout(names, ends, len(first))
+        records = np.frombuffer(raw, dtype=dtype, count=count, offset=pos)
+        rest = raw[pos+count*len(first):]
+        if not (records["_eol"] == b"\n").all() or \
+                (nrows is None and rest.strip()):
+            records = None
+
+    if records is None:
+        # not a fixed width file
+        values = np.array(raw[pos:].split(), dtype=float)
+        values = values.reshape(-1, len(names))
+        if nrows is not None:
+            values = values[:nrows]
+        return values[:, [names.index(c) for c in columns]]
+
+    values = np.empty((len(records), len(columns)))
+    for i, c in enumerate(columns):
+        values[:, i] = records[c].astype(float)
+    return values
+
+
+def read_tdump(datafile, nrows=None):
+    """Read the endpoints of an HYSPLIT tdump file.
+
+    Parameters
+    ----------
+    datafile : str, path
+        The back-trajectory file.
+    nrows : int, optional
+        Number of endpoints to read.
+
+    Return
+    ------
+    names : list of str
+        Name of the columns, i.e. `TDUMP_COLUMNS` followed by the diagnostic
+        meteo variables (PRESSURE, RAINFALL, ...).
+    values : np.ndarray
+        2D array of the endpoints, one row per endpoint.
+    """
+    with open(datafile, "rb") as f:
+        raw = f.read()
+    names, pos = _read_header(raw)
+    values = _read_endpoints(raw, pos, names, names, nrows)
+    return list(names), values
+
+
+def read_columns(datafile, columns, nrows=None):
+    """Read some columns of the endpoints of an HYSPLIT tdump file.
+
+    Only the requested columns are converted.
+
+    Parameters
+    ----------
+    datafile : str, path
+        The back-trajectory file.
+    columns : list of str
+        The columns to read, among `TDUMP_COLUMNS` and the diagnostic meteo
+        variables of the file.
+    nrows : int, optional
+        Number of endpoints to read.
+
+    Return
+    ------
+    endpoints : np.ndarray
+        Structured array with one float field per column. It is a view of a
+        2D float array, so `endpoints[c]` does not copy the data.
+    """
+    with open(datafile, "rb") as f:
+        raw = f.read()
+    names, pos = _read_header(raw)
+    missing = [c for c in columns if c not in names]
+    if missing:
+        raise KeyError("{} not in the columns of {}".format(missing, datafile))
+    values = _read_endpoints(raw, pos, names, list(columns), nrows)
+    dtype = np.dtype([(c, float) for c in columns])
+    return values.view(dtype)[:, 0]
+
+
+def check_tdump(datafile, hours=None, top=None):
+    """Check that an HYSPLIT tdump file is complete.
+
+    Parameters
+    ----------
+    datafile : str, path
+        The back-trajectory file.
+    hours : float, optional
+        The duration of the run (e.g. `hBT`). The file is truncated if its
+        last endpoint is younger. Otherwise, a file cut between two
+        endpoints can not be told from a complete one.
+    top : float, optional
+        The height (m) above which a trajectory may end before `hours`,
+        HYSPLIT stopping the trajectories reaching the model top. By default,
+        all the trajectories must last `hours`.
+
+    Return
+    ------
+    nrows : int
+        The number of endpoints.
+
+    Raises
+    ------
+    ValueError
+        If the file is empty, truncated or can not be parsed.
+    """
+    with open(datafile, "rb") as f:
+        raw = f.read()
+    if not raw.endswith(b"\n"):
+        raise ValueError("{} is truncated".format(datafile))
+    try:
+        names, pos = _read_header(raw)
+        values = _read_endpoints(raw, pos, names, names, None)
+    except (ValueError, IndexError) as e:
+        raise ValueError("{} can not be read: {}".format(datafile, e))
+    if len(values) == 0:
+        raise ValueError("{} has no endpoint".format(datafile))
+    if hours is not None:
+        age = float(values[-1, names.index("age")])
+        alt = float(values[-1, names.index("alt")])
+        if abs(age) < abs(float(hours)) and (top is None or alt < top):
+            raise ValueError("{} is truncated: its last endpoint is {}h old "
+                             "instead of {}h".format(datafile, abs(age),
+                                                     abs(float(hours))))
+    return len(values)
+
+
+def _set_first(line, value):
+    """Replace the first (right aligned) integer of a line by `value`."""
+    return re.sub(rb"^\s*\d+", lambda m: b"%*d" % (len(m.group()), value),
+                  line, count=1)
+
+
+def split_tdump(datafile, outfiles):
+    """Split an HYSPLIT tdump file of several trajectories.
+
+    HYSPLIT writes the endpoints of all the trajectories of a run in the same
+    file, numbered by their starting location. Each trajectory is written in
+    its own file, with the header of the run and its starting location, as
+    if it was computed alone. The lines are copied as they are (only the
+    trajectory number is set to 1), and each file is written under a
+    temporary name then renamed, so that an output file is always complete.
+
+    Parameters
+    ----------
+    datafile : str, path
+        The tdump file of the run.
+    outfiles : list of str, path
+        The output file of each trajectory, in the order of the starting
+        locations.
+    """
+    with open(datafile, "rb") as f:
+        lines = f.read().splitlines(keepends=True)
+    pos = int(lines[0].split()[0]) + 1
+    nb_traj = int(lines[pos].split()[0])
+    if nb_traj != len(outfiles):
+        raise ValueError("{} has {} trajectories, not {}".format(
+            datafile, nb_traj, len(outfiles)))
+    header = lines[:pos] + [_set_first(lines[pos], 1)]
+    starts = lines[pos+1:pos+1+nb_traj]
+    meteo = lines[pos+1+nb_traj]
+    nb_values = len(TDUMP_COLUMNS) + int(meteo.split()[0])
+
+    # an endpoint may be wrapped on several lines
+    records = [[] for i in range(nb_traj)]
+    record, count = [], 0
+    for line in lines[pos+2+nb_traj:]:
+        if not line.strip():
+            continue
+        record.append(line)
+        count += len(line.split())
+        if count >= nb_values:
+            traj = int(record[0].split()[0])
+            records[traj-1].extend([_set_first(record[0], 1)] + record[1:])
+            record, count = [], 0
+
+    for start, body, outfile in zip(starts, records, outfiles):
+        tmpfile = str(outfile) + ".tmp"
+        with open(tmpfile, "wb") as f:
+            f.writelines(header + [start, meteo] + body)
+        os.replace(tmpfile, outfile)
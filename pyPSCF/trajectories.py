@@ -0,0 +1,232 @@
+"""Compact in-memory container of back-trajectories."""
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+
+# HYSPLIT writes the endpoint coordinates with 3 decimals
+COORD_DECIMALS = 3
+
+
+class Trajectories:
+    """
+    Back-trajectories as per-trajectory metadata and ragged endpoint arrays.
+
+    The sample date, starting date and concentration are stored once per
+    trajectory. The endpoints of all the trajectories are stored one after
+    another in float32 arrays, the endpoints of the trajectory `i` being
+    `offsets[i]:offsets[i+1]`.
+
+    Parameters
+    ----------
+    date : array-like of datetime
+        The date of the sample of each trajectory.
+    dateBT : array-like of datetime
+        The starting date of each trajectory.
+    conc : array-like of float
+        The concentration of the sample of each trajectory.
+    offsets : array-like of int
+        Position of the first endpoint of each trajectory, plus the total
+        number of endpoints.
+    lon, lat : array-like of float
+        The coordinates of the endpoints.
+    age : array-like of float
+        The age of the endpoints (hour).
+    cell : array-like of int, optional
+        The grid cell of the endpoints, see :meth:`set_cells`.
+    rain : array-like of float, optional
+        The rainfall at the endpoints, see :meth:`truncate`.
+    """
+    def __init__(self, date, dateBT, conc, offsets, lon, lat, age, cell=None,
+                 rain=None):
+        self.date = pd.DatetimeIndex(date).values
+        self.dateBT = pd.DatetimeIndex(dateBT).values
+        self.conc = np.asarray(conc, dtype=float)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.lon = np.asarray(lon, dtype=np.float32)
+        self.lat = np.asarray(lat, dtype=np.float32)
+        self.age = np.asarray(age, dtype=np.float32)
+        self.cell = None if cell is None else np.asarray(cell, dtype=np.int32)
+        self.rain = None if rain is None else np.asarray(rain, dtype=np.float32)
+
+    def __len__(self):
+        return len(self.conc)
+
+    @property
+    def size(self):
+        """Number of endpoints."""
+        return int(self.offsets[-1])
+
+    @property
+    def lengths(self):
+        """Number of endpoints of each trajectory."""
+        return np.diff(self.offsets)
+
+    @property
+    def traj(self):
+        """Position of the trajectory of each endpoint."""
+        return np.repeat(np.arange(len(self)), self.lengths)
+
+    @property
+    def nbytes(self):
+        """Memory used by the arrays, in byte."""
+        arrays = [self.date, self.dateBT, self.conc, self.offsets, self.lon,
+                  self.lat, self.age, self.cell, self.rain]
+        return sum(a.nbytes for a in arrays if a is not None)
+
+    def repeat(self, values):
+        """Repeat per-trajectory `values` for each of their endpoints."""
+        return np.repeat(values, self.lengths)
+
+    def set_cells(self, grid):
+        """Compute the grid cell of each endpoint.
+
+        The float32 coordinates are rounded back to the HYSPLIT precision
+        first, so that the endpoints on a cell edge stay in the same cell as
+        with the values read from the files.
+
+        Parameters
+        ----------
+        grid : pyPSCF.grid.Grid
+        """
+        lon = np.round(self.lon.astype(float), COORD_DECIMALS)
+        lat = np.round(self.lat.astype(float), COORD_DECIMALS)
+        self.cell = grid.cell_index(lon, lat).astype(np.int32)
+        return self.cell
+
+    def contributions(self, size):
+        """Number of endpoints of each trajectory (row) in each cell (column).
+
+        The cells must be set (see :meth:`set_cells`).
+
+        Parameters
+        ----------
+        size : int
+            The number of cells of the grid.
+
+        Return
+        ------
+        contrib : scipy.sparse.csr_matrix
+        """
+        inside = self.cell >= 0
+        return sparse.csr_matrix(
+            (np.ones(inside.sum()), (self.traj[inside], self.cell[inside])),
+            shape=(len(self), size)
+        )
+
+    def segments(self, rows):
+        """The (lon, lat) endpoints of each trajectory in `rows`."""
+        lonlat = np.column_stack((self.lon, self.lat))
+        return [lonlat[self.offsets[i]:self.offsets[i+1]] for i in rows]
+
+    def _select(self, rows, endpoints, lengths):
+        """New container of the trajectories `rows` and the `endpoints`."""
+        return Trajectories(
+            self.date[rows], self.dateBT[rows], self.conc[rows],
+            np.concatenate(([0], np.cumsum(lengths))),
+            self.lon[endpoints], self.lat[endpoints], self.age[endpoints],
+            None if self.cell is None else self.cell[endpoints],
+            None if self.rain is None else self.rain[endpoints],
+        )
+
+    def take(self, rows):
+        """The trajectories in `rows`, as a new container."""
+        rows = np.asarray(rows, dtype=np.int64)
+        lengths = self.lengths[rows]
+        endpoints = np.repeat(self.offsets[rows] - np.concatenate(
+            ([0], np.cumsum(lengths)[:-1])), lengths) + np.arange(lengths.sum())
+        return self._select(rows, endpoints, lengths)
+
+    def compress(self, keep):
+        """Keep the endpoints where `keep` is True, as a new container.
+
+        The trajectories left without any endpoint are dropped.
+        """
+        lengths = np.bincount(self.traj[keep], minlength=len(self))
+        rows = np.flatnonzero(lengths)
+        return self._select(rows, keep, lengths[rows])
+
+    def truncate(self, hourinthepast=None, rainThreshold=None):
+        """Cut the trajectories by age and at the first rain.
+
+        All the trajectories are cut at once with masks over the endpoints,
+        so the full trajectories can be loaded once and cut with other
+        parameters without reading them again.
+
+        Parameters
+        ----------
+        hourinthepast : float, optional
+            Only keep the endpoints younger than `hourinthepast` hours.
+        rainThreshold : float, optional
+            Cut the trajectories from their first endpoint with a rainfall
+            above `rainThreshold` (needs `rain`). By default, the
+            trajectories are not cut by the rain.
+
+        Return
+        ------
+        bt : Trajectories
+            The trajectories cut, without the ones left empty.
+        """
+        keep = np.ones(self.size, dtype=bool)
+        if hourinthepast is not None:
+            keep &= np.abs(self.age) < hourinthepast
+        if rainThreshold is not None:
+            # number of rainy endpoints up to each endpoint in its trajectory
+            rainy = np.cumsum(self.rain > rainThreshold)
+            before = np.concatenate(([0], rainy))[self.offsets[:-1]]
+            keep &= rainy == self.repeat(before)
+        return self.compress(keep)
+
+    def assign(self, conc):
+        """The same trajectories with other concentrations.
+
+        The endpoint arrays are shared, not copied.
+        """
+        new = Trajectories.__new__(Trajectories)
+        new.__dict__.update(self.__dict__)
+        new.conc = np.asarray(conc, dtype=float)
+        return new
+
+    @classmethod
+    def concatenate(cls, trajectories):
+        """Concatenate several containers into a new one."""
+        lengths = np.concatenate([t.lengths for t in trajectories])
+        cells = [t.cell for t in trajectories]
+        rains = [t.rain for t in trajectories]
+        return cls(
+            np.concatenate([t.date for t in trajectories]),
+            np.concatenate([t.dateBT for t in trajectories]),
+            np.concatenate([t.conc for t in trajectories]),
+            np.concatenate(([0], np.cumsum(lengths))),
+            np.concatenate([t.lon for t in trajectories]),
+            np.concatenate([t.lat for t in trajectories]),
+            np.concatenate([t.age for t in trajectories]),
+            None if any(c is None for c in cells) else np.concatenate(cells),
+            None if any(r is None for r in rains) else np.concatenate(rains),
+        )
+
+    def meta(self):
+        """The date, dateBT and conc of each trajectory as a DataFrame."""
+        return pd.DataFrame(
+            data={"date": self.date, "dateBT": self.dateBT, "conc": self.conc},
+            index=pd.RangeIndex(len(self), name="traj")
+        )
+
+    def to_frame(self):
+        """One row per endpoint, with the columns date, dateBT, conc, lon,
+        lat, traj, age (and cell and rain if any)."""
+        traj = self.traj
+        df = pd.DataFrame(data={
+            "date": self.date[traj],
+            "dateBT": self.dateBT[traj],
+            "conc": self.conc[traj],
+            "lon": self.lon,
+            "lat": self.lat,
+            "traj": traj,
+            "age": self.age,
+        })
+        if self.cell is not None:
+            df["cell"] = self.cell
+        if self.rain is not None:
+            df["rain"] = self.rain
+        return df
@@ -0,0 +1,247 @@
+"""Columnar on-disk store of HYSPLIT back-trajectories.
+
+A store holds all the back-trajectories of one station. It is a directory with
+one `.npy` file per column, so that any column can be memory-mapped:
+
+- `dateBT.npy`: starting date of each trajectory, sorted,
+- `offsets.npy`: position of the first endpoint of each trajectory (plus the
+  total number of endpoints),
+- one file per endpoint column: age, lat, lon, alt and the diagnostic meteo
+  variables (PRESSURE, RAINFALL, ...),
+- `meta.json`: the station name and the list of the endpoint columns.
+"""
+import os
+import json
+import datetime as dt
+import numpy as np
+import pandas as pd
+
+from pyPSCF.tdump import read_tdump
+
+
+STORE_COLUMNS = ["age", "lat", "lon", "alt"]
+
+
+def ingest(folder, station, store=None, prefix=None, update=True):
+    """Convert a directory of HYSPLIT output into a trajectory store.
+
+    Parameters
+    ----------
+    folder : str, path
+        Path to the backtrajectories files (the `dirOutput` of the
+        back-trajectory computation).
+    station : str
+        The name of the station.
+    store : str, path, optional
+        Path of the store. By default `folder/store_<station>`.
+    prefix : str, optional
+        Prefix of all backtrajectories. By default 'traj\\_<station>\\_'.
+    update : boolean, default True
+        If the store already exists, only add the trajectories not yet in it.
+        Otherwise the store is rebuilt from scratch.
+
+    Return
+    ------
+    store : TrajStore
+    """
+    if store is None:
+        store = os.path.join(folder, "store_"+station)
+    if prefix is None:
+        prefix = "traj_"+station+"_"
+
+    old = None
+    if update and os.path.isfile(os.path.join(store, "meta.json")):
+        old = TrajStore(store)
+
+    # ===== find the new files
+    datesBT = []
+    files = []
+    for name in sorted(os.listdir(folder)):
+        if not name.startswith(prefix):
+            continue
+        try:
+            dateBT = dt.datetime.strptime(name[len(prefix):], "%y%m%d%H")
+        except ValueError:
+            continue
+        if old is not None and old.contains(dateBT):
+            continue
+        datesBT.append(dateBT)
+        files.append(os.path.join(folder, name))
+
+    # ===== parse them
+    columns = None
+    values = []
+    length = np.zeros(len(files), dtype=np.int64)
+    for i, datafile in enumerate(files):
+        names, traj = read_tdump(datafile)
+        if columns is None:
+            columns = STORE_COLUMNS + names[len(STORE_COLUMNS)+8:]
+            idx = [names.index(c) for c in columns]
+        elif names[len(STORE_COLUMNS)+8:] != columns[len(STORE_COLUMNS):]:
+            raise ValueError(
+                "{} does not have the same meteo columns as the other "
+                "back-trajectories".format(datafile)
+            )
+        values.append(traj[:, idx].astype(np.float32))
+        length[i] = len(traj)
+
+    if columns is None:
+        if old is not None:
+            return old
+        raise ValueError("No back-trajectory file found in {}".format(folder))
+    values = np.concatenate(values)
+    data = {c: values[:, i] for i, c in enumerate(columns)}
+    datesBT = pd.DatetimeIndex(datesBT).values
+    offsets = np.concatenate(([0], np.cumsum(length)))
+
+    # ===== merge with the already stored trajectories
+    if old is not None:
+        if old.columns != columns:
+            raise ValueError("The back-trajectories do not have the same "
+                             "meteo columns as the store")
+        oldDates, oldOffsets, oldData = old.read()
+        datesBT = np.concatenate((oldDates.values, datesBT))
+        length = np.concatenate((np.diff(oldOffsets), length))
+        data = {c: np.concatenate((oldData[c], data[c])) for c in columns}
+        offsets = np.concatenate(([0], np.cumsum(length)))
+        old = None
+
+    # keep the store sorted by starting date
+    order = np.argsort(datesBT, kind="stable")
+    if np.any(order != np.arange(len(order))):
+        length = np.diff(offsets)[order]
+        endpoints = np.repeat(offsets[:-1][order] - np.concatenate(
+            ([0], np.cumsum(length)[:-1])), length) + np.arange(length.sum())
+        data = {c: data[c][endpoints] for c in columns}
+        datesBT = datesBT[order]
+        offsets = np.concatenate(([0], np.cumsum(length)))
+
+    # ===== write the store
+    if not os.path.isdir(store):
+        os.makedirs(store)
+    np.save(os.path.join(store, "dateBT.npy"),
+            datesBT.astype("datetime64[s]"))
+    np.save(os.path.join(store, "offsets.npy"), offsets.astype(np.int64))
+    for c in columns:
+        np.save(os.path.join(store, c+".npy"), data[c])
+    with open(os.path.join(store, "meta.json"), "w") as f:
+        json.dump({"station": station, "columns": columns}, f, indent=4)
+
+    return TrajStore(store)
+
+
+class TrajStore:
+    """Read the back-trajectories of a store built by :func:`ingest`.
+
+    The endpoint columns are memory-mapped, so only the trajectories requested
+    are actually read from the disk.
+
+    Parameters
+    ----------
+    store : str, path
+        Path of the store.
+    """
+    def __init__(self, store):
+        self.store = store
+        with open(os.path.join(store, "meta.json"), "r") as f:
+            meta = json.load(f)
+        self.station = meta["station"]
+        self.columns = meta["columns"]
+        self.dateBT = pd.DatetimeIndex(
+            np.load(os.path.join(store, "dateBT.npy"))
+        )
+        self.offsets = np.load(os.path.join(store, "offsets.npy"))
+        self._data = {
+            c: np.load(os.path.join(store, c+".npy"), mmap_mode="r")
+            for c in self.columns
+        }
+
+    def __len__(self):
+        return len(self.dateBT)
+
+    def contains(self, dateBT):
+        """Either or not the trajectory starting at `dateBT` is stored."""
+        i = self.dateBT.searchsorted(dateBT)
+        return i < len(self.dateBT) and self.dateBT[i] == dateBT
+
+    def read(self, dateMin=None, dateMax=None, columns=None):
+        """Read all the trajectories starting between two dates.
+
+        Parameters
+        ----------
+        dateMin : str or datetime object, optional
+            The minimal starting date (included).
+        dateMax : str or datetime object, optional
+            The maximal starting date (included).
+        columns : list of str, optional
+            The endpoint columns to read. By default all of them.
+
+        Return
+        ------
+        dateBT : pd.DatetimeIndex
+            Starting date of the trajectories.
+        offsets : np.ndarray
+            Position of the first endpoint of each trajectory, plus the total
+            number of endpoints.
+        data : dict of np.ndarray
+            The endpoint columns.
+        """
+        if columns is None:
+            columns = self.columns
+        start = 0 if dateMin is None else \
+            self.dateBT.searchsorted(pd.Timestamp(dateMin), side="left")
+        end = len(self.dateBT) if dateMax is None else \
+            self.dateBT.searchsorted(pd.Timestamp(dateMax), side="right")
+        end = max(start, end)
+
+        offsets = self.offsets[start:end+1]
+        data = {
+            c: np.array(self._data[c][offsets[0]:offsets[-1]])
+            for c in columns
+        }
+        return self.dateBT[start:end], offsets - offsets[0], data
+
+    def select(self, datesBT, columns=None, nrows=None):
+        """Read the trajectories starting at the given dates.
+
+        The endpoints of the requested trajectories (up to `nrows` each) are
+        picked up directly in the memory-mapped columns, so the trajectories
+        in between are not read.
+
+        Parameters
+        ----------
+        datesBT : list of datetime
+            The starting dates of the trajectories.
+        columns : list of str, optional
+            The endpoint columns to read. By default all of them.
+        nrows : int, optional
+            Number of endpoints to keep for each trajectory.
+
+        Return
+        ------
+        found : np.ndarray of boolean
+            Either or not each date is in the store.
+        length : np.ndarray
+            Number of endpoints of each found trajectory.
+        data : dict of np.ndarray
+            The endpoint columns of the found trajectories, one after another.
+        """
+        if columns is None:
+            columns = self.columns
+        datesBT = pd.DatetimeIndex(datesBT)
+        idx = self.dateBT.searchsorted(datesBT)
+        found = idx < len(self.dateBT)
+        found[found] = self.dateBT[idx[found]] == datesBT[found]
+        idx = idx[found]
+        if len(idx) == 0:
+            return found, np.zeros(0, dtype=np.int64), \
+                {c: np.zeros(0) for c in columns}
+
+        length = np.diff(self.offsets)[idx]
+        if nrows is not None:
+            length = np.minimum(length, nrows)
+        endpoints = np.repeat(self.offsets[idx] - np.concatenate(
+            ([0], np.cumsum(length)[:-1])), length) + np.arange(length.sum())
+        data = {c: np.asarray(self._data[c][endpoints]) for c in columns}
+
+        return found, length, data
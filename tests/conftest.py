@@ -0,0 +1,26 @@
+"""Shared setup of the tests: the synthetic datasets of the benchmarks."""
+import os
+import sys
+import pytest
+import matplotlib
+matplotlib.use("Agg")
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "benchmarks"))
+from synthetic import make_dataset  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def synthetic(tmp_path_factory):
+    """Write a synthetic dataset (see :func:`synthetic.make_dataset`).
+
+    The datasets are written once per set of arguments.
+    """
+    datasets = {}
+
+    def make(**kwargs):
+        key = tuple(sorted(kwargs.items()))
+        if key not in datasets:
+            folder = tmp_path_factory.mktemp("synthetic")
+            datasets[key] = make_dataset(str(folder), **kwargs)
+        return datasets[key]
+    return make
@@ -0,0 +1,231 @@
+"""Restarted back-trajectory computations skip the complete outputs."""
+import os
+import sys
+import json
+import stat
+import time
+import pandas as pd
+import pytest
+
+import synthetic
+from synthetic import write_tdump, merge_tdump
+from pyPSCF import BackTrajHysplit
+from pyPSCF.background import Cancelled
+from pyPSCF.manifest import JobManifest, MANIFEST_NAME, DONE, FAILED
+from pyPSCF.tdump import check_tdump, split_tdump
+
+# writes the tdump of the starting points of the CONTROL file, of
+# HYSPLIT_STUB_LENGTH endpoints, and its pid in pid_<date>. The runs of the
+# dates in HYSPLIT_STUB_SLOW last a minute
+HYSPLIT_STUB = """#!{python}
+import os
+import sys
+import time
+import pandas as pd
+sys.path.insert(0, {path!r})
+from synthetic import write_tdump, merge_tdump
+
+with open("CONTROL") as f:
+    lines = f.read().splitlines()
+date = pd.to_datetime(lines[0], format="%y %m %d %H")
+with open(os.path.join("..", "pid_" + date.strftime("%y%m%d%H")), "w") as f:
+    f.write(str(os.getpid()))
+if date.strftime("%y%m%d%H") in os.environ.get("HYSPLIT_STUB_SLOW", ""):
+    time.sleep(60)
+files = []
+for i in range(int(lines[1])):
+    lat, lon, alt = map(float, lines[2+i].split())
+    files.append("traj%d" % i)
+    write_tdump(files[-1], date, lat0=lat, lon0=lon, alt=alt,
+                length=int(os.environ.get("HYSPLIT_STUB_LENGTH", 73)))
+merge_tdump(os.path.join(lines[-2], lines[-1]), files)
+"""
+
+
+@pytest.fixture
+def param(tmp_path):
+    for d in ["output", "gdas"]:
+        (tmp_path / d).mkdir()
+    param = {"lat": "45", "lon": "5", "alt": "100", "station": "STN",
+             "stepHH": "6", "hBT": "-72", "dateMin": "2017-05-01 00",
+             "dateMax": "2017-05-02 00", "dirHysplit": str(tmp_path),
+             "dirOutput": str(tmp_path / "output"),
+             "dirGDAS": str(tmp_path / "gdas")}
+    for date in pd.date_range("2017-05-01 06", "2017-05-02 00", freq="6h"):
+        write_tdump(output(param, date), date, length=73)
+    return param
+
+
+def output(param, date):
+    name = BackTrajHysplit.get_currentFile(param["station"], date)
+    return os.path.join(param["dirOutput"], name)
+
+
+def todo(tasks):
+    return [start["file"] for task in tasks for start in task["starts"]]
+
+
+def test_check_tdump(param):
+    datafile = output(param, pd.Timestamp("2017-05-01 06"))
+    assert check_tdump(datafile, hours=-72) == 73
+    with open(datafile) as f:
+        lines = f.readlines()
+    with open(datafile, "w") as f:
+        f.writelines(lines[:30])
+    assert check_tdump(datafile) == 25
+    with pytest.raises(ValueError):
+        check_tdump(datafile, hours=-72)
+
+
+def test_check_output(tmp_path):
+    date = pd.Timestamp("2017-05-01 06")
+    datafile = str(tmp_path / "tdump")
+    write_tdump(datafile, date, length=73)
+    BackTrajHysplit.check_output(datafile, -72)
+    # stopped early below the model top
+    write_tdump(datafile, date, length=25)
+    with pytest.raises(ValueError):
+        BackTrajHysplit.check_output(datafile, -72)
+    # stopped early at the model top
+    write_tdump(datafile, date, length=25, alt=9500.)
+    BackTrajHysplit.check_output(datafile, -72)
+
+
+def test_get_tasks(param, monkeypatch):
+    hashed = []
+    checksum = BackTrajHysplit.file_checksum
+    monkeypatch.setattr(BackTrajHysplit, "file_checksum",
+                        lambda path: hashed.append(path) or checksum(path))
+
+    # truncated between two endpoints
+    truncated = output(param, pd.Timestamp("2017-05-01 12"))
+    with open(truncated) as f:
+        lines = f.readlines()
+    with open(truncated, "w") as f:
+        f.writelines(lines[:30])
+    assert todo(BackTrajHysplit.get_tasks(param)) == \
+        [os.path.basename(truncated)]
+
+    # the outputs adopted are not hashed again
+    hashed.clear()
+    assert len(todo(BackTrajHysplit.get_tasks(param))) == 1
+    assert hashed == []
+
+    modified = output(param, pd.Timestamp("2017-05-01 18"))
+    with open(modified, "a") as f:
+        f.write("\n")
+    assert sorted(todo(BackTrajHysplit.get_tasks(param))) == \
+        sorted([os.path.basename(truncated), os.path.basename(modified)])
+    assert hashed == [modified]
+
+
+def test_split_tdump(tmp_path):
+    date = pd.Timestamp("2017-05-01 06")
+    files = [str(tmp_path / "traj{}".format(i)) for i in range(3)]
+    for f, alt in zip(files, [100, 500, 1000]):
+        write_tdump(f, date, alt=alt)
+    merge_tdump(str(tmp_path / "tdump"), files)
+    outfiles = [str(tmp_path / "out{}".format(i)) for i in range(3)]
+    split_tdump(str(tmp_path / "tdump"), outfiles)
+    for f, out in zip(files, outfiles):
+        with open(f) as a, open(out) as b:
+            assert a.read() == b.read()
+    with pytest.raises(ValueError):
+        split_tdump(str(tmp_path / "tdump"), outfiles[:2])
+
+
+def test_get_starts(param):
+    param["starts"] = [{"alt": 100}, {"alt": 500}, {"station": "OTHER"}]
+    assert [s["station"] for s in BackTrajHysplit.get_starts(param)] == \
+        ["STN_100m", "STN_500m", "OTHER"]
+    param["starts"] = [{"lat": 44}, {"lat": 46}]
+    with pytest.raises(ValueError):
+        BackTrajHysplit.get_starts(param)
+
+
+@pytest.fixture
+def hysplit(param):
+    """Install the HYSPLIT stub."""
+    if sys.platform == "win32":
+        pytest.skip("the HYSPLIT stub is a script")
+    hysplit = os.path.join(param["dirHysplit"], "exec", "hyts_std")
+    os.makedirs(os.path.dirname(hysplit))
+    with open(hysplit, "w") as f:
+        f.write(HYSPLIT_STUB.format(
+            python=sys.executable,
+            path=os.path.dirname(os.path.abspath(synthetic.__file__))
+        ))
+    os.chmod(hysplit, os.stat(hysplit).st_mode | stat.S_IEXEC)
+    param["setup"] = os.path.join(param["dirHysplit"], "SETUP.CFG")
+    open(param["setup"], "w").close()
+    return hysplit
+
+
+def working(param):
+    return [d for d in os.listdir(param["dirHysplit"])
+            if d.startswith("working_")]
+
+
+@pytest.mark.parametrize("length", [73, 25])
+def test_run_task(param, hysplit, monkeypatch, length):
+    monkeypatch.setenv("HYSPLIT_STUB_LENGTH", str(length))
+
+    param["starts"] = [{"alt": 100}, {"alt": 500}, {"alt": 1000}]
+    param["batchSize"] = 2
+    tasks = BackTrajHysplit.get_tasks(param)
+    # 2 runs per date
+    assert len(tasks) == 8
+    assert len(set(todo(tasks))) == 12
+    results = [r for task in tasks for r in BackTrajHysplit.run_task(task)]
+
+    state = DONE if length == 73 else FAILED
+    assert [r["state"] for r in results] == [state] * 12
+    manifest = JobManifest(os.path.join(param["dirOutput"], MANIFEST_NAME))
+    jobs = manifest.jobs()
+    for task in tasks:
+        for start in task["starts"]:
+            assert jobs[start["file"]]["state"] == state
+            assert os.path.exists(start["output"]) == (state == DONE)
+            if state == DONE:
+                with open(start["output"]) as f:
+                    lines = f.read().splitlines()
+                assert float(lines[3].split()[-1]) == start["alt"]
+    assert working(param) == []
+    assert len(BackTrajHysplit.get_tasks(param)) == (0 if state == DONE else 8)
+
+
+def test_BT_cancel(param, hysplit, monkeypatch, tmp_path):
+    fast, slow = pd.Timestamp("2017-05-01 12"), pd.Timestamp("2017-05-01 18")
+    for date in [fast, slow]:
+        os.remove(output(param, date))
+    monkeypatch.setenv("HYSPLIT_STUB_SLOW", slow.strftime("%y%m%d%H"))
+    paramFile = str(tmp_path / "param.json")
+    with open(paramFile, "w") as f:
+        json.dump(param, f)
+    pidFile = os.path.join(param["dirHysplit"],
+                           "pid_" + slow.strftime("%y%m%d%H"))
+
+    def progress(done, total):
+        if done:
+            # cancelled while the slow HYSPLIT runs
+            deadline = time.time() + 30
+            while not os.path.exists(pidFile) and time.time() < deadline:
+                time.sleep(0.1)
+            raise Cancelled()
+
+    start = time.time()
+    with pytest.raises(Cancelled):
+        BackTrajHysplit.BT(nbCPU=2, paramFile=paramFile, progress=progress)
+    assert time.time() - start < 30
+    # HYSPLIT is killed and its working directory removed
+    with open(pidFile) as f:
+        with pytest.raises(ProcessLookupError):
+            os.kill(int(f.read()), 0)
+    assert working(param) == []
+    assert not os.path.exists(output(param, slow))
+
+    jobs = JobManifest(os.path.join(param["dirOutput"], MANIFEST_NAME)).jobs()
+    assert jobs[os.path.basename(output(param, fast))]["state"] == DONE
+    assert jobs[os.path.basename(output(param, slow))]["state"] == FAILED
+    assert todo(BackTrajHysplit.get_tasks(param)) == \
+        [os.path.basename(output(param, slow))]
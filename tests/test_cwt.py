@@ -0,0 +1,36 @@
+"""The redistributed CWT converges and stays within the concentrations."""
+import warnings
+import numpy as np
+import pytest
+
+from pyPSCF.pyPSCF import PSCF
+
+
+@pytest.fixture(scope="module")
+def model(synthetic):
+    dataset = synthetic(days=365, add_hour=(0, 12), seed=2)
+    model = PSCF(specie="specie", wfunc=False, **dataset)
+    model.run()
+    return model
+
+
+@pytest.mark.parametrize("smooth", [False, True])
+def test_rcwt(model, smooth):
+    conc = model.traj_["conc"].values
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        RCWT = model.cwt(redistributed=True, smooth=smooth)
+    assert model.rcwt_iterations_ < 100
+    inside = model.ngrid_ > 0
+    assert np.all(RCWT[~inside] == 0)
+    assert RCWT[inside].min() >= conc.min() * (1 - 1e-9)
+    assert RCWT[inside].max() <= conc.max() * (1 + 1e-9)
+
+
+def test_cwt(model):
+    conc = model.traj_["conc"].values
+    CWT = model.cwt()
+    inside = model.ngrid_ > 0
+    assert np.all(CWT[~inside] == 0)
+    assert CWT[inside].min() >= conc.min() * (1 - 1e-9)
+    assert CWT[inside].max() <= conc.max() * (1 + 1e-9)
@@ -0,0 +1,103 @@
+"""The alternative ways to run a PSCF give the same results as `PSCF.run`."""
+import numpy as np
+import pandas as pd
+import pytest
+
+from pyPSCF.pyPSCF import PSCF, MultiPSCF
+from pyPSCF.trajstore import ingest
+
+
+@pytest.fixture(scope="module")
+def dataset(synthetic):
+    return synthetic(days=60, add_hour=(-6, 0, 6), species=("a", "b"), seed=1)
+
+
+def assert_same_results(model, ref):
+    np.testing.assert_allclose(model.concCrit, ref.concCrit)
+    np.testing.assert_array_equal(model.ngrid_, ref.ngrid_)
+    np.testing.assert_array_equal(model.mgrid_, ref.mgrid_)
+    np.testing.assert_allclose(model.PSCF_, ref.PSCF_)
+    np.testing.assert_allclose(model.trajdensity_, ref.trajdensity_)
+
+
+def test_run_stream(dataset):
+    ref = PSCF(specie="a", **dataset)
+    ref.run()
+    model = PSCF(specie="a", **dataset)
+    # a few samples per chunk
+    model.run_stream(max_endpoints=1000)
+    assert_same_results(model, ref)
+
+
+def test_run_stream_hourinthepast(dataset):
+    ref = PSCF(specie="a", **dict(dataset, hourinthepast=24))
+    ref.run()
+    # the full trajectories of the run are in memory, but are not used
+    model = PSCF(specie="a", cache=True, **dataset)
+    model.run()
+    model.hourinthepast = 24
+    model.run_stream(max_endpoints=1000)
+    assert_same_results(model, ref)
+
+
+def test_cache(dataset):
+    ref = PSCF(specie="a", **dataset)
+    ref.run()
+    # only the endpoints younger than hourinthepast are read by default
+    assert ref._cache is None
+    assert ref.bt.age.min() >= -ref.hourinthepast
+
+    model = PSCF(specie="a", cache=True, **dataset)
+    model.run()
+    assert len(model._cache.age) > len(ref.bt.age)
+    assert_same_results(model, ref)
+    # a second run takes the trajectories from memory
+    model.hourinthepast = 24
+    model.run()
+    short = PSCF(specie="a", **dict(dataset, hourinthepast=24))
+    short.run()
+    assert_same_results(model, short)
+
+
+def test_update(dataset, tmp_path):
+    data = pd.read_csv(dataset["concFile"], sep=";", index_col=0)
+    concFile = str(tmp_path / "conc.csv")
+    data.iloc[:40].to_csv(concFile, sep=";")
+    model = PSCF(specie="a", **dict(dataset, concFile=concFile))
+    model.run()
+
+    data.to_csv(concFile, sep=";")
+    model.update()
+
+    ref = PSCF(specie="a", **dict(dataset, concFile=concFile))
+    ref.run()
+    assert_same_results(model, ref)
+    np.testing.assert_array_equal(model.contrib_.toarray(),
+                                  ref.contrib_.toarray())
+
+
+def test_store(dataset, tmp_path):
+    store = ingest(dataset["folder"], dataset["station"],
+                   store=str(tmp_path / "store"), prefix=dataset["prefix"])
+    ref = PSCF(specie="a", **dataset)
+    ref.run()
+    model = PSCF(specie="a", store=store, **dataset)
+    model.run()
+    assert_same_results(model, ref)
+
+
+def test_multi(dataset):
+    percentiles = [50, 75, 90]
+    multi = MultiPSCF(species=["a", "b"], percentiles=percentiles, **dataset)
+    multi.run()
+    for specie in ["a", "b"]:
+        for i, percentile in enumerate(percentiles):
+            ref = PSCF(specie=specie, percentile=percentile, **dataset)
+            ref.run()
+            model = multi.select(specie, i)
+            assert_same_results(model, ref)
+            np.testing.assert_allclose(model.cwt(), ref.cwt())
+            np.testing.assert_allclose(
+                model.significance(n_resamples=50, random_state=0),
+                ref.significance(n_resamples=50, random_state=0)
+            )
@@ -0,0 +1,54 @@
+"""Saved and combined results hold the same grids as the runs."""
+import numpy as np
+import pytest
+import matplotlib.pyplot as plt
+
+from pyPSCF.pyPSCF import PSCF, CompositePSCF
+
+
+@pytest.fixture(scope="module")
+def datasets(synthetic):
+    return [synthetic(station=station, days=30, seed=seed)
+            for seed, station in enumerate(["ST1", "ST2"])]
+
+
+def test_netcdf(datasets, tmp_path):
+    model = PSCF(specie="specie", **datasets[0])
+    model.run()
+    model.cwt()
+    filename = str(tmp_path / "pscf.nc")
+    model.to_netcdf(filename)
+
+    loaded = PSCF.from_netcdf(filename, mmap=False)
+    assert set(vars(PSCF(specie="specie", **datasets[0]))) <= set(vars(loaded))
+    for name in ["ngrid_", "mgrid_", "PSCF_", "trajdensity_", "wF_", "CWT_"]:
+        np.testing.assert_allclose(getattr(loaded, name), getattr(model, name))
+    np.testing.assert_allclose(loaded.concCrit, model.concCrit)
+    assert (loaded.date == model.date).all()
+
+    # the figures are drawn again without computing anything
+    loaded.plot_PSCF()
+    loaded.plot_backtraj()
+    plt.close("all")
+
+
+def test_composite(datasets, tmp_path):
+    mapMinMax = datasets[0]["mapMinMax"]
+    models = [PSCF(specie="specie", **dict(d, mapMinMax=mapMinMax))
+              for d in datasets]
+    composite = CompositePSCF(models)
+    composite.run()
+    np.testing.assert_array_equal(composite.ngrid_,
+                                  models[0].ngrid_ + models[1].ngrid_)
+    np.testing.assert_array_equal(composite.mgrid_,
+                                  models[0].mgrid_ + models[1].mgrid_)
+    assert composite.cwt().shape == composite.grid.shape
+    composite.plot_PSCF()
+    plt.close("all")
+
+    filenames = [str(tmp_path / "{}.nc".format(m.station)) for m in models]
+    for model, filename in zip(models, filenames):
+        model.to_netcdf(filename)
+    combined = CompositePSCF([PSCF.from_netcdf(f) for f in filenames])
+    combined.combine()
+    np.testing.assert_allclose(combined.PSCF_, composite.PSCF_)
@@ -0,0 +1,70 @@
+"""Aggregation of the grids by direction and distance from the station."""
+import math
+import numpy as np
+import pytest
+
+from pyPSCF.pyPSCF import PSCF
+
+
+@pytest.fixture(scope="module")
+def model(synthetic):
+    model = PSCF(specie="specie", **synthetic(days=60, seed=5))
+    model.run()
+    return model
+
+
+def polar_loop(model):
+    """The percentage of mgrid by sector, as computed by the former
+    `plot_PSCF_polar`."""
+    deltalon = model.lon0 - model.lon
+    mesh_deltalon, mesh_lat = np.meshgrid(deltalon, model.lat)
+    mesh_deltalon = model.toRad(mesh_deltalon)
+    mesh_lat = model.toRad(mesh_lat)
+
+    a = np.sin(mesh_deltalon) * np.cos(mesh_lat)
+    b = np.cos(model.lat0*math.pi/180)*np.sin(mesh_lat) \
+        - np.sin(model.lat0*math.pi/180)*np.cos(mesh_lat)*np.cos(mesh_deltalon)
+    bearing = np.arctan2(a, b)
+    bearing += math.pi/2
+    bearing[np.where(bearing < 0)] += 2*math.pi
+    bearing = bearing.T
+
+    mPhi = list()
+    theta = model.toRad(np.arange(0, 361, 22.5))
+    mPhi.append(np.sum(model.mgrid_[np.where(bearing <= theta[1])]))
+    for i in range(1, len(theta)-1):
+        mPhi.append(np.sum(model.mgrid_[np.where((theta[i] < bearing) &
+                                                 (bearing <= theta[i+1]))]))
+    return mPhi/np.sum(model.mgrid_)*100
+
+
+def test_sectors(model):
+    sectors = model.sectors(16)
+    np.testing.assert_allclose(sectors["mgrid_percent"].values,
+                               polar_loop(model))
+    assert sectors["ngrid"].sum() == model.ngrid_.sum()
+
+
+def test_rings(model):
+    rings = [0, 500, 1000]
+    sectors = model.sectors(16, rings=rings)
+    assert len(sectors) == 32
+
+    # haversine distance of the cells to the station
+    lon = np.radians(model.lon)[:, np.newaxis]
+    lat = np.radians(model.lat)[np.newaxis, :]
+    lat0, lon0 = np.radians(model.lat0), np.radians(model.lon0)
+    h = np.sin((lat - lat0)/2)**2 \
+        + np.cos(lat0)*np.cos(lat)*np.sin((lon0 - lon)/2)**2
+    distance = 2 * 6371 * np.arcsin(np.sqrt(h))
+
+    for dmin, dmax in zip(rings[:-1], rings[1:]):
+        inside = (distance >= dmin) & (distance < dmax)
+        ring = sectors[sectors["dist_min"] == dmin]
+        np.testing.assert_allclose(ring["ngrid"].sum(),
+                                   model.ngrid_[inside].sum())
+    # the cells further than the last ring are left out
+    outside = model.ngrid_[distance >= rings[-1]].sum()
+    assert outside > 0
+    np.testing.assert_allclose(sectors["ngrid"].sum(),
+                               model.ngrid_.sum() - outside)
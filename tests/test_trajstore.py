@@ -0,0 +1,28 @@
+"""The trajectory store gives the endpoints of the files."""
+import os
+import numpy as np
+import pandas as pd
+
+from pyPSCF.tdump import read_columns
+from pyPSCF.trajstore import ingest
+
+
+def test_select(synthetic, tmp_path):
+    dataset = synthetic(days=30, add_hour=(0, 6, 12, 18), seed=6)
+    store = ingest(dataset["folder"], dataset["station"],
+                   store=str(tmp_path / "store"), prefix=dataset["prefix"])
+
+    # one trajectory a day out of four, in reverse order, and a missing one
+    datesBT = pd.date_range("2017-01-01 06", periods=20, freq="D")[::-1]
+    datesBT = datesBT.append(pd.DatetimeIndex(["2018-01-01"]))
+    found, length, data = store.select(datesBT, ["lon", "lat"], nrows=10)
+
+    assert found.tolist() == [True]*20 + [False]
+    assert (length == 10).all()
+    for i, dateBT in enumerate(datesBT[found]):
+        name = dataset["prefix"] + dateBT.strftime("%y%m%d%H")
+        endpoints = read_columns(os.path.join(dataset["folder"], name),
+                                 ["lon", "lat"], nrows=10)
+        for c in ["lon", "lat"]:
+            np.testing.assert_allclose(data[c][i*10:(i+1)*10], endpoints[c],
+                                       rtol=1e-6)
@@ -0,0 +1,61 @@
+"""The weighting functions of the PSCF."""
+import numpy as np
+import pytest
+
+from pyPSCF.pyPSCF import PSCF
+
+
+@pytest.fixture(scope="module")
+def model(synthetic):
+    model = PSCF(specie="specie", **synthetic(days=60, seed=4))
+    model.run()
+    return model
+
+
+def unweighted(model):
+    return np.divide(model.mgrid_, model.ngrid_,
+                     out=np.zeros(model.grid.shape), where=model.ngrid_ != 0)
+
+
+def test_manual(model):
+    """The default of the GUI, as weighted before `np.digitize`."""
+    model.reweight(wfunc=True, wfunc_type="manual",
+                   wFlim=[0.3, 0.6, 0.85], wFval=[0.08, 0.35, 0.725, 1.0])
+
+    trajdensity = model.trajdensity_
+    wFlim = np.array([0.3, 0.6, 0.85]) * trajdensity.max()
+    wFval = np.array([0.08, 0.35, 0.725, 1.0])
+    wF = np.zeros(np.shape(trajdensity))
+    wF[np.where(trajdensity < wFlim[0])] = wFval[0]
+    wF[np.where((trajdensity >= wFlim[0]) & (trajdensity < wFlim[1]))] = wFval[1]
+    wF[np.where((trajdensity >= wFlim[1]) & (trajdensity < wFlim[2]))] = wFval[2]
+    wF[np.where(trajdensity >= wFlim[2])] = wFval[3]
+
+    np.testing.assert_array_equal(model.wF_, wF)
+    np.testing.assert_allclose(model.PSCF_, unweighted(model) * wF)
+
+
+def test_piecewise(model):
+    model.reweight(wfunc=True, wfunc_type="piecewise", wFlim=[2, 5, 10],
+                   wFval=[0.1, 0.5, 0.8, 1])
+    ngrid = model.ngrid_
+    wF = np.select([ngrid < 2, ngrid < 5, ngrid < 10], [0.1, 0.5, 0.8], 1)
+    np.testing.assert_array_equal(model.wF_, wF)
+
+
+def test_callable(model):
+    model.reweight(wfunc=True, wfunc_type=lambda n: np.minimum(n/10, 1))
+    np.testing.assert_allclose(model.PSCF_, unweighted(model)
+                               * np.minimum(model.ngrid_/10, 1))
+
+
+def test_reweight_rollback(model):
+    model.reweight(wfunc=True, wfunc_type="auto")
+    old = (model.wfunc_type, model.wFlim, model.wFval)
+    PSCF_ = model.PSCF_.copy()
+    with pytest.raises(ValueError):
+        # decreasing limits
+        model.reweight(wfunc_type="piecewise", wFlim=[10, 5],
+                       wFval=[0.1, 0.5, 1])
+    assert (model.wfunc_type, model.wFlim, model.wFval) == old
+    np.testing.assert_array_equal(model.PSCF_, PSCF_)